@@ -1,17 +1,27 @@
+import time
+T_INICIO = time.perf_counter()
+
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.screenmanager import ScreenManager, Screen
-from kivy.uix.camera import Camera 
 from kivy.uix.image import Image
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
 from kivy.utils import platform
 from kivy.core.window import Window
-from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ListProperty
+from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ListProperty, OptionProperty, ObjectProperty
 from kivy.metrics import dp, sp
 from kivy.factory import Factory 
 from kivy.uix.popup import Popup
 from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.textinput import TextInput
+from kivy.uix.widget import Widget
+from kivy.graphics import Color, Rectangle, Line, Ellipse, RenderContext, BindTexture
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.graphics.texture import Texture
+from kivy.core.image import Image as CoreImage
+from kivy.resources import resource_find
+from kivy.event import EventDispatcher
 
 # --- IMPORTACIONES VITALES ---
 if platform == 'android':
@@ -26,106 +36,3400 @@ else:
     Window.size = (400, 750)
 
 import os
-import time
+import sys
 import csv
+import json
+import sqlite3
+import zipfile
+import hashlib
+import shutil
+import filecmp
+import atexit
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import importlib.util
+import types
+import glob
+import tempfile
+import itertools
+import functools
+import math
+import re
+import socket
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.request import pathname2url
+
+# --- PERFIL DE ARRANQUE ---
+# CIMACAM_PERFIL=1 imprime los tiempos y cierra la app tras el primer frame
+# (en escritorio sin pantalla: SDL_VIDEODRIVER=offscreen)
+class PerfilArranque:
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marcas = OrderedDict()
+        self.duraciones = OrderedDict()
+
+    def marcar(self, nombre):
+        if nombre not in self.marcas:
+            self.marcas[nombre] = (time.perf_counter() - self.t0) * 1000
+
+    @contextmanager
+    def medir(self, nombre):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.duraciones[nombre] = self.duraciones.get(nombre, 0) + (time.perf_counter() - t) * 1000
+
+    def reporte(self):
+        return {'marcas_ms': dict(self.marcas), 'duraciones_ms': dict(self.duraciones)}
+
+    def imprimir(self):
+        for nombre, ms in self.marcas.items():
+            print(f"[Arranque] {nombre}: {ms:.1f} ms desde el inicio")
+        for nombre, ms in self.duraciones.items():
+            print(f"[Arranque] {nombre}: {ms:.1f} ms")
+        print(json.dumps(self.reporte()))
+
+PERFIL = PerfilArranque(T_INICIO)
+
+# --- TRAZAS DEL CAMINO CRÍTICO (HUD / CHROME TRACE) ---
+# CIMACAM_TRAZA=1 las activa desde el arranque; si no, se activan con el HUD.
+# Desactivadas cuestan una lectura de atributo por llamada.
+class _TramoNulo:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_TRAMO_NULO = _TramoNulo()
+
+class _Tramo:
+    __slots__ = ('trazador', 'nombre', 'args', 't0')
+
+    def __init__(self, trazador, nombre, args):
+        self.trazador = trazador
+        self.nombre = nombre
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trazador.registrar(self.nombre, self.t0, time.perf_counter() - self.t0, self.args)
+        return False
+
+class Trazador:
+    # Buffer circular preasignado, sin candados: next() sobre itertools.count
+    # y la asignación a una posición de la lista son atómicos con el GIL.
+    # Al llenarse se pisan los eventos más viejos.
+    def __init__(self, capacidad=16384):
+        self.activo = bool(os.environ.get('CIMACAM_TRAZA'))
+        self.capacidad = capacidad
+        self._eventos = [None] * capacidad
+        self._secuencia = itertools.count()
+
+    def tramo(self, nombre, **args):
+        if not self.activo:
+            return _TRAMO_NULO
+        return _Tramo(self, nombre, args or None)
+
+    def registrar(self, nombre, inicio, duracion, args=None):
+        # (secuencia, nombre, inicio, duración, hilo, args); duración None = contador
+        i = next(self._secuencia)
+        self._eventos[i % self.capacidad] = (i, nombre, inicio, duracion, threading.get_ident(), args)
+
+    def contador(self, nombre, **valores):
+        if self.activo:
+            self.registrar(nombre, time.perf_counter(), None, valores)
+
+    def eventos(self, desde=-1):
+        evs = [e for e in list(self._eventos) if e is not None and e[0] > desde]
+        evs.sort()
+        return evs
+
+    def recientes(self, nombre, segundos):
+        limite = time.perf_counter() - segundos
+        return [e for e in self.eventos() if e[1] == nombre and e[2] >= limite and e[3] is not None]
+
+    def exportar(self, ruta):
+        # Formato Chrome trace (chrome://tracing, Perfetto): tiempos en µs
+        pid = os.getpid()
+        hilos = {t.ident: t.name for t in threading.enumerate()}
+        salida = []
+        vistos = set()
+        for _, nombre, inicio, duracion, hilo, args in self.eventos():
+            ts = (inicio - T_INICIO) * 1e6
+            if duracion is None:
+                salida.append({'name': nombre, 'ph': 'C', 'ts': ts, 'pid': pid, 'args': args or {}})
+                continue
+            evento = {'name': nombre, 'cat': 'cimacam', 'ph': 'X', 'ts': ts,
+                      'dur': duracion * 1e6, 'pid': pid, 'tid': hilo}
+            if args:
+                evento['args'] = args
+            salida.append(evento)
+            vistos.add(hilo)
+        for hilo in vistos:
+            salida.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': hilo,
+                           'args': {'name': hilos.get(hilo, str(hilo))}})
+        tmp = ruta + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': salida, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp, ruta)
+        return len(salida)
+
+TRAZA = Trazador()
+
+def trazado(nombre):
+    # Decorador para métodos del camino crítico (sirve con returns tempranos)
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            if not TRAZA.activo:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                TRAZA.registrar(nombre, t0, time.perf_counter() - t0)
+        return envoltura
+    return decorador
+
+def resumen_cuadros(tramos):
+    # Intervalo y costo por cuadro a partir de los tramos 'cuadro'; un hueco
+    # mayor a 1.5 intervalos típicos cuenta los cuadros que faltaron
+    if len(tramos) < 3:
+        return None
+    inicios = [e[2] for e in tramos]
+    intervalos = sorted(b - a for a, b in zip(inicios, inicios[1:]))
+    tipico = intervalos[len(intervalos) // 2]
+    perdidos = 0
+    if tipico > 0:
+        perdidos = sum(int(round(d / tipico)) - 1 for d in intervalos if d > 1.5 * tipico)
+    costos = sorted(e[3] for e in tramos)
+    return {'intervalo_ms': tipico * 1000,
+            'fps': 1 / tipico if tipico > 0 else 0,
+            'costo_ms': sum(costos) / len(costos) * 1000,
+            'costo_p95_ms': costos[min(len(costos) - 1, int(len(costos) * 0.95))] * 1000,
+            'perdidos': perdidos}
+if os.environ.get('CIMACAM_BENCH'):
+    os.environ.setdefault('CIMACAM_CAMARA', 'sintetica')
+
+_CANDADO_IMPORTS = threading.RLock()
+_CARGANDO = set()
+
+class _ModuloDiferido(types.ModuleType):
+    # Como importlib.util.LazyLoader, pero la carga queda bajo un candado:
+    # el sondeo de cámaras y los workers pueden tocar cv2 al mismo tiempo y
+    # ningún hilo debe ver el módulo a medio inicializar.
+    def __getattribute__(self, attr):
+        with _CANDADO_IMPORTS:
+            if object.__getattribute__(self, '__class__') is _ModuloDiferido and id(self) not in _CARGANDO:
+                _CARGANDO.add(id(self))
+                try:
+                    spec = object.__getattribute__(self, '__spec__')
+                    spec.loader.exec_module(self)
+                    self.__class__ = types.ModuleType
+                finally:
+                    _CARGANDO.discard(id(self))
+        return types.ModuleType.__getattribute__(self, attr)
+
+def importacion_diferida(nombre):
+    # El módulo se importa de verdad recién al usar un atributo
+    if nombre in sys.modules:
+        return sys.modules[nombre]
+    spec = importlib.util.find_spec(nombre)
+    if spec is None:
+        return None
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo
+    modulo.__class__ = _ModuloDiferido
+    return modulo
+
+# numpy/cv2 vienen en requirements (buildozer); se cargan al primer uso
+# (pantalla de cámara). Si faltan en escritorio se vuelve al guardado PNG
+# sincrónico de Kivy.
+np = importacion_diferida('numpy')
+cv2 = importacion_diferida('cv2')
+if np is None or cv2 is None:
+    np = None
+    cv2 = None
+
+PERFIL.marcar('imports')
+
+# --- PIPELINE DE CAPTURA EN SEGUNDO PLANO ---
+# El hilo de la UI solo copia los píxeles del cuadro; la compresión y la
+# escritura a disco ocurren en un pool acotado de hilos.
+FORMATOS_FOTO = {
+    'jpg': lambda q: [cv2.IMWRITE_JPEG_QUALITY, int(q)],
+    'webp': lambda q: [cv2.IMWRITE_WEBP_QUALITY, int(q)],
+    'png': lambda q: [cv2.IMWRITE_PNG_COMPRESSION, 3],
+}
+
+def pixeles_a_bgr(pixels, size, colorfmt='rgba', invertir_y=True, rotacion=0):
+    w, h = size
+    if colorfmt == 'nv21':
+        # Buffer crudo del preview de Android: plano Y + VU entrelazado
+        yuv = np.frombuffer(pixels, dtype=np.uint8).reshape(h * 3 // 2, w)
+        frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_NV21)
+    else:
+        frame = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, len(colorfmt))
+        if invertir_y:
+            # Las texturas GL tienen el origen abajo a la izquierda
+            frame = frame[::-1]
+        if colorfmt == 'rgba':
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        elif colorfmt == 'rgb':
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        else:
+            frame = np.ascontiguousarray(frame)
+    return rotar_frame(frame, rotacion)
+
+def rotar_frame(frame, grados):
+    # Misma convención que el Rotate del canvas (antihorario)
+    giro = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180,
+            270: cv2.ROTATE_90_CLOCKWISE}.get(int(grados) % 360)
+    return frame if giro is None else cv2.rotate(frame, giro)
+
+def escribir_imagen(filename, frame, formato='jpg', calidad=90):
+    ok, buf = cv2.imencode(f'.{formato}', frame, FORMATOS_FOTO[formato](calidad))
+    if not ok:
+        raise IOError(f"No se pudo codificar {formato}")
+    # Escritura atómica: nunca queda un archivo a medio escribir
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, filename)
+
+# Nombres asignados a fotos que todavía están en la cola del pipeline
+NOMBRES_EN_COLA = set()
+
+def nombre_unico(save_dir, prefix, tipo, ext):
+    # HHMMSS como siempre; si ya existe (o está en cola) se agrega _1, _2...
+    base = f"{prefix}_{tipo}_{datetime.now().strftime('%H%M%S')}"
+    filename = f"{save_dir}/{base}.{ext}"
+    n = 0
+    while filename in NOMBRES_EN_COLA or os.path.exists(filename):
+        n += 1
+        filename = f"{save_dir}/{base}_{n}.{ext}"
+    NOMBRES_EN_COLA.add(filename)
+    return filename
+
+# --- NITIDEZ (VARIANZA DEL LAPLACIANO) ---
+def luma_reducida(pixels, size, colorfmt, invertir_y=False, paso=4):
+    # Plano de luminancia submuestreado por saltos, sin convertir el cuadro entero
+    w, h = size
+    if colorfmt == 'nv21':
+        y = np.frombuffer(pixels, dtype=np.uint8)[:w * h].reshape(h, w)
+        return y[::paso, ::paso].astype(np.float32)
+    frame = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, len(colorfmt))[::paso, ::paso]
+    if invertir_y:
+        frame = frame[::-1]
+    pesos = {'bgr': (0.114, 0.587, 0.299), 'rgb': (0.299, 0.587, 0.114),
+             'rgba': (0.299, 0.587, 0.114, 0.0)}.get(colorfmt)
+    if pesos is None:
+        return frame[..., 0].astype(np.float32)
+    return frame.astype(np.float32) @ np.array(pesos, dtype=np.float32)
+
+def varianza_laplaciano(luma):
+    # Laplaciano de 4 vecinos sobre todo el plano a la vez
+    lap = (luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:]
+           - 4.0 * luma[1:-1, 1:-1])
+    return float(lap.var())
+
+def nitidez_cuadro(cuadro):
+    # El paso sigue a la resolución: preview y foto completa se miden igual
+    paso = max(2, int(round(4 * max(cuadro[1]) / 1920)))
+    return varianza_laplaciano(luma_reducida(*cuadro, paso=paso))
+
+def decodificar_still(cuadro):
+    # Las fotos del sensor llegan en JPEG; el resto del pipeline trabaja en BGR
+    pixels, size, colorfmt, invertir_y = cuadro
+    if colorfmt != 'jpeg':
+        return cuadro
+    frame = cv2.imdecode(np.frombuffer(pixels, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise IOError("Foto del sensor ilegible")
+    return frame, (frame.shape[1], frame.shape[0]), 'bgr', False
+
+# --- HASH PERCEPTUAL (FOTOS REPETIDAS) ---
+def hash_perceptual(luma):
+    # pHash de 64 bits: DCT de 32x32 y los 8x8 de baja frecuencia contra su mediana
+    reducida = cv2.resize(np.ascontiguousarray(luma, dtype=np.float32), (32, 32), interpolation=cv2.INTER_AREA)
+    bajas = cv2.dct(reducida)[:8, :8].ravel()
+    return int(np.packbits(bajas > np.median(bajas[1:])).view('>u8')[0])
+
+def hash_cuadro(cuadro):
+    return hash_perceptual(luma_reducida(*cuadro))
+
+def distancia_hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class IndiceHashes:
+    # Multi-index hashing: el hash se parte en 4 trozos de 16 bits. Si dos hashes
+    # difieren en <= radio bits, algún trozo difiere en <= radio // 4 (palomar):
+    # alcanza con mirar en cada tabla ese trozo y sus vecinos y verificar.
+    TROZOS = 4
+    BITS = 16
+
+    def __init__(self, radio=6):
+        self.radio = radio
+        self.tablas = [{} for _ in range(self.TROZOS)]
+        self.hashes = {}
+        self._vueltas = [0] + [sum(1 << b for b in bits)
+                               for k in range(1, radio // self.TROZOS + 1)
+                               for bits in itertools.combinations(range(self.BITS), k)]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _trozos(self, h):
+        mascara = (1 << self.BITS) - 1
+        return [(h >> (i * self.BITS)) & mascara for i in range(self.TROZOS)]
+
+    def agregar(self, clave, h, dato=None):
+        self.hashes[clave] = (h, dato)
+        for tabla, trozo in zip(self.tablas, self._trozos(h)):
+            tabla.setdefault(trozo, set()).add(clave)
+
+    def quitar(self, clave):
+        h, _ = self.hashes.pop(clave)
+        for tabla, trozo in zip(self.tablas, self._trozos(h)):
+            tabla[trozo].discard(clave)
+            if not tabla[trozo]:
+                del tabla[trozo]
+
+    def buscar(self, h):
+        # [(distancia, clave, dato)] de los hashes a <= radio bits, más cercanos primero
+        candidatos = set()
+        for tabla, trozo in zip(self.tablas, self._trozos(h)):
+            for vuelta in self._vueltas:
+                candidatos.update(tabla.get(trozo ^ vuelta, ()))
+        encontrados = []
+        for clave in candidatos:
+            otro, dato = self.hashes[clave]
+            d = distancia_hamming(h, otro)
+            if d <= self.radio:
+                encontrados.append((d, clave, dato))
+        return sorted(encontrados, key=lambda e: e[0])
+
+# --- ETIQUETAS DE EQUIPOS (QR / CÓDIGO DE BARRAS) ---
+def luma_roi(pixels, size, colorfmt, invertir_y=False, fraccion=0.6):
+    # Recorta el centro del cuadro antes de convertir: solo se toca la zona de la etiqueta
+    w, h = size
+    rw, rh = int(w * fraccion), int(h * fraccion)
+    x0, y0 = (w - rw) // 2, (h - rh) // 2
+    if colorfmt == 'nv21':
+        y = np.frombuffer(pixels, dtype=np.uint8)[:w * h].reshape(h, w)
+        return np.ascontiguousarray(y[y0:y0 + rh, x0:x0 + rw])
+    frame = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, len(colorfmt))[y0:y0 + rh, x0:x0 + rw]
+    if invertir_y:
+        # Invertido el código queda espejado y no se lee
+        frame = frame[::-1]
+    conversion = {'bgr': cv2.COLOR_BGR2GRAY, 'rgb': cv2.COLOR_RGB2GRAY, 'rgba': cv2.COLOR_RGBA2GRAY}.get(colorfmt)
+    if conversion is None:
+        return np.ascontiguousarray(frame[..., 0])
+    return cv2.cvtColor(np.ascontiguousarray(frame), conversion)
+
+class LectorEtiquetas:
+    # Los detectores de OpenCV no son thread-safe: una instancia por hilo de análisis
+    def __init__(self, fraccion=0.6):
+        self.fraccion = fraccion
+        self.qr = cv2.QRCodeDetector()
+        barcode = getattr(cv2, 'barcode', None)
+        self.barras = barcode.BarcodeDetector() if barcode is not None else None
+
+    def __call__(self, cuadro):
+        gris = luma_roi(*cuadro, fraccion=self.fraccion)
+        texto = self.qr.detectAndDecode(gris)[0]
+        if not texto and self.barras is not None:
+            resultado = self.barras.detectAndDecode(gris)
+            # OpenCV 4.x devuelve (ok, textos, tipos, puntos); 4.8+ (texto, puntos, ...)
+            if isinstance(resultado[0], bool):
+                texto = next((t for t in resultado[1] if t), '') if resultado[0] else ''
+            else:
+                texto = resultado[0]
+        return texto.strip() or None
+
+# --- ILUMINACIÓN: LUX ESTIMADOS DESDE EL PREVIEW ---
+class CalibracionLux:
+    # Tabla por dispositivo: luma media (0-255, exposición bloqueada) -> lux.
+    # Se ajusta comparando con un luxómetro patrón (agregar_punto).
+    TABLA_POR_DEFECTO = [[0, 0], [16, 20], [48, 100], [96, 300], [160, 750], [220, 1500], [255, 2500]]
+
+    def __init__(self, carpeta, modelo):
+        self.ruta = os.path.join(carpeta, f"calibracion_lux_{re.sub(r'[^A-Za-z0-9_-]', '_', modelo)}.json")
+        self.tabla = self.TABLA_POR_DEFECTO
+        if os.path.exists(self.ruta):
+            with open(self.ruta, encoding='utf-8') as f:
+                self.tabla = json.load(f)['tabla']
+        self._actualizar()
+
+    def _actualizar(self):
+        self.tabla = sorted(self.tabla)
+        # Una sola asignación: el hilo del medidor lee la tabla mientras se calibra
+        self._xy = (np.array([p[0] for p in self.tabla], dtype=np.float32),
+                    np.array([p[1] for p in self.tabla], dtype=np.float32))
+
+    def lux(self, luma_media):
+        x, y = self._xy
+        return float(np.interp(luma_media, x, y))
+
+    def agregar_punto(self, luma_media, lux_real):
+        # Se descartan los puntos que contradicen la medición (la curva debe crecer)
+        self.tabla = [p for p in self.tabla if abs(p[0] - luma_media) > 2
+                      and (p[0] < luma_media) == (p[1] < lux_real)] + [[luma_media, lux_real]]
+        self._actualizar()
+        with open(self.ruta, 'w', encoding='utf-8') as f:
+            json.dump({'tabla': self.tabla}, f)
+
+def medir_luz(cuadro, calibracion, bins=32):
+    # Cuadro submuestreado x8: luma media -> lux, más el histograma normalizado
+    luma = luma_reducida(*cuadro, paso=8)
+    media = float(luma.mean())
+    hist = np.bincount((luma.astype(np.uint8) >> 3).ravel(), minlength=bins).astype(np.float32)
+    return {'luma': media, 'lux': calibracion.lux(media), 'histograma': (hist / max(hist.max(), 1)).tolist()}
+
+def escribir_metadatos(filename, **campos):
+    # Metadatos de la foto en un .json al lado del archivo (se fusionan)
+    ruta = filename + '.json'
+    datos = {}
+    if os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as f:
+            datos = json.load(f)
+    datos.update(campos)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    return datos
+
+class AnalizadorEnVivo:
+    # Analiza cuadros del preview en un hilo propio, como mucho cada
+    # `intervalo` segundos; si el hilo sigue ocupado el cuadro se descarta
+    def __init__(self, fn, on_resultado, intervalo=0.5, nombre='analisis'):
+        self.fn = fn
+        self.on_resultado = on_resultado
+        self.intervalo = intervalo
+        self.nombre = nombre
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=nombre)
+        self._ocupado = False
+        self._ultimo = 0.0
+        # Cuadros que llegaron con el hilo todavía ocupado (para el HUD)
+        self.descartados = 0
+
+    def ofrecer(self, cuadro):
+        ahora = time.monotonic()
+        if ahora - self._ultimo < self.intervalo:
+            return False
+        if self._ocupado:
+            self.descartados += 1
+            return False
+        self._ocupado = True
+        self._ultimo = ahora
+        self._pool.submit(self._analizar, cuadro).add_done_callback(self._terminado)
+        return True
+
+    def _analizar(self, cuadro):
+        with TRAZA.tramo(f'analisis {self.nombre}'):
+            return self.fn(cuadro)
+
+    def _terminado(self, fut):
+        self._ocupado = False
+        if fut.exception() is not None:
+            print(f"Error Análisis: {fut.exception()}")
+        else:
+            mainthread(self.on_resultado)(fut.result())
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False)
+
+# --- BUFFER CIRCULAR DE CUADROS (ZERO SHUTTER LAG) ---
+class RingBufferCuadros:
+    def __init__(self, capacidad):
+        self.capacidad = max(1, int(capacidad))
+        self._datos = None
+        self._formato = None
+        self.escritos = 0
+
+    def agregar(self, pixels, size, colorfmt, invertir_y):
+        buf = np.frombuffer(pixels, dtype=np.uint8)
+        formato = (tuple(size), colorfmt, invertir_y, buf.size)
+        if self._formato != formato:
+            # Se preasigna una sola vez por resolución/formato
+            self._datos = np.empty((self.capacidad, buf.size), dtype=np.uint8)
+            self._formato = formato
+            self.escritos = 0
+        self._datos[self.escritos % self.capacidad] = buf
+        self.escritos += 1
+
+    def ultimos(self, n=1):
+        # Copias de los últimos n cuadros, del más viejo al más nuevo
+        n = min(n, self.escritos, self.capacidad)
+        size, colorfmt, invertir_y, _ = self._formato
+        indices = [(self.escritos - n + i) % self.capacidad for i in range(n)]
+        return [(self._datos[i].copy(), size, colorfmt, invertir_y) for i in indices]
+
+class CapturePipeline:
+    def __init__(self, max_workers=2, max_pendientes=6):
+        self.max_pendientes = max_pendientes
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='captura')
+        # Cola acotada: si los encoders no dan abasto la foto se rechaza
+        # (la UI nunca se bloquea esperando un cupo)
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+        self._candado = threading.Lock()
+        self.pendientes = 0
+        # Resultados listos cuyo callback todavía no corrió en el hilo de la UI
+        self._sin_entregar = {}
+
+    def submit(self, trabajo, on_done=None, on_error=None):
+        # None si la cola está llena
+        if not self._cupos.acquire(blocking=False):
+            return None
+        with self._candado:
+            self.pendientes += 1
+        encolado = time.perf_counter()
+
+        def ejecutar():
+            if TRAZA.activo:
+                TRAZA.registrar('captura en cola', encolado, time.perf_counter() - encolado)
+            with TRAZA.tramo('captura'):
+                return trabajo()
+        try:
+            fut = self._pool.submit(ejecutar)
+        except Exception:
+            # Pool cerrado: el cupo no lo va a liberar ningún trabajo
+            with self._candado:
+                self.pendientes -= 1
+            self._cupos.release()
+            raise
+        fut.add_done_callback(lambda f: self._terminado(f, on_done, on_error))
+        return fut
+
+    def lleno(self):
+        with self._candado:
+            return self.pendientes >= self.max_pendientes
+
+    def _terminado(self, fut, on_done, on_error):
+        with self._candado:
+            self.pendientes -= 1
+        self._cupos.release()
+        error = fut.exception()
+        if error is not None:
+            print(f"Error Captura: {error}")
+            callback, valor = on_error, error
+        else:
+            callback, valor = on_done, fut.result()
+        if callback:
+            with self._candado:
+                self._sin_entregar[fut] = (callback, valor)
+            mainthread(self._entregar)(fut)
+
+    def _entregar(self, fut):
+        with self._candado:
+            pendiente = self._sin_entregar.pop(fut, None)
+        if pendiente is not None:
+            callback, valor = pendiente
+            callback(valor)
+
+    def cerrar(self, entregar=False):
+        self._pool.shutdown(wait=True)
+        if entregar:
+            # Al salir de la app el Clock ya no corre: lo que quedó sin
+            # entregar (fotos escritas pero no registradas) se entrega acá
+            for fut in list(self._sin_entregar):
+                self._entregar(fut)
+
+# --- GRABACIÓN DE VIDEO EN LA APP (COLA ACOTADA, SEGMENTOS) ---
+def bajar_prioridad_hilo(nice=19):
+    # Linux/Android: la prioridad es por hilo; la UI siempre gana la CPU
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+class GrabadorVideo:
+    # Los cuadros del preview entran a una cola acotada (si el encoder se
+    # atrasa se descarta el más viejo) y un hilo los codifica a fps constante
+    # en archivos de `segmento_s` segundos: un cierre forzado pierde como
+    # mucho el segmento en curso. En pausa no entra ningún cuadro y el
+    # tiempo pausado no cuenta.
+    FORMATOS = (('mp4v', 'mp4'), ('MJPG', 'avi'))
+
+    def __init__(self, carpeta, prefijo, fps=30, segmento_s=120, lado_max=1280, max_cola=8,
+                 rotacion=0, on_segmento=None, on_fin=None):
+        self.carpeta = carpeta
+        self.prefijo = prefijo
+        self.fps = fps
+        self.segmento_s = segmento_s
+        self.lado_max = lado_max
+        self.rotacion = rotacion
+        self.on_segmento = on_segmento
+        self.on_fin = on_fin
+        self._cola = deque(maxlen=max_cola)
+        self._hay_cuadro = threading.Condition()
+        self._hilo = None
+        self.activo = False
+        self.pausado = False
+        self.descartados = 0
+        self.segmentos = []
+        self.entregados = 0
+        self._t0 = 0.0
+        self._pausas = 0.0
+        self._t_pausa = None
+
+    def iniciar(self):
+        self.activo = True
+        self._t0 = time.perf_counter()
+        self._hilo = threading.Thread(target=self._bucle, name='video', daemon=True)
+        self._hilo.start()
+
+    def tiempo(self):
+        # Segundos grabados, sin contar las pausas
+        ahora = self._t_pausa if self.pausado else time.perf_counter()
+        return ahora - self._t0 - self._pausas
+
+    def pausar(self):
+        if not self.pausado:
+            self._t_pausa = time.perf_counter()
+            self.pausado = True
+
+    def reanudar(self):
+        if self.pausado:
+            self._pausas += time.perf_counter() - self._t_pausa
+            self.pausado = False
+
+    def agregar(self, cuadro):
+        # Hilo de la UI: solo una copia del buffer (el proveedor lo reutiliza)
+        if not self.activo or self.pausado:
+            return
+        pixels, size, colorfmt, invertir_y = cuadro
+        copia = np.frombuffer(pixels, dtype=np.uint8).copy()
+        with self._hay_cuadro:
+            if len(self._cola) == self._cola.maxlen:
+                self.descartados += 1
+            self._cola.append((self.tiempo(), (copia, size, colorfmt, invertir_y)))
+            self._hay_cuadro.notify()
+
+    def detener(self, esperar=False):
+        # Los cuadros ya encolados se codifican antes de cerrar el archivo
+        with self._hay_cuadro:
+            self.activo = False
+            self._hay_cuadro.notify()
+        if esperar and self._hilo is not None:
+            self._hilo.join()
+
+    def entregar(self):
+        # En el hilo de la UI: avisa los segmentos cerrados que falten
+        while self.entregados < len(self.segmentos):
+            meta = self.segmentos[self.entregados]
+            self.entregados += 1
+            if self.on_segmento:
+                self.on_segmento(meta)
+
+    def _abrir(self, tamano):
+        for fourcc, ext in self.FORMATOS:
+            ruta = nombre_unico(self.carpeta, self.prefijo, 'Video', ext)
+            escritor = cv2.VideoWriter(ruta, cv2.VideoWriter_fourcc(*fourcc), self.fps, tamano)
+            if escritor.isOpened():
+                return escritor, ruta
+            escritor.release()
+            NOMBRES_EN_COLA.discard(ruta)
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        raise IOError("No hay encoder de video disponible")
+
+    def _preparar(self, cuadro, tamano):
+        frame = pixeles_a_bgr(*cuadro, rotacion=self.rotacion)
+        if tamano is None:
+            h, w = frame.shape[:2]
+            escala = min(1.0, self.lado_max / max(h, w))
+            # Los encoders piden lados pares
+            tamano = (int(w * escala) // 2 * 2, int(h * escala) // 2 * 2)
+        if (frame.shape[1], frame.shape[0]) != tamano:
+            # Un cambio de lente no cambia el tamaño del video ya empezado
+            frame = cv2.resize(frame, tamano, interpolation=cv2.INTER_LINEAR)
+        return frame, tamano
+
+    def _cerrar(self, escritor, ruta, escritos, primero):
+        escritor.release()
+        NOMBRES_EN_COLA.discard(ruta)
+        meta = escribir_metadatos(ruta, archivo=ruta, video=True, fps=self.fps, cuadros=escritos,
+                                  duracion=round(escritos / self.fps, 2), descartados=self.descartados,
+                                  bytes=os.path.getsize(ruta), miniatura=generar_miniatura(ruta, primero))
+        self.segmentos.append(meta)
+        mainthread(self.entregar)()
+
+    def _bucle(self):
+        escritor = ruta = primero = tamano = None
+        segmento = escritos = 0
+        error = None
+        # Si el encoder no da abasto se descartan cuadros, no se frena el preview
+        bajar_prioridad_hilo(10)
+        try:
+            while True:
+                with self._hay_cuadro:
+                    while self.activo and not self._cola:
+                        self._hay_cuadro.wait()
+                    if not self._cola:
+                        break
+                    t, cuadro = self._cola.popleft()
+                with TRAZA.tramo('video cuadro'):
+                    frame, tamano = self._preparar(cuadro, tamano)
+                    if escritor is not None and int(t // self.segmento_s) != segmento:
+                        self._cerrar(escritor, ruta, escritos, primero)
+                        escritor = None
+                    if escritor is None:
+                        segmento = int(t // self.segmento_s)
+                        escritor, ruta = self._abrir(tamano)
+                        primero, escritos = frame, 0
+                    # fps constante: si el preview viene más lento (o se
+                    # descartaron cuadros) se repite el último
+                    objetivo = int((t - segmento * self.segmento_s) * self.fps) + 1
+                    for _ in range(max(0, min(objetivo - escritos, self.fps))):
+                        escritor.write(frame)
+                        escritos += 1
+        except Exception as e:
+            print(f"Error Video: {e}")
+            error = e
+            self.activo = False
+        finally:
+            if escritor is not None:
+                try:
+                    self._cerrar(escritor, ruta, escritos, primero)
+                except Exception as e:
+                    error = error or e
+            if self.on_fin:
+                mainthread(self.on_fin)(error)
+
+# --- MINIATURAS: CACHÉ EN DISCO + LRU EN MEMORIA ---
+LADO_MINIATURA = 256
+
+def ruta_miniatura(filename):
+    carpeta, nombre = os.path.split(filename)
+    return os.path.join(carpeta, '.miniaturas', nombre + '.jpg')
+
+def generar_miniatura(filename, frame=None):
+    # Si el cuadro ya está en memoria (recién capturado) no se decodifica nada
+    if frame is None:
+        frame = cv2.imread(filename, cv2.IMREAD_REDUCED_COLOR_4)
+        if frame is None:
+            raise IOError(f"No se pudo leer {filename}")
+    h, w = frame.shape[:2]
+    escala = LADO_MINIATURA / max(h, w)
+    if escala < 1:
+        frame = cv2.resize(frame, (max(1, int(w * escala)), max(1, int(h * escala))),
+                           interpolation=cv2.INTER_AREA)
+    destino = ruta_miniatura(filename)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    escribir_imagen(destino, frame, 'jpg', 80)
+    return destino
+
+class ThumbnailCache:
+    def __init__(self, max_bytes=24 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self._texturas = OrderedDict()
+        self._esperando = {}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='miniaturas')
+
+    def pedir(self, filename, callback):
+        # callback(filename, texture) siempre en el hilo de la UI
+        textura = self._texturas.get(filename)
+        if textura is not None:
+            self._texturas.move_to_end(filename)
+            callback(filename, textura)
+            return
+        if filename in self._esperando:
+            self._esperando[filename].append(callback)
+            return
+        self._esperando[filename] = [callback]
+        fut = self._pool.submit(self._decodificar, filename)
+        fut.add_done_callback(lambda f: mainthread(self._decodificada)(filename, f))
+
+    def _decodificar(self, filename):
+        miniatura = ruta_miniatura(filename)
+        if not os.path.exists(miniatura):
+            # Fotos viejas: la miniatura se genera la primera vez que se ve
+            generar_miniatura(filename)
+        frame = cv2.imread(miniatura)
+        return cv2.cvtColor(frame[::-1], cv2.COLOR_BGR2RGB)
+
+    def _decodificada(self, filename, fut):
+        callbacks = self._esperando.pop(filename, [])
+        if fut.exception() is not None:
+            print(f"Error Miniatura: {fut.exception()}")
+            return
+        rgb = fut.result()
+        h, w = rgb.shape[:2]
+        textura = Texture.create(size=(w, h), colorfmt='rgb')
+        textura.blit_buffer(rgb.tobytes(), colorfmt='rgb', bufferfmt='ubyte')
+        self._texturas[filename] = textura
+        self.bytes_usados += w * h * 3
+        while self.bytes_usados > self.max_bytes and len(self._texturas) > 1:
+            _, vieja = self._texturas.popitem(last=False)
+            self.bytes_usados -= vieja.width * vieja.height * 3
+        for callback in callbacks:
+            callback(filename, textura)
+
+    def olvidar(self, filename):
+        textura = self._texturas.pop(filename, None)
+        if textura is not None:
+            self.bytes_usados -= textura.width * textura.height * 3
+
+# --- ALMACÉN SQLITE DEL PROYECTO ---
+ENCABEZADOS_EXTINTORES = ["Fecha", "Sector", "Foto", "Marca", "Tipo", "Capacidad", "N_Fab", "Venc_Carga", "Venc_PH", "Empresa", "Codigo"]
+# Campos del extintor que se copian del relevamiento anterior al leer su etiqueta
+CAMPOS_EXTINTOR = ('marca', 'tipo', 'capacidad', 'n_fab', 'venc_carga', 'venc_ph', 'empresa_mant')
+
+ESQUEMA_PROYECTO = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY, empresa TEXT, fecha TEXT);
+CREATE TABLE IF NOT EXISTS sectors (
+    id INTEGER PRIMARY KEY, session_id INTEGER REFERENCES sessions(id),
+    medicion TEXT, nombre TEXT, carpeta TEXT, fecha TEXT);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY, sector_id INTEGER REFERENCES sectors(id),
+    archivo TEXT, fecha TEXT, nitidez REAL, meta TEXT);
+CREATE TABLE IF NOT EXISTS extinguishers (
+    id INTEGER PRIMARY KEY, sector_id INTEGER REFERENCES sectors(id),
+    capture_id INTEGER REFERENCES captures(id), fecha TEXT, foto TEXT,
+    marca TEXT, tipo TEXT, capacidad TEXT, n_fab TEXT,
+    venc_carga TEXT, venc_ph TEXT, empresa_mant TEXT, codigo TEXT);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY, sector_id INTEGER REFERENCES sectors(id),
+    fecha TEXT, texto TEXT);
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY, sector_id INTEGER REFERENCES sectors(id),
+    tipo TEXT, x REAL, y REAL, valor REAL, fecha TEXT);
+CREATE TABLE IF NOT EXISTS sound_levels (
+    id INTEGER PRIMARY KEY, sector_id INTEGER REFERENCES sectors(id),
+    fecha TEXT, fuente TEXT, duracion REAL, laeq REAL, lamax REAL, lamin REAL,
+    la10 REAL, la50 REAL, la90 REAL, lceq REAL, lcpeak REAL);
+CREATE TABLE IF NOT EXISTS phashes (
+    capture_id INTEGER PRIMARY KEY REFERENCES captures(id), archivo TEXT, phash INTEGER);
+CREATE TABLE IF NOT EXISTS storage (
+    capture_id INTEGER PRIMARY KEY REFERENCES captures(id), bytes INTEGER, nivel INTEGER DEFAULT 0);
+CREATE INDEX IF NOT EXISTS idx_captures_archivo ON captures(archivo);
+"""
+
+def ahora_iso():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+class ProjectStore:
+    ARCHIVO = 'cimacam.db'
+
+    def __init__(self, path_empresa):
+        self.ruta = os.path.join(path_empresa, self.ARCHIVO)
+        self.con = sqlite3.connect(self.ruta)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(ESQUEMA_PROYECTO)
+        self._migrar()
+        # Los INSERT quedan en la transacción abierta; se confirman en lote
+        self._confirmar = Clock.create_trigger(lambda dt: self.confirmar(), 1.0)
+        self._indice = None
+        self._uso = None
+        self._etiquetas = None
+
+    def _migrar(self):
+        # Proyectos creados antes de leer etiquetas: falta la columna del código
+        columnas = [fila[1] for fila in self.con.execute("PRAGMA table_info(extinguishers)")]
+        if 'codigo' not in columnas:
+            self.con.execute("ALTER TABLE extinguishers ADD COLUMN codigo TEXT")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_extinguishers_codigo ON extinguishers(codigo)")
+        self.con.commit()
+
+    def _insertar(self, sql, valores):
+        cur = self.con.execute(sql, valores)
+        self._confirmar()
+        return cur.lastrowid
+
+    def confirmar(self):
+        if self.con.in_transaction:
+            self.con.commit()
+
+    def cerrar(self):
+        self._confirmar.cancel()
+        self.confirmar()
+        self.con.close()
+
+    def checkpoint(self):
+        # Vuelca el WAL al archivo principal para poder copiar solo cimacam.db
+        self.confirmar()
+        self.con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def nueva_sesion(self, empresa):
+        return self._insertar("INSERT INTO sessions (empresa, fecha) VALUES (?, ?)",
+                              (empresa, ahora_iso()))
+
+    def nuevo_sector(self, session_id, medicion, nombre, carpeta):
+        return self._insertar(
+            "INSERT INTO sectors (session_id, medicion, nombre, carpeta, fecha) VALUES (?, ?, ?, ?, ?)",
+            (session_id, medicion, nombre, carpeta, ahora_iso()))
+
+    def agregar_captura(self, sector_id, archivo, meta):
+        return self._insertar(
+            "INSERT INTO captures (sector_id, archivo, fecha, nitidez, meta) VALUES (?, ?, ?, ?, ?)",
+            (sector_id, os.path.basename(archivo), ahora_iso(), meta.get('nitidez'),
+             json.dumps(meta, ensure_ascii=False)))
+
+    # SQLite guarda enteros con signo: los hashes de 64 bits se desplazan
+    @staticmethod
+    def _hash_a_sql(h):
+        return h - (1 << 64) if h >= 1 << 63 else h
+
+    def indice_hashes(self):
+        # Se arma una vez por proyecto desde la tabla; después se mantiene en memoria
+        if self._indice is None:
+            self._indice = IndiceHashes()
+            for capture_id, archivo, h in self.con.execute("SELECT capture_id, archivo, phash FROM phashes"):
+                self._indice.agregar(capture_id, h & ((1 << 64) - 1), archivo)
+        return self._indice
+
+    def agregar_hash(self, capture_id, archivo, h):
+        self._insertar("INSERT OR REPLACE INTO phashes (capture_id, archivo, phash) VALUES (?, ?, ?)",
+                       (capture_id, os.path.basename(archivo), self._hash_a_sql(h)))
+        self.indice_hashes().agregar(capture_id, h, os.path.basename(archivo))
+
+    def olvidar_indice(self):
+        self._indice = None
+
+    def uso_bytes(self):
+        # Un SUM al abrir; después se lleva con los deltas de registrar_bytes
+        if self._uso is None:
+            self._uso = self.con.execute("SELECT COALESCE(SUM(bytes), 0) FROM storage").fetchone()[0]
+        return self._uso
+
+    def olvidar_uso(self):
+        self._uso = None
+
+    def registrar_bytes(self, capture_id, n_bytes, nivel=0):
+        fila = self.con.execute("SELECT bytes FROM storage WHERE capture_id = ?", (capture_id,)).fetchone()
+        self._insertar("INSERT OR REPLACE INTO storage (capture_id, bytes, nivel) VALUES (?, ?, ?)",
+                       (capture_id, n_bytes, nivel))
+        if self._uso is not None:
+            self._uso += n_bytes - (fila[0] if fila else 0)
+
+    def sin_contabilizar(self, limite=200):
+        return self.con.execute(
+            "SELECT c.id, c.archivo, s.carpeta FROM captures c JOIN sectors s ON s.id = c.sector_id"
+            " LEFT JOIN storage st ON st.capture_id = c.id WHERE st.capture_id IS NULL LIMIT ?",
+            (limite,)).fetchall()
+
+    def candidatas_reduccion(self, nivel_max, excluir_sector, limite=20):
+        # Las más viejas y menos reducidas primero; el puesto en curso no se toca
+        return self.con.execute(
+            "SELECT c.id, c.archivo, s.carpeta, st.nivel FROM storage st"
+            " JOIN captures c ON c.id = st.capture_id JOIN sectors s ON s.id = c.sector_id"
+            " WHERE st.nivel < ? AND c.sector_id IS NOT ? ORDER BY st.nivel, c.id LIMIT ?",
+            (nivel_max, excluir_sector, limite)).fetchall()
+
+    def renombrar_captura(self, capture_id, viejo, nuevo):
+        viejo, nuevo = os.path.basename(viejo), os.path.basename(nuevo)
+        if viejo == nuevo:
+            return
+        self.con.execute("UPDATE captures SET archivo = ? WHERE id = ?", (nuevo, capture_id))
+        self.con.execute("UPDATE phashes SET archivo = ? WHERE capture_id = ?", (nuevo, capture_id))
+        self.con.execute("UPDATE extinguishers SET foto = ? WHERE capture_id = ? OR (capture_id IS NULL AND foto = ?)",
+                         (nuevo, capture_id, viejo))
+        self._confirmar()
+        if self._indice is not None and capture_id in self._indice.hashes:
+            h, _ = self._indice.hashes[capture_id]
+            self._indice.agregar(capture_id, h, nuevo)
+
+    def agregar_extintor(self, sector_id, foto, campos, codigo=''):
+        fila = self.con.execute("SELECT id FROM captures WHERE archivo = ? ORDER BY id DESC LIMIT 1",
+                                (foto,)).fetchone()
+        extintor_id = self._insertar(
+            "INSERT INTO extinguishers (sector_id, capture_id, fecha, foto, marca, tipo, capacidad,"
+            " n_fab, venc_carga, venc_ph, empresa_mant, codigo) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (sector_id, fila[0] if fila else None, ahora_iso(), foto, campos['marca'], campos['tipo'],
+             campos['capacidad'], campos['n_fab'], campos['venc_carga'], campos['venc_ph'],
+             campos['empresa_mant'], codigo or None))
+        if codigo:
+            self.indice_etiquetas()[codigo] = {c: campos[c] for c in CAMPOS_EXTINTOR}
+        return extintor_id
+
+    def indice_etiquetas(self):
+        # código de etiqueta -> datos del último relevamiento de ese equipo.
+        # Se arma una vez por cliente; cada lectura en cámara es un acceso al dict
+        if self._etiquetas is None:
+            self._etiquetas = {}
+            for fila in self.con.execute(
+                    f"SELECT codigo, {', '.join(CAMPOS_EXTINTOR)} FROM extinguishers"
+                    " WHERE codigo IS NOT NULL AND codigo != '' ORDER BY id"):
+                self._etiquetas[fila[0]] = dict(zip(CAMPOS_EXTINTOR, fila[1:]))
+        return self._etiquetas
+
+    def extintor_por_codigo(self, codigo):
+        return self.indice_etiquetas().get(codigo)
+
+    def agregar_nota(self, sector_id, texto):
+        return self._insertar("INSERT INTO notes (sector_id, fecha, texto) VALUES (?, ?, ?)",
+                              (sector_id, ahora_iso(), texto))
+
+    def agregar_lectura(self, sector_id, tipo, x, y, valor):
+        return self._insertar("INSERT INTO readings (sector_id, tipo, x, y, valor, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+                              (sector_id, tipo, x, y, valor, ahora_iso()))
+
+    def agregar_nivel_sonoro(self, sector_id, fuente, datos):
+        campos = ('duracion', 'laeq', 'lamax', 'lamin', 'la10', 'la50', 'la90', 'lceq', 'lcpeak')
+        return self._insertar(
+            f"INSERT INTO sound_levels (sector_id, fecha, fuente, {', '.join(campos)}) VALUES (?, ?, ?{', ?' * len(campos)})",
+            (sector_id, ahora_iso(), fuente) + tuple(datos.get(c) for c in campos))
+
+    def borrar_lectura(self, lectura_id):
+        self.con.execute("DELETE FROM readings WHERE id = ?", (lectura_id,))
+        self._confirmar()
+
+    def lecturas(self, sector_id, tipo):
+        return self.con.execute("SELECT id, x, y, valor FROM readings WHERE sector_id = ? AND tipo = ? ORDER BY id",
+                                (sector_id, tipo)).fetchall()
+
+def formatear_fecha(iso, formato):
+    return datetime.strptime(iso, '%Y-%m-%d %H:%M:%S').strftime(formato)
+
+def exportar_planillas(ruta_db, path_empresa, empresa):
+    # Corre en un hilo aparte con su propia conexión (WAL permite leer en paralelo).
+    # Recorre el cursor fila por fila: nunca carga la tabla entera en memoria.
+    con = sqlite3.connect(ruta_db)
+    try:
+        csv_file = os.path.join(path_empresa, f"Relevamiento_Extintores_{empresa}.csv")
+        filas = con.execute(
+            "SELECT e.fecha, s.nombre, e.foto, e.marca, e.tipo, e.capacidad, e.n_fab,"
+            " e.venc_carga, e.venc_ph, e.empresa_mant, COALESCE(e.codigo, '')"
+            " FROM extinguishers e LEFT JOIN sectors s ON s.id = e.sector_id ORDER BY e.id")
+        n_extintores = 0
+        tmp = csv_file + '.tmp'
+        with open(tmp, mode='w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(ENCABEZADOS_EXTINTORES)
+            for fila in filas:
+                writer.writerow((formatear_fecha(fila[0], "%d/%m/%Y %H:%M:%S"),) + fila[1:])
+                n_extintores += 1
+        # Sin cambios no se toca el archivo: el catálogo re-lee por mtime
+        if n_extintores and not (os.path.exists(csv_file) and filecmp.cmp(tmp, csv_file, shallow=False)):
+            os.replace(tmp, csv_file)
+        else:
+            os.remove(tmp)
+
+        n_informes = 0
+        notas = con.execute(
+            "SELECT n.id, n.fecha, n.texto, s.medicion, s.nombre, s.carpeta, ses.empresa"
+            " FROM notes n JOIN sectors s ON s.id = n.sector_id"
+            " JOIN sessions ses ON ses.id = s.session_id ORDER BY n.id")
+        for nota_id, fecha, texto, medicion, puesto, carpeta, cliente in notas:
+            os.makedirs(carpeta, exist_ok=True)
+            contenido = (f"CLIENTE: {cliente}\n"
+                         f"TIPO: {medicion}\n"
+                         f"PUESTO: {puesto}\n"
+                         f"FECHA: {formatear_fecha(fecha, '%d/%m/%Y %H:%M')}\n"
+                         + "="*30 + "\n"
+                         + texto)
+            # El id de la nota en el nombre: dos notas en el mismo segundo no se pisan
+            hora = formatear_fecha(fecha, '%H%M%S')
+            fname = os.path.join(carpeta, f"Informe_{hora}_{nota_id}.txt")
+            if not mismo_texto(fname, contenido):
+                with open(fname, "w", encoding="utf-8") as f:
+                    f.write(contenido)
+            # Exportaciones anteriores la guardaban sin el id
+            viejo = os.path.join(carpeta, f"Informe_{hora}.txt")
+            if mismo_texto(viejo, contenido):
+                os.remove(viejo)
+            n_informes += 1
+        return n_extintores, n_informes
+    finally:
+        con.close()
+
+def mismo_texto(ruta, contenido):
+    if not os.path.exists(ruta):
+        return False
+    with open(ruta, encoding='utf-8', errors='replace') as f:
+        return f.read() == contenido
+
+def limpiar_duplicados(ruta_db, path_empresa, radio=6):
+    # Agrupa las capturas casi idénticas (unión de pares a <= radio bits) y deja
+    # la más nítida de cada grupo. Las demás se mueven a .duplicados/ (no se
+    # borran) y salen de la base. Las fotos de extintores nunca se mueven.
+    con = sqlite3.connect(ruta_db, timeout=10)
+    try:
+        filas = con.execute(
+            "SELECT p.capture_id, p.phash, c.archivo, c.nitidez, s.carpeta,"
+            " EXISTS (SELECT 1 FROM extinguishers e WHERE e.capture_id = c.id OR e.foto = c.archivo)"
+            " FROM phashes p JOIN captures c ON c.id = p.capture_id"
+            " LEFT JOIN sectors s ON s.id = c.sector_id").fetchall()
+        indice = IndiceHashes(radio)
+        datos = {}
+        for capture_id, h, archivo, nitidez, carpeta, protegida in filas:
+            indice.agregar(capture_id, h & ((1 << 64) - 1))
+            datos[capture_id] = (archivo, nitidez or 0.0, carpeta or path_empresa, protegida)
+        padre = {k: k for k in datos}
+
+        def raiz(k):
+            while padre[k] != k:
+                padre[k] = padre[padre[k]]
+                k = padre[k]
+            return k
+        for capture_id, (h, _) in indice.hashes.items():
+            for _, otro, _ in indice.buscar(h):
+                padre[raiz(otro)] = raiz(capture_id)
+        grupos = {}
+        for k in datos:
+            grupos.setdefault(raiz(k), []).append(k)
+
+        movidas, liberados = 0, 0
+        papelera = os.path.join(path_empresa, '.duplicados')
+        for miembros in grupos.values():
+            if len(miembros) < 2:
+                continue
+            conservar = max(miembros, key=lambda k: (datos[k][3], datos[k][1]))
+            for k in miembros:
+                archivo, _, carpeta, protegida = datos[k]
+                if k == conservar or protegida:
+                    continue
+                ruta = os.path.join(carpeta, archivo)
+                if os.path.exists(ruta):
+                    destino = os.path.join(papelera, os.path.relpath(carpeta, path_empresa))
+                    os.makedirs(destino, exist_ok=True)
+                    liberados += os.path.getsize(ruta)
+                    for extra in (ruta, ruta + '.json'):
+                        if os.path.exists(extra):
+                            os.replace(extra, os.path.join(destino, os.path.basename(extra)))
+                    if os.path.exists(ruta_miniatura(ruta)):
+                        os.remove(ruta_miniatura(ruta))
+                con.execute("DELETE FROM phashes WHERE capture_id = ?", (k,))
+                con.execute("DELETE FROM storage WHERE capture_id = ?", (k,))
+                con.execute("DELETE FROM captures WHERE id = ?", (k,))
+                movidas += 1
+        con.commit()
+        return movidas, liberados
+    finally:
+        con.close()
+
+# --- CATÁLOGO ENTRE PROYECTOS (BÚSQUEDA SOBRE CimaCam_Datos) ---
+def carpeta_datos():
+    if platform == 'android':
+        # GUARDA EN DESCARGAS
+        from android.storage import primary_external_storage_path
+        return os.path.join(primary_external_storage_path(), "Download", "CimaCam_Datos")
+    return os.path.join(os.getcwd(), "CimaCam_Datos")
+
+ESQUEMA_CATALOGO = """
+CREATE TABLE IF NOT EXISTS archivos (
+    ruta TEXT PRIMARY KEY, empresa TEXT, mtime_ns INTEGER, bytes INTEGER);
+CREATE TABLE IF NOT EXISTS extintores (
+    id INTEGER PRIMARY KEY, ruta TEXT, empresa TEXT, fecha TEXT, sector TEXT, foto TEXT,
+    marca TEXT, tipo TEXT, capacidad TEXT, n_fab TEXT, venc_carga TEXT, venc_ph TEXT,
+    empresa_mant TEXT, codigo TEXT, mes_carga TEXT, mes_ph TEXT);
+CREATE TABLE IF NOT EXISTS informes (
+    id INTEGER PRIMARY KEY, ruta TEXT, empresa TEXT, cliente TEXT, medicion TEXT,
+    puesto TEXT, fecha TEXT, texto TEXT);
+CREATE INDEX IF NOT EXISTS idx_cat_extintores_ruta ON extintores(ruta);
+CREATE INDEX IF NOT EXISTS idx_cat_extintores_codigo ON extintores(empresa, codigo);
+CREATE INDEX IF NOT EXISTS idx_cat_extintores_carga ON extintores(mes_carga);
+CREATE INDEX IF NOT EXISTS idx_cat_extintores_ph ON extintores(mes_ph);
+CREATE INDEX IF NOT EXISTS idx_cat_informes_ruta ON informes(ruta);
+CREATE INDEX IF NOT EXISTS idx_cat_informes_medicion ON informes(medicion);
+"""
+
+# Vencimientos escritos a mano: "10/2027", "10/27", "15/10/2027", "2027-10"...
+_VENC_ISO = re.compile(r'\b(\d{4})[-/.](\d{1,2})\b')
+_VENC_LOCAL = re.compile(r'\b(\d{1,2})[-/.](\d{4}|\d{2})\b(?![-/.]\d)')
+
+def mes_vencimiento(texto):
+    # -> 'AAAA-MM' (comparable como texto) o None si no se reconoce
+    if not texto:
+        return None
+    m = _VENC_ISO.search(texto)
+    if m:
+        anio, mes = int(m.group(1)), int(m.group(2))
+    else:
+        m = _VENC_LOCAL.search(texto)
+        if not m:
+            return None
+        mes, anio = int(m.group(1)), int(m.group(2))
+        if anio < 100:
+            anio += 2000
+    return f"{anio:04d}-{mes:02d}" if 1 <= mes <= 12 else None
+
+def fecha_iso(texto, formatos=("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")):
+    for formato in formatos:
+        try:
+            return datetime.strptime(texto.strip(), formato).strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, AttributeError):
+            pass
+    return None
+
+def leer_informe(ruta):
+    # Encabezado "CLAVE: valor" hasta la línea de '=' (ver exportar_planillas)
+    campos = {}
+    with open(ruta, encoding='utf-8', errors='replace') as f:
+        for linea in f:
+            if linea.startswith('='):
+                break
+            clave, _, valor = linea.partition(':')
+            campos[clave.strip().upper()] = valor.strip()
+        texto = f.read()
+    return {'cliente': campos.get('CLIENTE'), 'medicion': campos.get('TIPO'), 'puesto': campos.get('PUESTO'),
+            'fecha': fecha_iso(campos.get('FECHA')), 'texto': texto}
+
+def leer_planilla_extintores(ruta):
+    # Por nombre de columna: las planillas viejas no tienen "Codigo"
+    with open(ruta, newline='', encoding='utf-8-sig', errors='replace') as f:
+        for fila in csv.DictReader(f, delimiter=';'):
+            yield {'fecha': fecha_iso(fila.get('Fecha')), 'sector': fila.get('Sector'), 'foto': fila.get('Foto'),
+                   'marca': fila.get('Marca'), 'tipo': fila.get('Tipo'), 'capacidad': fila.get('Capacidad'),
+                   'n_fab': fila.get('N_Fab'), 'venc_carga': fila.get('Venc_Carga'), 'venc_ph': fila.get('Venc_PH'),
+                   'empresa_mant': fila.get('Empresa'), 'codigo': fila.get('Codigo') or ''}
+
+def leer_base_proyecto(ruta):
+    # Los mismos campos que leer_planilla_extintores / leer_informe, directo de
+    # cimacam.db (solo lectura: la app puede tenerla abierta)
+    con = sqlite3.connect(f"file:{pathname2url(ruta)}?mode=ro", uri=True)
+    try:
+        columnas = [fila[1] for fila in con.execute("PRAGMA table_info(extinguishers)")]
+        codigo = "COALESCE(e.codigo, '')" if 'codigo' in columnas else "''"
+        extintores = [
+            {'fecha': fila[0], 'sector': fila[1], 'foto': fila[2], 'marca': fila[3], 'tipo': fila[4],
+             'capacidad': fila[5], 'n_fab': fila[6], 'venc_carga': fila[7], 'venc_ph': fila[8],
+             'empresa_mant': fila[9], 'codigo': fila[10]}
+            for fila in con.execute(
+                "SELECT e.fecha, s.nombre, e.foto, e.marca, e.tipo, e.capacidad, e.n_fab,"
+                f" e.venc_carga, e.venc_ph, e.empresa_mant, {codigo}"
+                " FROM extinguishers e LEFT JOIN sectors s ON s.id = e.sector_id ORDER BY e.id")]
+        informes = [
+            {'cliente': cliente, 'medicion': medicion, 'puesto': puesto, 'fecha': fecha, 'texto': texto}
+            for fecha, texto, medicion, puesto, cliente in con.execute(
+                "SELECT n.fecha, n.texto, s.medicion, s.nombre, ses.empresa"
+                " FROM notes n JOIN sectors s ON s.id = n.sector_id"
+                " JOIN sessions ses ON ses.id = s.session_id ORDER BY n.id")]
+        return extintores, informes
+    finally:
+        con.close()
+
+class CatalogoDatos:
+    # Índice de todas las carpetas de clientes. Se re-indexa por (mtime, tamaño):
+    # sin cambios solo se recorre el árbol y se compara contra un dict.
+    # Un cliente con cimacam.db se lee de la base (esté exportado o no); las
+    # planillas e informes sueltos solo cuentan en carpetas sin base.
+    # Un solo hilo por instancia (la pantalla lo usa desde su propio worker).
+    def __init__(self, raiz, ruta_db):
+        self.raiz = raiz
+        self.con = sqlite3.connect(ruta_db, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(ESQUEMA_CATALOGO)
+        try:
+            self.con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS informes_fts USING fts5(texto, puesto, cliente)")
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite sin FTS5: la búsqueda cae a LIKE
+            self.fts = False
+        self.con.commit()
+
+    def cerrar(self):
+        self.con.close()
+
+    def _recorrer(self, carpeta, relativa='', exportados=True):
+        # scandir: el tipo de cada entrada viene del directorio, solo se hace stat de los candidatos
+        try:
+            entradas = list(os.scandir(carpeta))
+        except OSError:
+            return
+        for e in entradas:
+            if e.name.startswith('.'):
+                continue
+            rel = f"{relativa}/{e.name}" if relativa else e.name
+            if e.is_dir(follow_symlinks=False):
+                # Con la base del cliente, lo exportado repetiría sus datos
+                base = not relativa and os.path.exists(os.path.join(e.path, ProjectStore.ARCHIVO))
+                yield from self._recorrer(e.path, rel, exportados and not base)
+            elif e.name == ProjectStore.ARCHIVO and relativa and '/' not in relativa:
+                # Lo último puede estar todavía en el WAL: cuenta para (mtime, tamaño)
+                st = e.stat()
+                mtime, n = st.st_mtime_ns, st.st_size
+                if os.path.exists(e.path + '-wal'):
+                    st = os.stat(e.path + '-wal')
+                    mtime, n = max(mtime, st.st_mtime_ns), n + st.st_size
+                yield rel, mtime, n
+            elif ((e.name.startswith('Relevamiento_Extintores_') and e.name.endswith('.csv'))
+                  or (e.name.startswith('Informe_') and e.name.endswith('.txt'))) and relativa and exportados:
+                st = e.stat()
+                yield rel, st.st_mtime_ns, st.st_size
+
+    @trazado('catalogo indexar')
+    def indexar(self):
+        t0 = time.perf_counter()
+        conocidos = {ruta: (mtime, n) for ruta, mtime, n in self.con.execute("SELECT ruta, mtime_ns, bytes FROM archivos")}
+        vistos = 0
+        cambiados = 0
+        with self.con:
+            for rel, mtime, n in self._recorrer(self.raiz):
+                vistos += 1
+                if conocidos.pop(rel, None) == (mtime, n):
+                    continue
+                self._quitar(rel)
+                empresa = rel.split('/', 1)[0]
+                try:
+                    self._indexar_archivo(rel, empresa)
+                except (OSError, csv.Error, sqlite3.Error) as e:
+                    # Se registra igual: se vuelve a leer cuando cambie
+                    print(f"Error Catálogo: {rel}: {e}")
+                self.con.execute("INSERT OR REPLACE INTO archivos (ruta, empresa, mtime_ns, bytes) VALUES (?, ?, ?, ?)",
+                                 (rel, empresa, mtime, n))
+                cambiados += 1
+            for rel in conocidos:
+                self._quitar(rel)
+                self.con.execute("DELETE FROM archivos WHERE ruta = ?", (rel,))
+        return {'archivos': vistos, 'cambiados': cambiados, 'borrados': len(conocidos),
+                'segundos': time.perf_counter() - t0}
+
+    def _quitar(self, rel):
+        self.con.execute("DELETE FROM extintores WHERE ruta = ?", (rel,))
+        if self.fts:
+            self.con.execute("DELETE FROM informes_fts WHERE rowid IN (SELECT id FROM informes WHERE ruta = ?)", (rel,))
+        self.con.execute("DELETE FROM informes WHERE ruta = ?", (rel,))
+
+    def _indexar_archivo(self, rel, empresa):
+        ruta = os.path.join(self.raiz, *rel.split('/'))
+        if rel.endswith('/' + ProjectStore.ARCHIVO):
+            extintores, informes = leer_base_proyecto(ruta)
+        elif rel.endswith('.csv'):
+            extintores, informes = leer_planilla_extintores(ruta), ()
+        else:
+            extintores, informes = (), (leer_informe(ruta),)
+        self.con.executemany(
+            "INSERT INTO extintores (ruta, empresa, fecha, sector, foto, marca, tipo, capacidad, n_fab,"
+            " venc_carga, venc_ph, empresa_mant, codigo, mes_carga, mes_ph)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((rel, empresa, f['fecha'], f['sector'], f['foto'], f['marca'], f['tipo'], f['capacidad'],
+              f['n_fab'], f['venc_carga'], f['venc_ph'], f['empresa_mant'], f['codigo'],
+              mes_vencimiento(f['venc_carga']), mes_vencimiento(f['venc_ph']))
+             for f in extintores))
+        for inf in informes:
+            informe_id = self.con.execute(
+                "INSERT INTO informes (ruta, empresa, cliente, medicion, puesto, fecha, texto) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rel, empresa, inf['cliente'], inf['medicion'], inf['puesto'], inf['fecha'], inf['texto'])).lastrowid
+            if self.fts:
+                self.con.execute("INSERT INTO informes_fts (rowid, texto, puesto, cliente) VALUES (?, ?, ?, ?)",
+                                 (informe_id, inf['texto'], inf['puesto'] or '', inf['cliente'] or ''))
+
+    # Un equipo con etiqueta aparece en cada relevamiento: vale su último registro
+    # por fecha. El id solo desempata: sigue el orden de indexado, no el de los
+    # relevamientos (una planilla vieja re-exportada se indexa después)
+    _VIGENTES = ("(e.codigo = '' OR e.id = (SELECT x.id FROM extintores x"
+                 " WHERE x.empresa = e.empresa AND x.codigo = e.codigo ORDER BY x.fecha DESC, x.id DESC LIMIT 1))")
+
+    def vencimientos(self, desde, hasta, campo='carga', empresa=None):
+        # Meses 'AAAA-MM' inclusive; campo 'carga' o 'ph'
+        columna = {'carga': 'mes_carga', 'ph': 'mes_ph'}[campo]
+        return self.con.execute(
+            f"SELECT e.empresa, e.sector, e.marca, e.tipo, e.capacidad, e.codigo, e.{columna} FROM extintores e"
+            f" WHERE e.{columna} BETWEEN ? AND ? AND (? IS NULL OR e.empresa = ?) AND {self._VIGENTES}"
+            f" ORDER BY e.{columna}, e.empresa, e.sector", (desde, hasta, empresa, empresa)).fetchall()
+
+    def resumen_vencimientos(self, campo='carga', desde=None):
+        # [(mes, extintores, clientes)] por mes de vencimiento
+        columna = {'carga': 'mes_carga', 'ph': 'mes_ph'}[campo]
+        return self.con.execute(
+            f"SELECT e.{columna}, COUNT(*), COUNT(DISTINCT e.empresa) FROM extintores e"
+            f" WHERE e.{columna} IS NOT NULL AND (? IS NULL OR e.{columna} >= ?) AND {self._VIGENTES}"
+            f" GROUP BY e.{columna} ORDER BY e.{columna}", (desde, desde)).fetchall()
+
+    def informes_por_medicion(self, empresa=None):
+        # [(medición, informes, clientes)]
+        return self.con.execute(
+            "SELECT COALESCE(medicion, '?'), COUNT(*), COUNT(DISTINCT empresa) FROM informes"
+            " WHERE (? IS NULL OR empresa = ?) GROUP BY medicion ORDER BY COUNT(*) DESC",
+            (empresa, empresa)).fetchall()
+
+    def buscar_notas(self, consulta, medicion=None, empresa=None, limite=50):
+        # [(empresa, medición, puesto, fecha, ruta, fragmento)]; cada palabra es un prefijo obligatorio
+        palabras = consulta.split()
+        if not palabras:
+            return []
+        if self.fts:
+            expresion = ' '.join('"%s"*' % p.replace('"', '""') for p in palabras)
+            return self.con.execute(
+                "SELECT i.empresa, i.medicion, i.puesto, i.fecha, i.ruta,"
+                " snippet(informes_fts, 0, '[', ']', '...', 12)"
+                " FROM informes_fts JOIN informes i ON i.id = informes_fts.rowid"
+                " WHERE informes_fts MATCH ? AND (? IS NULL OR i.medicion = ?) AND (? IS NULL OR i.empresa = ?)"
+                " ORDER BY rank LIMIT ?", (expresion, medicion, medicion, empresa, empresa, limite)).fetchall()
+        condiciones = ' AND '.join("(texto LIKE ? OR puesto LIKE ? OR cliente LIKE ?)" for _ in palabras)
+        valores = [f"%{p}%" for p in palabras for _ in range(3)]
+        return self.con.execute(
+            f"SELECT empresa, medicion, puesto, fecha, ruta, substr(texto, 1, 80) FROM informes"
+            f" WHERE {condiciones} AND (? IS NULL OR medicion = ?) AND (? IS NULL OR empresa = ?)"
+            f" ORDER BY fecha DESC LIMIT ?", valores + [medicion, medicion, empresa, empresa, limite]).fetchall()
+
+# --- DIARIO DE SESIÓN (REANUDAR TRAS UN CIERRE FORZADO) ---
+class DiarioSesion:
+    # Cada cambio de estado es una línea JSON que solo se agrega; el fsync va
+    # en lote (o inmediato antes de salir de la app). Cada COMPACTAR_CADA líneas
+    # el estado completo pasa a la instantánea y el diario vuelve a cero, así
+    # que recuperar lee a lo sumo esa cantidad de líneas.
+    COMPACTAR_CADA = 256
+
+    def __init__(self, carpeta):
+        self.ruta_diario = os.path.join(carpeta, 'sesion.diario')
+        self.ruta_instantanea = os.path.join(carpeta, 'sesion.json')
+        self.estado = {}
+        self.seq = 0
+        self.lineas = 0
+        self._archivo = None
+        self._sincronizar = Clock.create_trigger(lambda dt: self.sincronizar(), 0.5)
+
+    def _aplicar(self, cambios):
+        if cambios.get('_fin'):
+            self.estado = {}
+        else:
+            self.estado.update(cambios)
+
+    def recuperar(self):
+        if os.path.exists(self.ruta_instantanea):
+            with open(self.ruta_instantanea, encoding='utf-8') as f:
+                instantanea = json.load(f)
+            self.seq, self.estado = instantanea['seq'], instantanea['estado']
+        cortada = False
+        if os.path.exists(self.ruta_diario):
+            # En binario: el corte puede caer en medio de un carácter UTF-8 y
+            # así el error sale de json.loads y no de la lectura del archivo
+            with open(self.ruta_diario, 'rb') as f:
+                for linea in f:
+                    try:
+                        cambios = json.loads(linea)
+                    except ValueError:
+                        cortada = True  # última línea cortada por el cierre
+                        break
+                    self.lineas += 1
+                    # Un corte entre la instantánea y el truncado deja líneas ya incluidas
+                    seq = cambios.pop('_seq')
+                    if seq > self.seq:
+                        self.seq = seq
+                        self._aplicar(cambios)
+        if cortada:
+            # No se puede seguir agregando detrás de una línea a medias
+            self.compactar()
+        return dict(self.estado)
+
+    def registrar(self, cambios, sincronizar=False):
+        self.seq += 1
+        self._aplicar(cambios)
+        if self._archivo is None:
+            self._archivo = open(self.ruta_diario, 'a', encoding='utf-8')
+        self._archivo.write(json.dumps(dict(cambios, _seq=self.seq), ensure_ascii=False) + '\n')
+        self.lineas += 1
+        if self.lineas >= self.COMPACTAR_CADA:
+            self.compactar()
+        elif sincronizar:
+            self.sincronizar()
+        else:
+            self._sincronizar()
+
+    def sincronizar(self):
+        if self._archivo is not None:
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+
+    def compactar(self):
+        tmp = self.ruta_instantanea + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'seq': self.seq, 'estado': self.estado}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ruta_instantanea)
+        if self._archivo is not None:
+            self._archivo.close()
+        self._archivo = open(self.ruta_diario, 'w', encoding='utf-8')
+        self.lineas = 0
+
+    def cerrar(self):
+        self._sincronizar.cancel()
+        self.compactar()
+        self._archivo.close()
+        self._archivo = None
+
+# --- PRESUPUESTO DE ALMACENAMIENTO ---
+# Escalones de reducción: (lado máximo, formato, calidad). Nivel 0 = original.
+NIVELES_REDUCCION = (None, (0, 'jpg', 90), (1920, 'jpg', 80), (1280, 'jpg', 70))
+
+def siguiente_nivel(ruta, nivel):
+    # El escalón 1 solo pasa PNG/WebP a JPEG; un JPEG re-codificado a la misma
+    # calidad no achica nada, así que empieza directo en el 2
+    if nivel == 0 and not ruta.lower().endswith(('.png', '.webp')):
+        return 2
+    return nivel + 1
+
+def reducir_captura(ruta, nivel):
+    # Re-codifica una captura al escalón `nivel`. Si cambia la extensión el
+    # original queda en disco (ver descartar_original). Devuelve (ruta nueva, bytes).
+    lado, formato, calidad = NIVELES_REDUCCION[nivel]
+    frame = cv2.imread(ruta, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise IOError(f"No se pudo leer {ruta}")
+    h, w = frame.shape[:2]
+    if lado and max(h, w) > lado:
+        escala = lado / max(h, w)
+        frame = cv2.resize(frame, (int(w * escala), int(h * escala)), interpolation=cv2.INTER_AREA)
+    nuevo = os.path.splitext(ruta)[0] + '.' + formato
+    if nuevo != ruta and os.path.exists(nuevo):
+        nuevo = os.path.splitext(ruta)[0] + '_r.' + formato
+    escribir_imagen(nuevo, frame, formato, calidad)
+    if nuevo != ruta and os.path.exists(ruta + '.json'):
+        shutil.copyfile(ruta + '.json', nuevo + '.json')
+    escribir_metadatos(nuevo, archivo=nuevo, nivel_reduccion=nivel)
+    return nuevo, os.path.getsize(nuevo)
+
+def descartar_original(viejo, nuevo):
+    # Recién con el renombrado confirmado en la base: si la app se cae antes,
+    # la base sigue apuntando a un archivo que existe
+    if nuevo == viejo:
+        return
+    for ruta in (viejo, viejo + '.json'):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    if os.path.exists(ruta_miniatura(viejo)):
+        os.replace(ruta_miniatura(viejo), ruta_miniatura(nuevo))
+
+def descartar_reducida(viejo, nuevo):
+    # La base no llegó a apuntar a la copia reducida: se borra y queda el original
+    if nuevo == viejo:
+        return
+    for ruta in (nuevo, nuevo + '.json'):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+class GestorAlmacenamiento:
+    # El uso del proyecto se lleva en la base (bytes por captura, sin recorrer
+    # carpetas) y el espacio libre sale de statvfs. Si el proyecto pasa su
+    # presupuesto, un hilo de baja prioridad re-codifica las capturas más
+    # viejas escalón por escalón hasta bajar al 90 %.
+    CONFIG = {'presupuesto_mb': 4096, 'reserva_mb': 500, 'minimo_mb': 100}
+
+    def __init__(self, carpeta_config):
+        self.config = dict(self.CONFIG)
+        ruta = os.path.join(carpeta_config, 'almacenamiento.json')
+        if os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                self.config.update(json.load(f))
+        self.store = None
+        self.carpeta = None
+        self.sector_actual = None
+        self.ocupado = lambda: False
+        self.avisado = False
+        self._reduciendo = False
+        # Las capturas de antes del presupuesto ya se midieron todas (por proyecto)
+        self._contabilizado = False
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def mb(self, clave):
+        return self.config[clave] * 1024 * 1024
+
+    def usar(self, store, carpeta):
+        self.store = store
+        self.carpeta = carpeta
+        self._contabilizado = False
+        self.revisar()
+
+    def libre(self):
+        return shutil.disk_usage(self.carpeta or '.').free
+
+    def verificar(self):
+        # (se puede capturar, aviso). Debajo del mínimo se bloquea la toma.
+        libre = self.libre()
+        if libre < self.mb('minimo_mb'):
+            return False, f"¡SIN ESPACIO!\nQuedan {libre / (1024 * 1024):.0f} MB"
+        if libre < self.mb('reserva_mb'):
+            return True, f"Poco espacio: {libre / (1024 * 1024):.0f} MB libres"
+        return True, None
+
+    def registrar(self, capture_id, n_bytes, nivel=0):
+        if self.store is not None and n_bytes is not None:
+            self.store.registrar_bytes(capture_id, n_bytes, nivel)
+            self.revisar()
+
+    def excedido(self):
+        # Una vez que empezó a reducir sigue hasta el 90 % (no se re-dispara cada foto)
+        margen = 0.9 if self._reduciendo else 1.0
+        return (self.store.uso_bytes() > margen * self.mb('presupuesto_mb')
+                or self.libre() < 2 * self.mb('reserva_mb'))
+
+    def revisar(self):
+        if self.store is None or cv2 is None or (self._hilo is not None and self._hilo.is_alive()):
+            return
+        # Capturas anteriores a esta función: se miden una sola vez, y una vez
+        # terminado el relleno no se vuelve a consultar en cada foto
+        pendientes = None if self._contabilizado else self.store.sin_contabilizar()
+        self._contabilizado = not pendientes
+        if pendientes:
+            self._lanzar(self._medir, pendientes)
+        elif self.excedido():
+            candidatas = self.store.candidatas_reduccion(len(NIVELES_REDUCCION) - 1, self.sector_actual)
+            self._reduciendo = bool(candidatas)
+            if candidatas:
+                self._lanzar(self._reducir, candidatas)
+        else:
+            self._reduciendo = False
+
+    def _lanzar(self, fn, lote):
+        self._detener.clear()
+        self._hilo = threading.Thread(target=fn, args=(lote,), name='almacenamiento', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _medir(self, lote):
+        medidas = []
+        for capture_id, archivo, carpeta in lote:
+            ruta = os.path.join(carpeta, archivo)
+            medidas.append((capture_id, os.path.getsize(ruta) if os.path.exists(ruta) else 0))
+        mainthread(self._medidas_listas)(medidas)
+
+    def _medidas_listas(self, medidas):
+        if self.store is None:
+            return
+        for capture_id, n_bytes in medidas:
+            self.store.registrar_bytes(capture_id, n_bytes)
+        self.revisar()
+
+    def _reducir(self, lote):
+        bajar_prioridad_hilo()
+        for capture_id, archivo, carpeta, nivel in lote:
+            # Cede el paso mientras la cámara tiene fotos en cola
+            while self.ocupado() and not self._detener.is_set():
+                time.sleep(0.5)
+            if self._detener.is_set():
+                return
+            ruta = os.path.join(carpeta, archivo)
+            try:
+                if not os.path.exists(ruta):
+                    mainthread(self._reducida)(capture_id, ruta, ruta, 0, len(NIVELES_REDUCCION) - 1)
+                    continue
+                siguiente = siguiente_nivel(ruta, nivel)
+                nuevo, n_bytes = reducir_captura(ruta, siguiente)
+                mainthread(self._reducida)(capture_id, ruta, nuevo, n_bytes, siguiente)
+            except Exception as e:
+                print(f"Error Almacenamiento: {e}")
+                # No se vuelve a intentar, pero el archivo sigue ocupando lo que ocupa
+                n_bytes = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+                mainthread(self._reducida)(capture_id, ruta, ruta, n_bytes, len(NIVELES_REDUCCION) - 1)
+            time.sleep(0.05)
+        mainthread(self.revisar)()
+
+    def _reducida(self, capture_id, viejo, nuevo, n_bytes, nivel):
+        if self.store is None:
+            descartar_reducida(viejo, nuevo)
+            return
+        self.store.renombrar_captura(capture_id, viejo, nuevo)
+        self.store.registrar_bytes(capture_id, n_bytes, nivel)
+        self.store.confirmar()
+        descartar_original(viejo, nuevo)
+
+# --- EXPORTACIÓN DEL PROYECTO A ZIP (STREAMING, REANUDABLE) ---
+# Medios ya comprimidos: se guardan sin volver a comprimir
+EXTENSIONES_COMPRIMIDAS = ('.jpg', '.jpeg', '.png', '.webp', '.mp4', '.avi', '.zip', '.gz')
+# Archivos que nunca van al zip
+IGNORAR_EXPORTACION = ('.tmp', '.part', '-wal', '-shm', '.progreso.json')
+
+def hash_archivo(ruta, bloque=1024 * 1024):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(bloque), b''):
+            h.update(trozo)
+    return h.hexdigest()
+
+class ExportadorProyecto:
+    # Cada CHECKPOINT_BYTES se cierra el zip (queda válido en disco) y se anota
+    # su tamaño; si la exportación se corta, se trunca ahí y se sigue.
+    CHECKPOINT_BYTES = 64 * 1024 * 1024
+    BLOQUE = 1024 * 1024
+
+    def __init__(self, carpeta, destino, on_progreso=None, on_fin=None, preparar=None):
+        self.carpeta = carpeta
+        self.preparar = preparar
+        self.destino = destino
+        self.parcial = destino + '.part'
+        self.ruta_progreso = destino + '.progreso.json'
+        self.on_progreso = on_progreso
+        self.on_fin = on_fin
+        self.cancelado = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._correr, name='exportar', daemon=True)
+        self._hilo.start()
+
+    def cancelar(self):
+        self.cancelado.set()
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def listar(self):
+        archivos = []
+        for raiz, dirs, nombres in os.walk(self.carpeta):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for nombre in nombres:
+                if nombre.endswith(IGNORAR_EXPORTACION):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                archivos.append((ruta, os.path.relpath(ruta, self.carpeta).replace(os.sep, '/'),
+                                 os.path.getsize(ruta)))
+        return archivos
+
+    def _cargar_progreso(self):
+        if os.path.exists(self.ruta_progreso) and os.path.exists(self.parcial):
+            with open(self.ruta_progreso, encoding='utf-8') as f:
+                progreso = json.load(f)
+            with open(self.parcial, 'r+b') as f:
+                # Descarta lo escrito después del último checkpoint
+                f.truncate(progreso['offset'])
+            return progreso
+        return {'offset': 0, 'hechos': [], 'hashes': {}, 'duplicados': {}}
+
+    def _guardar_progreso(self, progreso):
+        progreso['offset'] = os.path.getsize(self.parcial)
+        tmp = self.ruta_progreso + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(progreso, f)
+        os.replace(tmp, self.ruta_progreso)
+
+    def _avisar(self, hechos, total):
+        if self.on_progreso:
+            mainthread(self.on_progreso)(hechos, total)
+
+    def _correr(self):
+        try:
+            resultado = self._exportar()
+        except Exception as e:
+            print(f"Error Exportar ZIP: {e}")
+            resultado = e
+        if self.on_fin:
+            mainthread(self.on_fin)(resultado)
+
+    def _exportar(self):
+        if self.preparar is not None:
+            self.preparar()
+        archivos = self.listar()
+        total = sum(a[2] for a in archivos)
+        # Solo puede haber duplicados entre archivos del mismo tamaño
+        tamanios = {}
+        for _, _, tam in archivos:
+            tamanios[tam] = tamanios.get(tam, 0) + 1
+
+        progreso = self._cargar_progreso()
+        hechos = set(progreso['hechos'])
+        bytes_hechos = sum(a[2] for a in archivos if a[1] in hechos)
+        desde_checkpoint = 0
+        ultimo_aviso = 0.0
+        zf = zipfile.ZipFile(self.parcial, 'a' if progreso['offset'] else 'w', allowZip64=True)
+        try:
+            for ruta, arcname, tam in archivos:
+                if arcname in hechos:
+                    continue
+                if self.cancelado.is_set():
+                    return None
+                # Los vacíos tienen todos el mismo hash pero no son copias de nada
+                if tam > 0 and tamanios[tam] > 1:
+                    digest = hash_archivo(ruta)
+                    original = progreso['hashes'].get(digest)
+                    if original is not None:
+                        progreso['duplicados'][arcname] = original
+                        progreso['hechos'].append(arcname)
+                        bytes_hechos += tam
+                        continue
+                    progreso['hashes'][digest] = arcname
+
+                info = zipfile.ZipInfo.from_file(ruta, arcname)
+                info.compress_type = (zipfile.ZIP_STORED if arcname.lower().endswith(EXTENSIONES_COMPRIMIDAS)
+                                      else zipfile.ZIP_DEFLATED)
+                with open(ruta, 'rb') as origen, zf.open(info, 'w', force_zip64=tam > 0x7fffffff) as dest:
+                    for trozo in iter(lambda: origen.read(self.BLOQUE), b''):
+                        dest.write(trozo)
+                        bytes_hechos += len(trozo)
+                        desde_checkpoint += len(trozo)
+                        if time.monotonic() - ultimo_aviso > 0.25:
+                            ultimo_aviso = time.monotonic()
+                            self._avisar(bytes_hechos, total)
+                progreso['hechos'].append(arcname)
+
+                if desde_checkpoint >= self.CHECKPOINT_BYTES:
+                    zf.close()
+                    self._guardar_progreso(progreso)
+                    zf = zipfile.ZipFile(self.parcial, 'a', allowZip64=True)
+                    desde_checkpoint = 0
+
+            if progreso['duplicados']:
+                # Los duplicados no se copian: se listan contra el archivo que sí está
+                lineas = [f"{dup} = {orig}" for dup, orig in sorted(progreso['duplicados'].items())]
+                zf.writestr('DUPLICADOS.txt', "\n".join(lineas) + "\n")
+        finally:
+            zf.close()
+            if self.cancelado.is_set():
+                self._guardar_progreso(progreso)
+
+        os.replace(self.parcial, self.destino)
+        if os.path.exists(self.ruta_progreso):
+            os.remove(self.ruta_progreso)
+        self._avisar(total, total)
+        return self.destino
+
+# --- ATLAS DE GUÍAS (ERGONOMÍA Y OTRAS MEDICIONES) ---
+class GuideAtlas:
+    # Todas las guías de una medición en una sola textura, subida una vez.
+    # Cambiar de guía es cambiar de región: sin disco ni GPU con la cámara activa.
+    def __init__(self, archivos):
+        self.nombres = []
+        self.regiones = {}
+        self.textura = None
+        rutas = [(os.path.basename(a), resource_find(a) or a) for a in archivos]
+        if cv2 is None:
+            # Sin cv2: una textura por guía, pero igual precargadas
+            for nombre, ruta in rutas:
+                self.nombres.append(nombre)
+                self.regiones[nombre] = CoreImage(ruta).texture
+            return
+
+        imagenes = []
+        for nombre, ruta in rutas:
+            img = cv2.imread(ruta, cv2.IMREAD_UNCHANGED)
+            if img is None:
+                print(f"Guía no encontrada: {ruta}")
+                continue
+            conversion = cv2.COLOR_BGRA2RGBA if img.ndim == 3 and img.shape[2] == 4 else cv2.COLOR_BGR2RGBA
+            imagenes.append((nombre, cv2.cvtColor(img, conversion)))
+        if not imagenes:
+            return
+
+        cols = math.ceil(math.sqrt(len(imagenes)))
+        filas = math.ceil(len(imagenes) / cols)
+        celda_w = max(img.shape[1] for _, img in imagenes)
+        celda_h = max(img.shape[0] for _, img in imagenes)
+        lienzo = np.zeros((filas * celda_h, cols * celda_w, 4), dtype=np.uint8)
+        ubicaciones = []
+        for i, (nombre, img) in enumerate(imagenes):
+            fila, col = divmod(i, cols)
+            h, w = img.shape[:2]
+            lienzo[fila * celda_h:fila * celda_h + h, col * celda_w:col * celda_w + w] = img
+            ubicaciones.append((nombre, col * celda_w, fila * celda_h, w, h))
+
+        alto = lienzo.shape[0]
+        self.textura = Texture.create(size=(lienzo.shape[1], alto), colorfmt='rgba')
+        # GL tiene el origen abajo: se invierte el lienzo y las coordenadas y
+        self.textura.blit_buffer(lienzo[::-1].tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+        for nombre, x, y, w, h in ubicaciones:
+            self.nombres.append(nombre)
+            self.regiones[nombre] = self.textura.get_region(x, alto - y - h, w, h)
+
+    @classmethod
+    def desde_carpeta(cls, carpeta):
+        return cls(sorted(glob.glob(os.path.join(carpeta, '*.png'))))
+
+# --- MAPAS DE ILUMINACIÓN / RUIDO POR SECTOR ---
+def interpolar_idw(xs, ys, vs, ancho, alto, potencia=2.0, paso=4, bloque=4_000_000):
+    # IDW vectorizado sobre una grilla reducida (1/paso) y reescalado bilineal.
+    # Coordenadas normalizadas 0..1 con y hacia abajo (como la imagen).
+    px = np.asarray(xs, dtype=np.float32)
+    py = np.asarray(ys, dtype=np.float32)
+    pv = np.asarray(vs, dtype=np.float32)
+    gw, gh = max(2, ancho // paso), max(2, alto // paso)
+    gx = (np.arange(gw, dtype=np.float32) + 0.5) / gw
+    gy = (np.arange(gh, dtype=np.float32) + 0.5) / gh
+    z = np.empty((gh, gw), dtype=np.float32)
+    # Se procesan bloques de filas para acotar la memoria (filas x columnas x puntos)
+    filas = max(1, bloque // (gw * len(pv)))
+    for f0 in range(0, gh, filas):
+        dx = gx[None, :, None] - px
+        dy = gy[f0:f0 + filas, None, None] - py
+        d2 = dx * dx + dy * dy
+        w = 1.0 / np.maximum(d2, 1e-12) ** (potencia / 2)
+        z[f0:f0 + filas] = (w * pv).sum(axis=-1) / w.sum(axis=-1)
+    return cv2.resize(z, (ancho, alto), interpolation=cv2.INTER_LINEAR)
+
+def estadisticas_lecturas(vs, tipo):
+    vs = np.asarray(vs, dtype=np.float64)
+    if tipo == "RUIDO":
+        # Los dB se promedian en energía
+        media = 10 * np.log10(np.mean(10 ** (vs / 10)))
+    else:
+        media = vs.mean()
+    datos = {'n': int(vs.size), 'min': float(vs.min()), 'max': float(vs.max()), 'media': float(media)}
+    if tipo == "ILUMINACION":
+        datos['uniformidad_min_med'] = float(vs.min() / media) if media else 0.0
+        datos['uniformidad_min_max'] = float(vs.min() / vs.max()) if vs.max() else 0.0
+    return datos
+
+def renderizar_mapa(lecturas, tipo, destino, lado=1000, croquis=None):
+    xs = [l[0] for l in lecturas]
+    ys = [l[1] for l in lecturas]
+    vs = [l[2] for l in lecturas]
+    if tipo == "RUIDO":
+        energia = interpolar_idw(xs, ys, 10 ** (np.asarray(vs) / 10), lado, lado)
+        z = 10 * np.log10(np.maximum(energia, 1e-12))
+    else:
+        z = interpolar_idw(xs, ys, vs, lado, lado)
+    vmin, vmax = float(min(vs)), float(max(vs))
+    norm = np.clip((z - vmin) / max(vmax - vmin, 1e-6) * 255, 0, 255).astype(np.uint8)
+    imagen = cv2.applyColorMap(norm, cv2.COLORMAP_JET)
+    if croquis is not None and os.path.exists(croquis):
+        fondo = cv2.imread(croquis)
+        if fondo is not None:
+            imagen = cv2.addWeighted(cv2.resize(fondo, (lado, lado)), 0.4, imagen, 0.6, 0)
+    for x, y, v in zip(xs, ys, vs):
+        centro = (int(x * lado), int(y * lado))
+        cv2.circle(imagen, centro, 6, (255, 255, 255), -1)
+        cv2.putText(imagen, f"{v:.0f}", (centro[0] + 8, centro[1] - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    datos = estadisticas_lecturas(vs, tipo)
+    unidad = "dBA" if tipo == "RUIDO" else "lux"
+    leyenda = f"min {datos['min']:.0f}  med {datos['media']:.0f}  max {datos['max']:.0f} {unidad}"
+    if 'uniformidad_min_med' in datos:
+        leyenda += f"  U {datos['uniformidad_min_med']:.2f}"
+    cv2.rectangle(imagen, (0, lado - 40), (lado, lado), (0, 0, 0), -1)
+    cv2.putText(imagen, leyenda, (10, lado - 12), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    escribir_imagen(destino, imagen, 'png')
+    escribir_metadatos(destino, tipo=tipo, lecturas=[list(l) for l in lecturas], **datos)
+    return datos
+
+# --- SONÓMETRO (RUIDO) ---
+def curva_ponderacion(frecuencias, curva='A'):
+    # Curvas A y C de IEC 61672 como ganancia lineal, normalizadas a 0 dB en 1 kHz
+    def respuesta(f):
+        f2 = np.asarray(f, dtype=np.float64) ** 2
+        c1, c2, c3, c4 = 20.598997 ** 2, 107.65265 ** 2, 737.86223 ** 2, 12194.217 ** 2
+        if curva == 'C':
+            return c4 * f2 / ((f2 + c1) * (f2 + c4))
+        return c4 * f2 ** 2 / ((f2 + c1) * np.sqrt((f2 + c2) * (f2 + c3)) * (f2 + c4))
+    return respuesta(frecuencias) / respuesta(1000.0)
+
+class MedidorSonido:
+    # Niveles cada 125 ms (constante "Fast"). Memoria constante: acumulado de
+    # energía, extremos y un histograma de niveles de 0.1 dB para los percentiles.
+    # La ponderación se aplica sobre el espectro de cada bloque (rfft de todos
+    # los bloques juntos); LCpeak sale de la señal C reconstruida (irfft).
+    OFFSET_POR_DEFECTO = 120.0  # dB SPL de una señal de valor eficaz 1.0 (0 dBFS)
+    RESOLUCION_DB = 0.1
+    RANGO_DB = 160.0
+
+    def __init__(self, tasa, offset_db=None, bloque_s=0.125):
+        self.tasa = tasa
+        self.offset_db = self.OFFSET_POR_DEFECTO if offset_db is None else offset_db
+        self.n = int(tasa * bloque_s)
+        frecuencias = np.fft.rfftfreq(self.n, 1.0 / tasa)
+        # Parseval con rfft: los bins intermedios cuentan dos veces
+        parseval = np.full(frecuencias.size, 2.0)
+        parseval[0] = 1.0
+        if self.n % 2 == 0:
+            parseval[-1] = 1.0
+        parseval /= float(self.n) ** 2
+        self._pesos_a = (curva_ponderacion(frecuencias, 'A') ** 2 * parseval).astype(np.float32)
+        self._pesos_c = (curva_ponderacion(frecuencias, 'C') ** 2 * parseval).astype(np.float32)
+        self._ganancia_c = curva_ponderacion(frecuencias, 'C').astype(np.float32)
+        self._pendiente = np.zeros(0, dtype=np.float32)
+        self.histograma = np.zeros(int(self.RANGO_DB / self.RESOLUCION_DB), dtype=np.int64)
+        self.energia_a = 0.0
+        self.energia_c = 0.0
+        self.bloques = 0
+        self.lamax = -math.inf
+        self.lamin = math.inf
+        self.pico_c = 0.0
+        self.ultimo = None
+
+    def _nivel(self, media_cuadratica):
+        return 10 * np.log10(np.maximum(media_cuadratica, 1e-20)) + self.offset_db
+
+    def procesar(self, muestras):
+        muestras = np.concatenate((self._pendiente, np.asarray(muestras, dtype=np.float32)))
+        m = muestras.size // self.n
+        self._pendiente = muestras[m * self.n:]
+        if not m:
+            return
+        bloques = muestras[:m * self.n].reshape(m, self.n)
+        espectro = np.fft.rfft(bloques, axis=1)
+        potencia = espectro.real ** 2 + espectro.imag ** 2
+        ms_a = potencia @ self._pesos_a
+        ms_c = potencia @ self._pesos_c
+        senal_c = np.fft.irfft(espectro * self._ganancia_c, n=self.n, axis=1)
+        self.pico_c = max(self.pico_c, float(np.abs(senal_c).max()))
+        niveles = self._nivel(ms_a)
+        self.energia_a += float(ms_a.sum())
+        self.energia_c += float(ms_c.sum())
+        self.bloques += m
+        self.lamax = max(self.lamax, float(niveles.max()))
+        self.lamin = min(self.lamin, float(niveles.min()))
+        self.ultimo = float(niveles[-1])
+        indices = np.clip((niveles / self.RESOLUCION_DB).astype(np.int64), 0, self.histograma.size - 1)
+        self.histograma += np.bincount(indices, minlength=self.histograma.size)
+
+    def percentil_excedido(self, porcentaje):
+        # LAN: nivel superado el N % del tiempo
+        acumulado = np.cumsum(self.histograma[::-1])
+        i = int(np.searchsorted(acumulado, self.bloques * porcentaje / 100.0))
+        return (self.histograma.size - 1 - i) * self.RESOLUCION_DB
+
+    def resultado(self):
+        if not self.bloques:
+            return {}
+        return {
+            'duracion': self.bloques * self.n / self.tasa,
+            'la': self.ultimo,
+            'laeq': float(self._nivel(self.energia_a / self.bloques)),
+            'lamax': self.lamax,
+            'lamin': self.lamin,
+            'la10': self.percentil_excedido(10),
+            'la50': self.percentil_excedido(50),
+            'la90': self.percentil_excedido(90),
+            'lceq': float(self._nivel(self.energia_c / self.bloques)),
+            'lcpeak': float(self._nivel(self.pico_c ** 2)),
+        }
+
+class FuenteMicrofono:
+    # AudioRecord PCM 16 bits mono. UNPROCESSED (API 24+) evita el AGC y los
+    # filtros de voz; si el equipo no lo soporta se usa VOICE_RECOGNITION.
+    nombre = 'microfono'
+
+    def __init__(self, tasa=48000):
+        AudioRecord = autoclass('android.media.AudioRecord')
+        AudioFormat = autoclass('android.media.AudioFormat')
+        AudioSource = autoclass('android.media.MediaRecorder$AudioSource')
+        self.tasa = tasa
+        minimo = AudioRecord.getMinBufferSize(tasa, AudioFormat.CHANNEL_IN_MONO, AudioFormat.ENCODING_PCM_16BIT)
+        for origen in (9, AudioSource.VOICE_RECOGNITION):  # 9 = UNPROCESSED
+            self.grabador = AudioRecord(origen, tasa, AudioFormat.CHANNEL_IN_MONO,
+                                        AudioFormat.ENCODING_PCM_16BIT, max(minimo, tasa))
+            if self.grabador.getState() == AudioRecord.STATE_INITIALIZED:
+                break
+            self.grabador.release()
+        else:
+            raise RuntimeError("No se pudo abrir el micrófono")
+        self.grabador.startRecording()
+        self._buffer = bytearray(tasa // 5)
+
+    def leer(self):
+        n = self.grabador.read(self._buffer, 0, len(self._buffer))
+        if n <= 0:
+            return None
+        return np.frombuffer(bytes(self._buffer[:n - n % 2]), dtype='<i2').astype(np.float32) / 32768.0
+
+    def cerrar(self):
+        self.grabador.stop()
+        self.grabador.release()
+
+class FuenteWav:
+    # Para probar en escritorio: WAV PCM 16 bits (los canales se promedian).
+    # Con tiempo_real se entrega al ritmo de la grabación, como el micrófono.
+    def __init__(self, ruta, tiempo_real=True, bloque_s=0.1):
+        self.nombre = os.path.basename(ruta)
+        self.archivo = wave.open(ruta, 'rb')
+        if self.archivo.getsampwidth() != 2:
+            self.archivo.close()
+            raise ValueError("Solo WAV PCM de 16 bits")
+        self.tasa = self.archivo.getframerate()
+        self.canales = self.archivo.getnchannels()
+        self.cuadros = int(self.tasa * bloque_s)
+        self.tiempo_real = tiempo_real
+        self._reloj = time.monotonic()
+
+    def leer(self):
+        datos = self.archivo.readframes(self.cuadros)
+        if not datos:
+            return None
+        muestras = np.frombuffer(datos, dtype='<i2').astype(np.float32) / 32768.0
+        if self.canales > 1:
+            muestras = muestras.reshape(-1, self.canales).mean(axis=1)
+        if self.tiempo_real:
+            self._reloj += muestras.size / self.tasa
+            time.sleep(max(0.0, self._reloj - time.monotonic()))
+        return muestras
+
+    def cerrar(self):
+        self.archivo.close()
+
+class Sonometro:
+    # Hilo de captura + análisis; publica lecturas en el hilo de Kivy
+    def __init__(self, fuente, offset_db=None, on_lectura=None, on_fin=None, intervalo=0.5):
+        self.fuente = fuente
+        self.medidor = MedidorSonido(fuente.tasa, offset_db)
+        self.on_lectura = on_lectura
+        self.on_fin = on_fin
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._correr, name='sonometro', daemon=True)
+        self._hilo.start()
+
+    def detener(self, esperar=False):
+        self._detener.set()
+        if esperar and self._hilo is not None:
+            self._hilo.join()
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def _correr(self):
+        error = None
+        proxima = time.monotonic() + self.intervalo
+        try:
+            while not self._detener.is_set():
+                muestras = self.fuente.leer()
+                if muestras is None:
+                    break
+                self.medidor.procesar(muestras)
+                if self.on_lectura and time.monotonic() >= proxima:
+                    proxima += self.intervalo
+                    mainthread(self.on_lectura)(self.medidor.resultado())
+        except Exception as e:
+            print(f"Error Sonómetro: {e}")
+            error = e
+        finally:
+            self.fuente.cerrar()
+        if self.on_fin:
+            mainthread(self.on_fin)(self.medidor.resultado(), error)
+
+def offset_sonometro(carpeta, modelo):
+    # calibracion_ruido_<modelo>.json: {"offset_db": ...} ajustado con un calibrador acústico
+    ruta = os.path.join(carpeta, f"calibracion_ruido_{re.sub(r'[^A-Za-z0-9_-]', '_', modelo)}.json")
+    if os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as f:
+            return float(json.load(f)['offset_db'])
+    return None
+
+# --- TERMOGRAFÍA RADIOMÉTRICA (BETA) ---
+# Cuadros crudos uint16 en "TLinear" (0.01 K por cuenta), el formato de salida
+# más común de los núcleos radiométricos (Lepton, InfiRay, FLIR).
+ESCALA_RADIOMETRICA = 0.01
+OFFSET_RADIOMETRICO = -273.15
+RESOLUCIONES_TERMICAS = ((640, 480), (640, 512), (384, 288), (320, 240), (256, 192), (160, 120), (80, 60))
+EXTENSIONES_TERMICAS = ('.npy', '.raw', '.bin', '.tif', '.tiff')
+# "pared_160x120.raw": la resolución del crudo escrita en el nombre
+_RESOLUCION_EN_NOMBRE = re.compile(r'(\d{2,4})[xX](\d{2,4})')
+
+def resolucion_crudo(ruta, pixeles):
+    # Del nombre, de un sidecar .json {"ancho", "alto"} o, si el tamaño calza
+    # con una sola resolución conocida, del tamaño. Un 640x480 también es
+    # 4 cuadros de 320x240 o 16 de 160x120: ante la duda no se adivina.
+    nombre = os.path.basename(ruta)
+    coincidencias = _RESOLUCION_EN_NOMBRE.findall(os.path.splitext(nombre)[0])
+    if coincidencias:
+        return tuple(int(v) for v in coincidencias[-1])
+    if os.path.exists(ruta + '.json'):
+        try:
+            with open(ruta + '.json', encoding='utf-8') as f:
+                datos = json.load(f)
+            return int(datos['ancho']), int(datos['alto'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Sidecar sin ancho/alto: {nombre}.json")
+    posibles = [(ancho, alto) for ancho, alto in RESOLUCIONES_TERMICAS if pixeles % (ancho * alto) == 0]
+    if len(posibles) == 1:
+        return posibles[0]
+    if not posibles:
+        raise ValueError(f"Resolución desconocida: {nombre}")
+    raise ValueError(f"Resolución ambigua: {nombre}\nAgregar _ANCHOxALTO al nombre")
+PALETAS_TERMICAS = {}
+
+def crudo_a_celsius(crudo):
+    return crudo.astype(np.float32) * ESCALA_RADIOMETRICA + OFFSET_RADIOMETRICO
+
+def celsius_a_crudo(temp):
+    return np.clip((temp - OFFSET_RADIOMETRICO) / ESCALA_RADIOMETRICA, 0, 65535).astype(np.uint16)
+
+def _paleta_interpolada(puntos):
+    # [(posición 0..1, (B, G, R)), ...] -> LUT de 256 colores BGR
+    x = np.linspace(0, 1, 256)
+    pos = [p for p, _ in puntos]
+    return np.stack([np.interp(x, pos, [c[i] for _, c in puntos]) for i in range(3)], axis=1).astype(np.uint8)
+
+def paleta_termica(nombre):
+    # Las LUT se arman una sola vez; colorear un cuadro es solo indexarlas
+    if not PALETAS_TERMICAS:
+        gradiente = np.arange(256, dtype=np.uint8).reshape(256, 1)
+        PALETAS_TERMICAS['hierro'] = _paleta_interpolada([
+            (0.0, (0, 0, 0)), (0.25, (140, 0, 32)), (0.5, (150, 0, 180)),
+            (0.75, (0, 120, 255)), (0.9, (0, 220, 255)), (1.0, (255, 255, 255))])
+        PALETAS_TERMICAS['arcoiris'] = cv2.applyColorMap(gradiente, cv2.COLORMAP_JET).reshape(256, 3)
+        PALETAS_TERMICAS['gris'] = np.repeat(gradiente, 3, axis=1)
+    return PALETAS_TERMICAS[nombre]
+
+def analizar_termico(crudo, paleta='hierro', umbral=None, area_minima=20, rango=None):
+    temp = crudo_a_celsius(crudo)
+    tmin, tmax, tmed = float(temp.min()), float(temp.max()), float(temp.mean())
+    lo, hi = rango or (tmin, tmax)
+    indices = np.clip((temp - lo) * (255.0 / max(hi - lo, 1e-3)), 0, 255).astype(np.uint8)
+    imagen = np.take(paleta_termica(paleta), indices, axis=0)
+    # Umbral automático: a mitad de camino entre la media y el máximo
+    if umbral is None:
+        umbral = tmed + 0.5 * (tmax - tmed) if tmax - tmed >= 2 else tmax + 1
+    mascara = (temp >= umbral).astype(np.uint8)
+    n, etiquetas, stats, centroides = cv2.connectedComponentsWithStats(mascara, connectivity=8)
+    regiones = []
+    for i in np.nonzero(stats[1:, cv2.CC_STAT_AREA] >= area_minima)[0] + 1:
+        x, y, w, h, area = (int(v) for v in stats[i])
+        zona = temp[y:y + h, x:x + w][etiquetas[y:y + h, x:x + w] == i]
+        regiones.append({'x': x, 'y': y, 'w': w, 'h': h, 'area': area,
+                         'tmin': float(zona.min()), 'tmax': float(zona.max()), 'tmed': float(zona.mean())})
+    regiones.sort(key=lambda r: r['tmax'], reverse=True)
+    for n_region, r in enumerate(regiones, 1):
+        cv2.rectangle(imagen, (r['x'], r['y']), (r['x'] + r['w'], r['y'] + r['h']), (255, 255, 255), 1)
+        cv2.putText(imagen, f"R{n_region} {r['tmax']:.1f}C", (r['x'], max(12, r['y'] - 4)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
+    fila, columna = np.unravel_index(int(np.argmax(temp)), temp.shape)
+    cv2.drawMarker(imagen, (int(columna), int(fila)), (0, 255, 0), cv2.MARKER_CROSS, 14, 2)
+    return {'imagen': imagen, 'tmin': tmin, 'tmax': tmax, 'tmed': tmed,
+            'umbral': float(umbral), 'regiones': regiones}
+
+class FuenteTermicaArchivo:
+    # .npy (h, w) o (n, h, w); .raw/.bin uint16 little-endian (resolución en
+    # resolucion_crudo); .tif de 16 bits. Las secuencias se recorren en bucle.
+    def __init__(self, ruta):
+        self.nombre = os.path.basename(ruta)
+        ext = os.path.splitext(ruta)[1].lower()
+        if ext == '.npy':
+            cuadros = np.load(ruta, mmap_mode='r')
+        elif ext in ('.raw', '.bin'):
+            tam = os.path.getsize(ruta)
+            if tam == 0 or tam % 2:
+                raise ValueError(f"No es un crudo de 16 bits: {self.nombre}")
+            ancho, alto = resolucion_crudo(ruta, tam // 2)
+            if (tam // 2) % (ancho * alto):
+                raise ValueError(f"El tamaño no corresponde a {ancho}x{alto}: {self.nombre}")
+            cuadros = np.memmap(ruta, dtype='<u2', mode='r').reshape(-1, alto, ancho)
+        else:
+            cuadros = cv2.imread(ruta, cv2.IMREAD_UNCHANGED)
+            if cuadros is None or cuadros.dtype != np.uint16:
+                raise ValueError(f"No es una imagen radiométrica de 16 bits: {self.nombre}")
+        if cuadros.ndim == 2:
+            cuadros = cuadros[None]
+        self.cuadros = cuadros
+        self.actual = 0
+
+    def leer(self):
+        crudo = np.asarray(self.cuadros[self.actual % len(self.cuadros)], dtype=np.uint16)
+        self.actual += 1
+        return crudo
+
+class FuenteTermicaSimulada:
+    # Tablero a ~24 °C con tres puntos calientes que se desplazan y ruido de sensor
+    nombre = 'simulada'
+
+    def __init__(self, ancho=640, alto=480, semilla=0):
+        self.rng = np.random.default_rng(semilla)
+        self.yy, self.xx = np.mgrid[0:alto, 0:ancho].astype(np.float32)
+        self.fondo = 22.0 + 4.0 * self.yy / alto
+        self.puntos = [(0.3, 0.4, 68.0, 18.0), (0.65, 0.55, 47.0, 30.0), (0.8, 0.2, 38.0, 12.0)]
+        self.t = 0.0
+
+    def leer(self):
+        self.t += 0.1
+        alto, ancho = self.fondo.shape
+        temp = self.fondo + self.rng.normal(0, 0.15, self.fondo.shape).astype(np.float32)
+        for px, py, pico, radio in self.puntos:
+            cx = px * ancho + 10 * math.sin(self.t)
+            cy = py * alto + 6 * math.cos(self.t * 0.7)
+            temp += (pico - 24.0) * np.exp(-((self.xx - cx) ** 2 + (self.yy - cy) ** 2) / (2 * radio ** 2))
+        return celsius_a_crudo(temp)
+
+# --- CÁMARA SINTÉTICA (ESCRITORIO SIN CÁMARA / BENCHMARK) ---
+# CIMACAM_CAMARA=sintetica            -> patrón en movimiento
+# CIMACAM_CAMARA=sintetica:/carpeta   -> las imágenes de la carpeta, en bucle
+def camara_sintetica_activa():
+    return os.environ.get('CIMACAM_CAMARA', '').startswith('sintetica')
+
+def sondear_camaras_sinteticas():
+    # Principal, frontal y gran angular, como un teléfono típico
+    resoluciones = [[1920, 1080], [1280, 720], [640, 480]]
+    return [{'index': 0, 'facing': 'back', 'orientacion': 0, 'focal': 4.2, 'resoluciones': resoluciones},
+            {'index': 1, 'facing': 'front', 'orientacion': 0, 'focal': 3.0, 'resoluciones': resoluciones},
+            {'index': 2, 'facing': 'back', 'orientacion': 0, 'focal': 2.2, 'resoluciones': resoluciones}]
+
+class CamaraSintetica(EventDispatcher):
+    # Misma interfaz que los proveedores de kivy.core.camera (start/stop,
+    # texture, _buffer + _copy_to_gpu, on_texture), sin tocar hardware
+    __events__ = ('on_load', 'on_texture')
+    fps = 30
+
+    def __init__(self, index=0, resolution=(1920, 1080), stopped=False, **kwargs):
+        super(CamaraSintetica, self).__init__()
+        self._index = index
+        self._resolution = tuple(resolution) if resolution and resolution[0] > 0 else (1920, 1080)
+        self._format = 'bgr'
+        self._buffer = None
+        self._evento = None
+        self._n = 0
+        self.stopped = True
+        ancho, alto = self._resolution
+        self._texture = Texture.create(size=(ancho, alto), colorfmt='rgb')
+        self._texture.flip_vertical()
+        self._cuadros = self._cargar_carpeta(os.environ.get('CIMACAM_CAMARA', '').partition(':')[2])
+        if not self._cuadros:
+            self._cuadros = [self._patron()]
+        self.dispatch('on_load')
+        if not stopped:
+            self.start()
+
+    texture = property(lambda self: self._texture)
+
+    def _cargar_carpeta(self, carpeta, maximo=60):
+        if not carpeta or not os.path.isdir(carpeta):
+            return []
+        cuadros = []
+        for ruta in sorted(glob.glob(os.path.join(carpeta, '*')))[:maximo]:
+            frame = cv2.imread(ruta, cv2.IMREAD_COLOR)
+            if frame is not None:
+                cuadros.append(cv2.resize(frame, self._resolution, interpolation=cv2.INTER_AREA))
+        return cuadros
+
+    def _patron(self, resolucion=None):
+        # Degradado con grilla y texto (con detalle para la nitidez); el tono cambia con el índice
+        ancho, alto = resolucion or self._resolution
+        x = np.linspace(0, 255, ancho, dtype=np.float32)
+        y = np.linspace(0, 255, alto, dtype=np.float32)[:, None]
+        frame = np.empty((alto, ancho, 3), dtype=np.uint8)
+        frame[..., 0] = (x + 80 * self._index) % 256
+        frame[..., 1] = y
+        frame[..., 2] = (255 - x * 0.5 - y * 0.5)
+        frame[::40] = 255
+        frame[:, ::40] = 255
+        cv2.putText(frame, f"CAM {self._index}", (ancho // 3, alto // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    alto / 200, (0, 0, 0), max(2, alto // 150))
+        return frame
+
+    def start(self):
+        self.stopped = False
+        if self._evento is None:
+            self._evento = Clock.schedule_interval(self._update, 1.0 / self.fps)
+
+    def stop(self):
+        self.stopped = True
+        if self._evento is not None:
+            self._evento.cancel()
+            self._evento = None
+
+    def _update(self, dt):
+        if self.stopped:
+            return
+        frame = self._cuadros[self._n % len(self._cuadros)]
+        if len(self._cuadros) == 1:
+            # El patrón se desplaza para que el preview tenga movimiento
+            frame = np.roll(frame, (self._n * 8) % frame.shape[1], axis=1)
+        self._n += 1
+        self._buffer = frame.tobytes()
+        self._copy_to_gpu()
+
+    def _copy_to_gpu(self):
+        self._texture.blit_buffer(self._buffer, colorfmt=self._format)
+        self._buffer = None
+        self.dispatch('on_texture')
+
+    def tomar_still(self, resolucion, on_still):
+        # Como takePicture en Android: la foto llega aparte, a la resolución pedida
+        ancho, alto = resolucion
+        n = max(0, self._n - 1)
+        if len(self._cuadros) == 1:
+            frame = self._patron((ancho, alto))
+            frame = np.roll(frame, (n * 8 * ancho // self._resolution[0]) % ancho, axis=1)
+        else:
+            frame = cv2.resize(self._cuadros[n % len(self._cuadros)], (ancho, alto), interpolation=cv2.INTER_CUBIC)
+        Clock.schedule_once(lambda dt: on_still((frame, (ancho, alto), 'bgr', False)), 0)
+
+    def on_texture(self):
+        pass
+
+    def on_load(self):
+        pass
+
+def tomar_still_android(proveedor, resolucion, on_still, calidad=95):
+    # takePicture con la resolución de captura mientras el preview sigue en la
+    # resolución de pantalla; el preview se reanuda apenas llega el JPEG
+    from jnius import PythonJavaClass, java_method
+
+    class CallbackFoto(PythonJavaClass):
+        __javainterfaces__ = ['android/hardware/Camera$PictureCallback']
+        __javacontext__ = 'app'
+
+        @java_method('([BLandroid/hardware/Camera;)V')
+        def onPictureTaken(self, data, camera):
+            proveedor._callback_foto = None
+            try:
+                camera.startPreview()
+            except Exception as e:
+                print(f"Error Preview: {e}")
+            jpeg = data.tostring() if hasattr(data, 'tostring') else bytes(data)
+            mainthread(on_still)((jpeg, tuple(resolucion), 'jpeg', False) if jpeg else None)
+
+    camara = proveedor._android_camera
+    params = camara.getParameters()
+    params.setPictureSize(int(resolucion[0]), int(resolucion[1]))
+    params.setJpegQuality(int(calidad))
+    camara.setParameters(params)
+    # La referencia evita que el recolector se lleve el callback antes de tiempo
+    proveedor._callback_foto = CallbackFoto()
+    camara.takePicture(None, None, proveedor._callback_foto)
+
+def fijar_fps_android(proveedor, fps):
+    # Baja el ritmo del sensor, no solo el de updateTexImage: de los rangos
+    # soportados que incluyen `fps`, el de tope más bajo (si ninguno lo incluye,
+    # el de piso más bajo). None vuelve al rango más rápido.
+    camara = proveedor._android_camera
+    params = camara.getParameters()
+    soportados = params.getSupportedPreviewFpsRange()
+    rangos = [tuple(soportados.get(i)) for i in range(soportados.size())]
+    if not rangos:
+        return
+    if fps:
+        incluyen = [r for r in rangos if r[0] <= fps * 1000 <= r[1]]
+        if incluyen:
+            rango = min(incluyen, key=lambda r: (r[1], r[0]))
+        else:
+            rango = min(rangos)
+    else:
+        rango = max(rangos, key=lambda r: (r[1], r[0]))
+    if getattr(proveedor, '_rango_fps', None) == rango:
+        return
+    params.setPreviewFpsRange(int(rango[0]), int(rango[1]))
+    camara.setParameters(params)
+    proveedor._rango_fps = rango
+
+# --- CAPACIDADES DE LAS CÁMARAS (SONDEO ÚNICO POR MODELO) ---
+def sondear_camaras_android():
+    CameraAndroid = autoclass('android.hardware.Camera')
+    CameraInfo = autoclass('android.hardware.Camera$CameraInfo')
+    camaras = []
+    for i in range(CameraAndroid.getNumberOfCameras()):
+        info = CameraInfo()
+        CameraAndroid.getCameraInfo(i, info)
+        datos = {'index': i, 'facing': 'front' if info.facing == CameraInfo.CAMERA_FACING_FRONT else 'back',
+                 'orientacion': info.orientation, 'focal': None, 'resoluciones': []}
+        try:
+            cam = CameraAndroid.open(i)
+            try:
+                params = cam.getParameters()
+                tamanios = params.getSupportedPreviewSizes()
+                datos['resoluciones'] = [[tamanios.get(k).width, tamanios.get(k).height]
+                                         for k in range(tamanios.size())]
+                fotos = params.getSupportedPictureSizes()
+                datos['fotos'] = [[fotos.get(k).width, fotos.get(k).height] for k in range(fotos.size())]
+                datos['focal'] = params.getFocalLength()
+            finally:
+                cam.release()
+        except Exception as e:
+            print(f"Sondeo cámara {i}: {e}")
+        camaras.append(datos)
+    return camaras
+
+def sondear_camaras_opencv(maximo=4):
+    camaras = []
+    for i in range(maximo):
+        cap = cv2.VideoCapture(i)
+        try:
+            ok, frame = cap.read() if cap.isOpened() else (False, None)
+            if not ok:
+                break
+            h, w = frame.shape[:2]
+            camaras.append({'index': i, 'facing': 'back', 'orientacion': 0, 'focal': None,
+                            'resoluciones': [[w, h]]})
+        finally:
+            cap.release()
+    return camaras
+
+class CameraCapabilities:
+    def __init__(self, carpeta):
+        self.modelo = self.modelo_dispositivo()
+        if camara_sintetica_activa():
+            self.modelo += '_sintetica'
+        self.ruta = os.path.join(carpeta, f"camaras_{re.sub(r'[^A-Za-z0-9_-]', '_', self.modelo)}.json")
+        self.camaras = None
+        self._hilo = None
+
+    @staticmethod
+    def modelo_dispositivo():
+        if platform == 'android' and autoclass:
+            Build = autoclass('android.os.Build')
+            return f"{Build.MANUFACTURER}_{Build.MODEL}"
+        return f"{platform}_{socket.gethostname()}"
+
+    def cargar_o_sondear(self):
+        # El sondeo abre cada cámara: se hace una vez por modelo, en segundo plano
+        if os.path.exists(self.ruta):
+            with open(self.ruta, encoding='utf-8') as f:
+                self.camaras = json.load(f)['camaras']
+            return
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._sondear, name='sondeo_camaras', daemon=True)
+        self._hilo.start()
+
+    def _sondear(self):
+        try:
+            if camara_sintetica_activa():
+                camaras = sondear_camaras_sinteticas()
+            elif platform == 'android' and autoclass:
+                camaras = sondear_camaras_android()
+            elif cv2 is not None:
+                camaras = sondear_camaras_opencv()
+            else:
+                return
+            self.camaras = camaras
+            if not camaras or not all(c['resoluciones'] for c in camaras):
+                # Alguna cámara no abrió (sin permiso, ocupada): se usa lo que hay
+                # pero no se guarda, así el próximo arranque vuelve a sondear
+                print("Sondeo de cámaras incompleto: no se guarda")
+                return
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+            with open(self.ruta, 'w', encoding='utf-8') as f:
+                json.dump({'modelo': self.modelo, 'camaras': camaras}, f)
+        except Exception as e:
+            print(f"Error Sondeo: {e}")
+
+    def buscar(self, index):
+        for c in self.camaras or []:
+            if c['index'] == index:
+                return c
+        return None
+
+    def indices_para(self, tipo):
+        # Devuelve los índices a probar, en orden. Sin sondeo se adivina como antes.
+        if not self.camaras:
+            return {'1x': [0], '0.5x': [2, 3, 4], 'front': [1]}.get(tipo, [0])
+        traseras = [c for c in self.camaras if c['facing'] == 'back']
+        frontales = [c for c in self.camaras if c['facing'] == 'front']
+        if tipo == '1x':
+            return [traseras[0]['index']] if traseras else [0]
+        if tipo == 'front':
+            return [frontales[0]['index']] if frontales else []
+        if tipo == '0.5x' and traseras:
+            # El gran angular es la trasera con menor distancia focal que la principal
+            principal = traseras[0].get('focal') or 0
+            anchas = [c for c in traseras[1:] if c.get('focal') and c['focal'] < principal]
+            return [min(anchas, key=lambda c: c['focal'])['index']] if anchas else []
+        return []
+
+    @staticmethod
+    def stills_aparte():
+        # Proveedores que entregan la foto aparte del preview
+        return platform == 'android' or camara_sintetica_activa()
+
+    def perfiles(self, index, pantalla):
+        # (preview, captura). Con fotos aparte, la foto usa la máxima resolución y
+        # el preview la más chica con el mismo aspecto que cubre la pantalla
+        # (fit_mode "cover" sin escalar hacia arriba). Si no, un único perfil.
+        camara = self.buscar(index)
+        if not camara or not camara['resoluciones'] or not self.stills_aparte():
+            return self.resolucion_para(index, (1920, 1080)), None
+        area = lambda r: r[0] * r[1]
+        captura = max(camara.get('fotos') or camara['resoluciones'], key=area)
+        aspecto = captura[0] / captura[1]
+        mismas = ([r for r in camara['resoluciones'] if abs(r[0] / r[1] - aspecto) < 0.02 * aspecto]
+                  or camara['resoluciones'])
+        largo, corto = max(pantalla), min(pantalla)
+        cubren = [r for r in mismas if max(r) >= largo and min(r) >= corto]
+        preview = min(cubren, key=area) if cubren else max(mismas, key=area)
+        return list(preview), list(captura)
+
+    def resolucion_para(self, index, deseada):
+        # La soportada más cercana a la deseada (en píxeles) sin pasarse si se puede
+        camara = self.buscar(index)
+        if not camara or not camara['resoluciones']:
+            return list(deseada)
+        objetivo = deseada[0] * deseada[1]
+        candidatas = [r for r in camara['resoluciones'] if r[0] * r[1] <= objetivo] or camara['resoluciones']
+        return list(min(candidatas, key=lambda r: abs(r[0] * r[1] - objetivo)))
+
+# --- PREVIEW EN UNA SOLA PASADA (GLSL) ---
+# Cebra: franjas sobre lo quemado. Falso color: violeta/azul subexpuesto,
+# verde en tonos medios, rosa en piel, rojo quemado (como un monitor de cine).
+SHADER_PREVIEW = '''
+$HEADER$
+uniform sampler2D texture1;
+uniform vec3 guia_x;
+uniform vec3 guia_y;
+uniform vec2 guia_pos;
+uniform vec2 guia_tam;
+uniform float guia_opacidad;
+uniform float modo;
+uniform float umbral_cebra;
+
+vec3 falso_color(float y) {
+    if (y < 0.03) return vec3(0.5, 0.0, 0.6);
+    if (y < 0.10) return vec3(0.0, 0.3, 1.0);
+    if (y > 0.97) return vec3(1.0, 0.0, 0.0);
+    if (y > 0.90) return vec3(1.0, 1.0, 0.0);
+    if (y > 0.38 && y < 0.48) return vec3(0.2, 0.8, 0.2);
+    if (y > 0.52 && y < 0.58) return vec3(1.0, 0.5, 0.7);
+    return vec3(y);
+}
+
+void main(void) {
+    vec3 color = texture2D(texture0, tex_coord0).rgb;
+    float y = dot(color, vec3(0.299, 0.587, 0.114));
+    if (modo > 1.5) {
+        color = falso_color(y);
+    } else if (modo > 0.5 && y > umbral_cebra) {
+        float franja = mod(floor((gl_FragCoord.x + gl_FragCoord.y) / 8.0), 2.0);
+        color = mix(color, vec3(franja), 0.7);
+    }
+    if (guia_opacidad > 0.0) {
+        vec3 t = vec3(tex_coord0, 1.0);
+        vec2 g = vec2(dot(guia_x, t), dot(guia_y, t));
+        if (g.x >= 0.0 && g.x <= 1.0 && g.y >= 0.0 && g.y <= 1.0) {
+            vec4 guia = texture2D(texture1, guia_pos + g * guia_tam);
+            color = mix(color, guia.rgb, guia.a * guia_opacidad);
+        }
+    }
+    gl_FragColor = vec4(color, 1.0) * frag_color;
+}
+'''
+
+MODOS_EXPOSICION = ['normal', 'cebra', 'falso_color']
+
+class PreviewCamara(Widget):
+    # Un rectángulo y un shader: la rotación y el recorte "cover" van en las
+    # coordenadas de textura de las esquinas, la guía (ajuste "contain", sin
+    # rotar) se mezcla en el mismo fragmento. Sin stencil ni PushMatrix/Rotate.
+    # Si el shader no compila queda el de kivy: se pierden guía y cebra,
+    # no la rotación ni el recorte.
+    texture = ObjectProperty(None, allownone=True)
+    texture_size = ListProperty([0, 0])
+    rotacion = NumericProperty(0)
+    guia = ObjectProperty(None, allownone=True)
+    guia_opacidad = NumericProperty(0.4)
+    modo_exposicion = OptionProperty('normal', options=MODOS_EXPOSICION)
+    umbral_cebra = NumericProperty(0.95)
+    _textura_vacia = None
+
+    def __init__(self, **kwargs):
+        self.canvas = RenderContext(use_parent_projection=True, use_parent_modelview=True,
+                                    use_parent_frag_modelview=True)
+        self.canvas.shader.fs = SHADER_PREVIEW
+        if not self.canvas.shader.success:
+            print("Shader de preview no compiló: sin guía ni cebra")
+        if PreviewCamara._textura_vacia is None:
+            PreviewCamara._textura_vacia = Texture.create(size=(1, 1), colorfmt='rgba')
+            PreviewCamara._textura_vacia.blit_buffer(b'\x00' * 4, colorfmt='rgba')
+        with self.canvas:
+            self._textura_guia = BindTexture(texture=PreviewCamara._textura_vacia, index=1)
+            Color(1, 1, 1, 1)
+            self._rect = Rectangle()
+        self.canvas['texture1'] = 1
+        self._actualizar = Clock.create_trigger(self.actualizar_geometria, -1)
+        super(PreviewCamara, self).__init__(**kwargs)
+        for propiedad in ('pos', 'size', 'texture', 'rotacion', 'guia', 'guia_opacidad'):
+            self.fbind(propiedad, self._actualizar)
+        self.fbind('modo_exposicion', self._uniformes_exposicion)
+        self.fbind('umbral_cebra', self._uniformes_exposicion)
+        self._uniformes_exposicion()
+
+    def _uniformes_exposicion(self, *args):
+        self.canvas['modo'] = float(MODOS_EXPOSICION.index(self.modo_exposicion))
+        self.canvas['umbral_cebra'] = float(self.umbral_cebra)
+
+    def alternar_exposicion(self):
+        i = MODOS_EXPOSICION.index(self.modo_exposicion)
+        self.modo_exposicion = MODOS_EXPOSICION[(i + 1) % len(MODOS_EXPOSICION)]
+
+    def actualizar_geometria(self, *args):
+        rect = self._rect
+        rect.pos = self.pos
+        rect.size = self.size
+        tex = self.texture
+        ancho, alto = self.size
+        if tex is None or not ancho or not alto:
+            rect.texture = None
+            return
+        if rect.texture is not tex:
+            rect.texture = tex
+        # Pantalla (u, v) -> píxeles centrados -> giro inverso -> textura
+        tw, th = tex.size
+        giro = int(self.rotacion) % 360 // 90
+        w_img, h_img = (ancho, alto) if giro % 2 == 0 else (alto, ancho)
+        escala = max(w_img / tw, h_img / th)
+        coseno, seno = ((1, 0), (0, -1), (-1, 0), (0, 1))[giro]
+        (u0, v0), (du, dv) = tex.uvpos, tex.uvsize
+
+        def camara(u, v):
+            px, py = (u - 0.5) * ancho, (v - 0.5) * alto
+            qx, qy = coseno * px - seno * py, seno * px + coseno * py
+            return u0 + du * (qx / (escala * tw) + 0.5), v0 + dv * (qy / (escala * th) + 0.5)
+        esquinas = [camara(0, 0), camara(1, 0), camara(1, 1), camara(0, 1)]
+        rect.tex_coords = [c for esquina in esquinas for c in esquina]
+        self._uniformes_guia(esquinas)
+
+    def _uniformes_guia(self, esquinas):
+        guia = self.guia
+        if guia is None or not self.guia_opacidad:
+            self.canvas['guia_opacidad'] = 0.0
+            self._textura_guia.texture = PreviewCamara._textura_vacia
+            return
+        # La guía se ubica en coordenadas de pantalla; el shader solo tiene las
+        # de la cámara, así que se le pasa la transformación afín entre ambas
+        ancho, alto = self.size
+        gw, gh = guia.size
+        escala = min(ancho / gw, alto / gh)
+        dx, dy = ancho / (escala * gw), alto / (escala * gh)
+        (cx, cy), (ax, ay), _, (bx, by) = esquinas
+        l11, l21, l12, l22 = ax - cx, ay - cy, bx - cx, by - cy
+        det = l11 * l22 - l12 * l21
+        i11, i12, i21, i22 = l22 / det, -l12 / det, -l21 / det, l11 / det
+        ex, ey = 0.5 - 0.5 * dx, 0.5 - 0.5 * dy
+        self.canvas['guia_x'] = [dx * i11, dx * i12, ex - dx * (i11 * cx + i12 * cy)]
+        self.canvas['guia_y'] = [dy * i21, dy * i22, ey - dy * (i21 * cx + i22 * cy)]
+        self.canvas['guia_pos'] = [float(c) for c in guia.uvpos]
+        self.canvas['guia_tam'] = [float(c) for c in guia.uvsize]
+        self.canvas['guia_opacidad'] = float(self.guia_opacidad)
+        self._textura_guia.texture = guia
+
+    @contextmanager
+    def sin_guia(self):
+        # Las fotos tomadas de la pantalla no llevan la guía
+        opacidad = self.canvas['guia_opacidad']
+        self.canvas['guia_opacidad'] = 0.0
+        try:
+            yield
+        finally:
+            self.canvas['guia_opacidad'] = opacidad
 
 # --- CLASE CÁMARA NATIVA MEJORADA ---
-class KivyCamera(Camera):
+# Misma interfaz que kivy.uix.camera.Camera, pero el proveedor nativo
+# (kivy.core.camera) se importa recién cuando se crea la cámara.
+class KivyCamera(PreviewCamara):
+    __events__ = ('on_first_frame',)
+    play = BooleanProperty(False)
+    index = NumericProperty(-1)
+    resolution = ListProperty([-1, -1])
     is_recording = BooleanProperty(False)
     is_paused = BooleanProperty(False)
+    # Video en la app: fps del archivo, largo de cada segmento y lado máximo
+    video_fps = NumericProperty(30)
+    video_segment_s = NumericProperty(120)
+    video_max_side = NumericProperty(1280)
+    record_time = StringProperty("")
+    grabador = None
+    _reloj_video = None
+    # Grabadores detenidos que todavía vacían su cola
+    _cerrando = []
     capture_count = NumericProperty(0)
-    status_info = StringProperty("Cámara lista") 
-    
+    status_info = StringProperty("Cámara lista")
+    # Formato/calidad de las fotos que codifica el pipeline
+    capture_format = OptionProperty('jpg', options=['jpg', 'webp', 'png'])
+    capture_quality = NumericProperty(90)
+    pending_writes = NumericProperty(0)
+    # 'sensor' lee el buffer crudo del proveedor; 'pantalla' re-renderiza el widget
+    capture_source = OptionProperty('sensor', options=['sensor', 'pantalla'])
+    # Cuadros guardados para la foto sin retardo y para la ráfaga
+    zsl_frames = NumericProperty(3)
+    burst_frames = NumericProperty(10)
+    # Varianza del Laplaciano: por debajo del umbral la foto se considera movida
+    blur_threshold = NumericProperty(50)
+    live_sharpness = NumericProperty(0)
+    # Medidor de luz en vivo (solo ILUMINACION)
+    light_meter = BooleanProperty(False)
+    live_lux = NumericProperty(0)
+    live_luma = NumericProperty(0)
+    live_histogram = ListProperty([])
+    # Lector de etiquetas QR / código de barras (solo INCENDIOS)
+    tag_scanner = BooleanProperty(False)
+    ultimo_codigo = StringProperty("")
+    tag_timeout = NumericProperty(10)
+    # Tiempo desde que se pide un lente hasta su primer cuadro
+    lens_switch_ms = NumericProperty(0)
+    # Perfil de captura: FOTO pide al sensor esta resolución (vacío = el cuadro del preview)
+    still_resolution = ListProperty([])
+    still_timeout = NumericProperty(3)
+    still_pendiente = False
+    _cuadro_crudo = None
+    _ultimo_buffer = None
+    _rafaga_restante = 0
+    _esperando_cuadro = False
+    _cambio_lente = None
+
     def __init__(self, **kwargs):
+        self._camera = None
         # Resolución FULL HD
         super(KivyCamera, self).__init__(resolution=(1920, 1080), index=0, play=False, **kwargs)
-        # Configuración agresiva para llenar pantalla
-        self.fit_mode = "cover" 
-        self.allow_stretch = True
-        self.keep_ratio = False 
+        self.pipeline = CapturePipeline() if cv2 is not None else None
+        self.ring = None
+        if cv2 is not None and self.zsl_frames > 0:
+            self.ring = RingBufferCuadros(max(self.zsl_frames, self.burst_frames))
+        self.analizador_foco = None
+        if cv2 is not None:
+            self.analizador_foco = AnalizadorEnVivo(
+                nitidez_cuadro, lambda nota: setattr(self, 'live_sharpness', nota), nombre='foco')
+        self.analizador_luz = None
+        self.analizador_etiquetas = None
+        self._vencer_codigo = Clock.create_trigger(lambda dt: setattr(self, 'ultimo_codigo', ''), self.tag_timeout)
+        self.fbind('index', self._on_index)
+        self.fbind('resolution', self._on_index)
+        self._on_index()
+
+    def on_light_meter(self, instance, activo):
+        if activo and self.analizador_luz is None and cv2 is not None:
+            calibracion = App.get_running_app().calibracion_lux()
+            self.analizador_luz = AnalizadorEnVivo(
+                lambda cuadro: medir_luz(cuadro, calibracion), self._luz_medida,
+                intervalo=0.3, nombre='luz')
+        if not activo:
+            self.live_lux = 0
+            self.live_luma = 0
+            self.live_histogram = []
+
+    def _luz_medida(self, lectura):
+        if self.light_meter:
+            self.live_lux = lectura['lux']
+            self.live_luma = lectura['luma']
+            self.live_histogram = lectura['histograma']
+
+    def on_tag_scanner(self, instance, activo):
+        if activo and self.analizador_etiquetas is None and cv2 is not None:
+            self.analizador_etiquetas = AnalizadorEnVivo(
+                LectorEtiquetas(), self._etiqueta_leida, intervalo=0.25, nombre='etiquetas')
+        if not activo:
+            self._vencer_codigo.cancel()
+            self.ultimo_codigo = ""
+
+    def _etiqueta_leida(self, codigo):
+        if not self.tag_scanner or not codigo:
+            return
+        # El código sigue vigente mientras se encuadra el equipo para la foto
+        self._vencer_codigo.cancel()
+        self._vencer_codigo.timeout = self.tag_timeout
+        self._vencer_codigo()
+        if codigo == self.ultimo_codigo:
+            return
+        self.ultimo_codigo = codigo
+        app = App.get_running_app()
+        previo = app.store.extintor_por_codigo(codigo) if app.store is not None else None
+        self.status_info = f"ETIQUETA {codigo}\n{'Ya relevado' if previo else 'Equipo nuevo'}"
+        Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 2)
+
+    def analisis_captura(self):
+        # Mediciones que el worker calcula sobre el cuadro crudo de cada foto
+        analisis = {'nitidez': nitidez_cuadro}
+        if cv2 is not None:
+            analisis['phash'] = hash_cuadro
+        if self.light_meter and cv2 is not None:
+            calibracion = App.get_running_app().calibracion_lux()
+            analisis['lux'] = lambda cuadro: medir_luz(cuadro, calibracion)['lux']
+        return analisis
+
+    @trazado('cuadro')
+    def on_tex(self, camera):
+        self.texture = texture = camera.texture
+        self.texture_size = list(texture.size)
+        self.canvas.ask_update()
+        # En Android el primer tick llega antes que el primer cuadro del sensor
+        if not self._cuadro_nuevo(camera):
+            return
+        PERFIL.marcar('primer cuadro de cámara')
+        if self._esperando_cuadro:
+            self._esperando_cuadro = False
+            self.dispatch('on_first_frame')
+        if self.capture_source != 'sensor' or (self.ring is None and self.grabador is None):
+            return
+        cuadro = self.leer_cuadro_sensor(permitir_textura=False)
+        if cuadro is None:
+            return
+        if self.grabador is not None:
+            self.grabador.agregar(cuadro)
+        if self.ring is None:
+            return
+        self.ring.agregar(*cuadro)
+        if self.analizador_foco is not None:
+            self.analizador_foco.ofrecer(cuadro)
+        if self.light_meter and self.analizador_luz is not None:
+            self.analizador_luz.ofrecer(cuadro)
+        if self.tag_scanner and self.analizador_etiquetas is not None:
+            self.analizador_etiquetas.ofrecer(cuadro)
+        if self._rafaga_restante:
+            self._rafaga_restante -= 1
+            if not self._rafaga_restante:
+                self._cerrar_rafaga()
+
+    def _cuadro_nuevo(self, proveedor):
+        # Android despacha on_texture en cada tick del Clock, llegue o no un
+        # cuadro; cada cuadro del preview llega en otro objeto de buffer
+        if not hasattr(proveedor, 'grab_frame'):
+            return True
+        buffer = proveedor._buffer
+        if buffer is None or buffer is self._ultimo_buffer:
+            return False
+        self._ultimo_buffer = buffer
+        return True
+
+    def soltar_proveedor(self):
+        if self._camera is not None:
+            self._camera.unbind(on_texture=self.on_tex)
+            self._camera.stop()
+            # Android: hay que soltar el dispositivo antes de abrir otro
+            liberar = getattr(self._camera, '_release_camera', None)
+            if liberar is not None:
+                liberar()
+        self._camera = None
+        self._esperando_cuadro = True
+        self._cuadro_crudo = None
+        self._ultimo_buffer = None
+
+    def _on_index(self, *largs):
+        self.soltar_proveedor()
+        if self.index < 0:
+            return
+        with PERFIL.medir('proveedor de cámara'):
+            if camara_sintetica_activa():
+                CoreCamera = CamaraSintetica
+            else:
+                from kivy.core.camera import Camera as CoreCamera
+            if self.resolution[0] < 0 or self.resolution[1] < 0:
+                self._camera = CoreCamera(index=self.index, stopped=True)
+            else:
+                self._camera = CoreCamera(index=self.index, resolution=self.resolution, stopped=True)
+        self._enganchar_proveedor(self._camera)
+        if self.play:
+            self._camera.start()
+        self._camera.bind(on_texture=self.on_tex)
+
+    def on_play(self, instance, value):
+        if not self._camera:
+            return
+        if not value:
+            self._camera.stop()
+            return
+        try:
+            self._camera.start()
+        except Exception as e:
+            # Otra app pudo quedarse con la cámara mientras estábamos en pausa
+            print(f"Reabriendo cámara: {e}")
+            self._on_index()
+
+    def _enganchar_proveedor(self, proveedor):
+        # Los proveedores de escritorio descartan _buffer al subirlo a la GPU;
+        # guardamos la referencia (sin copiar) para leer el cuadro del sensor
+        copiar_original = proveedor._copy_to_gpu
+
+        def copiar_a_gpu():
+            if proveedor._buffer is not None:
+                self._cuadro_crudo = (proveedor._buffer, tuple(proveedor._resolution), proveedor._format)
+            copiar_original()
+        proveedor._copy_to_gpu = copiar_a_gpu
+        if getattr(proveedor, '_android_camera', None) is not None:
+            proveedor.tomar_still = functools.partial(tomar_still_android, proveedor)
+
+    def leer_cuadro_sensor(self, permitir_textura=True):
+        # Devuelve (pixels, size, colorfmt, invertir_y) a resolución del sensor
+        proveedor = self._camera
+        if proveedor is None:
+            return None
+        if hasattr(proveedor, 'grab_frame'):
+            # Android: copia del buffer NV21 del preview, sin pasar por GL
+            buf = proveedor.grab_frame()
+            if buf is not None:
+                return buf, tuple(proveedor._resolution), 'nv21', False
+        elif self._cuadro_crudo is not None:
+            buf, size, colorfmt = self._cuadro_crudo
+            return buf, size, colorfmt, False
+        if self.texture is None or not permitir_textura:
+            return None
+        # Último recurso: leer la textura de la cámara (sin rotar ni recortar)
+        return self.texture.pixels, self.texture.size, 'rgba', True
 
     def start_camera(self):
+        self.aplicar_perfiles()
         self.play = True
         self.status_info = ""
 
+    def aplicar_perfiles(self):
+        # El sondeo termina en segundo plano: el perfil se aplica al (re)abrir
+        app = App.get_running_app()
+        if not app.camaras or not app.camaras.camaras or self.index < 0:
+            return
+        preview, captura = app.camaras.perfiles(self.index, Window.size)
+        if list(self.resolution) != preview:
+            self.seleccionar_camara(self.index)
+        else:
+            self.still_resolution = captura or []
+
     def stop_camera(self):
+        if self.grabador is not None:
+            self.detener_grabacion()
         self.play = False
         self.status_info = "Cámara Pausada"
 
-    # --- CAMBIO DE LENTES ---
-    def cambiar_lente(self, tipo):
-        self.play = False 
-        
-        if tipo == '1x':
-            self.index = 0
-            self.status_info = "Lente: Principal"
-            Clock.schedule_once(lambda dt: self.reactivar(), 0.5)
-            
-        elif tipo == '0.5x':
-            self.status_info = "Buscando Gran Angular..."
-            # Intentamos índice 2, si falla probamos otros
-            Clock.schedule_once(lambda dt: self.probar_lente_extra(2), 0.5)
-            
-        elif tipo == 'front':
-            self.status_info = "Cámara Frontal"
-            Clock.schedule_once(lambda dt: self.probar_lente_extra(1), 0.5)
+    # --- ENERGÍA (LA DECIDE ControladorCamara) ---
+    def aplicar_energia(self, estado, reposo=False):
+        if estado == 'pausada':
+            self.stop_camera()
+            if reposo:
+                self.status_info = "En reposo\nTocar para seguir"
+            return
+        if self._camera is None:
+            # Se soltó con la app en segundo plano: se vuelve a abrir
+            self._on_index()
+        if not self.play:
+            self.start_camera()
+        self.limitar_fps(ControladorCamara.FPS_LENTO if estado == 'lenta' else None)
+
+    def limitar_fps(self, fps):
+        # Re-programa el _update del proveedor (Android, OpenCV, sintética): menos
+        # cuadros subidos a la GPU y analizados. None vuelve al ritmo propio.
+        proveedor = self._camera
+        if getattr(proveedor, '_android_camera', None) is not None:
+            try:
+                fijar_fps_android(proveedor, fps)
+            except Exception as e:
+                print(f"Error FPS: {e}")
+        for atributo in ('_update_ev', '_evento'):
+            evento = getattr(proveedor, atributo, None)
+            if evento is None:
+                continue
+            if not hasattr(proveedor, '_intervalo_propio'):
+                proveedor._intervalo_propio = evento.timeout
+            intervalo = proveedor._intervalo_propio
+            if fps:
+                intervalo = max(intervalo, 1.0 / fps)
+            if evento.timeout != intervalo:
+                evento.cancel()
+                setattr(proveedor, atributo, Clock.schedule_interval(proveedor._update, intervalo))
+
+    # --- CAMBIO DE LENTES ---
+    ETIQUETAS_LENTE = {'1x': "Principal", '0.5x': "Gran Angular", 'front': "Cámara Frontal"}
+
+    def on_first_frame(self, *args):
+        if self._cambio_lente is None:
+            return
+        tipo, t0, _, timeout = self._cambio_lente
+        timeout.cancel()
+        self._cambio_lente = None
+        self.lens_switch_ms = (time.perf_counter() - t0) * 1000
+        if TRAZA.activo:
+            TRAZA.registrar('cambio de lente', t0, self.lens_switch_ms / 1000, {'lente': tipo})
+        print(f"Cambio de lente {tipo}: {self.lens_switch_ms:.0f} ms")
+        self.status_info = f"Lente: {self.ETIQUETAS_LENTE.get(tipo, tipo)}"
+        Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 1.5)
+
+    def seleccionar_camara(self, indice):
+        # Un solo reinicio del proveedor aunque cambien índice y resolución
+        app = App.get_running_app()
+        resolucion, captura = app.camaras.perfiles(indice, Window.size) if app.camaras else ([1920, 1080], None)
+        self.still_resolution = captura or []
+        self.funbind('resolution', self._on_index)
+        self.resolution = resolucion
+        self.fbind('resolution', self._on_index)
+        if self.index != indice:
+            self.index = indice
+        else:
+            self._on_index()
+
+    @trazado('cambiar_lente')
+    def cambiar_lente(self, tipo):
+        app = App.get_running_app()
+        candidatos = app.camaras.indices_para(tipo) if app.camaras else [0]
+        if not candidatos:
+            self.status_info = "Lente no disponible"
+            return
+        if self._cambio_lente is not None:
+            self._cambio_lente[3].cancel()
+        self.status_info = f"Abriendo {self.ETIQUETAS_LENTE.get(tipo, tipo)}..."
+        self.play = True
+        self._cambio_lente = (tipo, time.perf_counter(), list(candidatos), None)
+        self._probar_siguiente()
+
+    def _probar_siguiente(self, *args):
+        # Se espera el primer cuadro real; si no llega, se prueba el siguiente índice
+        tipo, t0, candidatos, _ = self._cambio_lente
+        if not candidatos:
+            self._cambio_lente = None
+            self.status_info = "Lente no disponible"
+            self.seleccionar_camara(0)
+            return
+        indice = candidatos.pop(0)
+        timeout = Clock.schedule_once(self._probar_siguiente, 2.5)
+        self._cambio_lente = (tipo, t0, candidatos, timeout)
+        try:
+            self.seleccionar_camara(indice)
+        except Exception as e:
+            print(f"Falló ID {indice}: {e}")
+            timeout.cancel()
+            Clock.schedule_once(self._probar_siguiente, 0)
+
+    # --- FOTOS ---
+    def espacio_suficiente(self):
+        app = App.get_running_app()
+        puede, aviso = app.almacenamiento.verificar()
+        if not puede:
+            self.status_info = aviso
+        elif aviso and not app.almacenamiento.avisado:
+            app.almacenamiento.avisado = True
+            app.mostrar_aviso("Almacenamiento", aviso)
+        return puede
+
+    @trazado('take_photo')
+    def take_photo(self, es_extintor=False):
+        app = App.get_running_app()
+        if not self.espacio_suficiente():
+            return
+        try:
+            save_dir = app.path_puesto
+            if not os.path.exists(save_dir):
+                os.makedirs(save_dir, exist_ok=True)
+            
+            prefix = "EXT" if es_extintor else app.current_measurement_type[:3]
+
+            if self.pipeline is None:
+                # Sin cv2: guardado sincrónico como antes
+                filename = nombre_unico(save_dir, prefix, 'Foto', 'png')
+                with self.sin_guia():
+                    self.export_to_png(filename)
+                app.temp_photo_path = filename
+                self.abrir_formulario_extintor(es_extintor)
+                self.foto_guardada({'archivo': filename}, es_extintor)
+                return
+
+            if self.pipeline.lleno():
+                self.cola_llena()
+                return
+            filename = nombre_unico(save_dir, prefix, 'Foto', self.capture_format)
+            cuadro, rotacion = self.cuadro_actual()
+            app.temp_photo_path = filename
+            self.pending_writes += 1
+            guardar = lambda still: self._encolar_foto(filename, still or cuadro, rotacion, es_extintor)
+            if not self.pedir_still(guardar):
+                guardar(cuadro)
+            self.abrir_formulario_extintor(es_extintor)
+
+        except Exception as e:
+            self.status_info = f"Error: {str(e)}"
+
+    def _encolar_foto(self, filename, cuadro, rotacion, es_extintor):
+        formato, calidad = self.capture_format, self.capture_quality
+        analisis = self.analisis_captura()
+
+        def trabajo():
+            still = decodificar_still(cuadro)
+            pixels, size, colorfmt, invertir_y = still
+            frame = pixeles_a_bgr(pixels, size, colorfmt, invertir_y, rotacion)
+            escribir_imagen(filename, frame, formato, calidad)
+            campos = {nombre: fn(still) for nombre, fn in analisis.items()}
+            return escribir_metadatos(filename, archivo=filename, bytes=os.path.getsize(filename),
+                                      resolucion=list(size), miniatura=generar_miniatura(filename, frame), **campos)
+
+        if self.pipeline.submit(trabajo,
+                                on_done=lambda f: self.foto_guardada(f, es_extintor),
+                                on_error=lambda e: self.foto_fallida(e, filename)) is None:
+            self.cola_llena(filename)
+
+    def pedir_still(self, on_still):
+        # Foto a la resolución del perfil de captura; si el sensor no contesta a
+        # tiempo se usa el cuadro del preview (on_still recibe None)
+        tomar = getattr(self._camera, 'tomar_still', None)
+        if tomar is None or not self.still_resolution or self.capture_source != 'sensor':
+            return False
+        entregado = []
+
+        def listo(still):
+            if entregado:
+                return
+            entregado.append(True)
+            timeout.cancel()
+            self.still_pendiente = False
+            on_still(still)
+            # El preview se pudo haber quedado encendido esperando la foto
+            App.get_running_app().control_camara.revisar()
+        self.still_pendiente = True
+        timeout = Clock.schedule_once(lambda dt: listo(None), self.still_timeout)
+        try:
+            with TRAZA.tramo('pedir_still'):
+                tomar(tuple(self.still_resolution), listo)
+        except Exception as e:
+            print(f"Error Foto Completa: {e}")
+            listo(None)
+        return True
+
+    def cuadro_actual(self):
+        # En el hilo de la UI solo se leen los píxeles; el resto va al pool.
+        # Prioridad: cuadro visible al tocar (ring), buffer del sensor, widget.
+        app = App.get_running_app()
+        if self.capture_source == 'sensor':
+            if self.ring is not None and self.ring.escritos:
+                cuadro = self.ring.ultimos(1)[0]
+            else:
+                cuadro = self.leer_cuadro_sensor()
+            if cuadro is not None:
+                # La rotación se aplica una sola vez, sobre los píxeles, al guardar
+                return cuadro, app.cam_rotation
+        with self.sin_guia():
+            texture = self.export_as_image().texture
+        return (texture.pixels, texture.size, 'rgba', True), 0
+
+    # --- RÁFAGA: SE GUARDA EL CUADRO MÁS NÍTIDO ---
+    def take_burst(self):
+        if self.ring is None or not self.play:
+            return self.take_photo()
+        if not self.espacio_suficiente():
+            return
+        if not self._rafaga_restante:
+            self._rafaga_restante = int(self.burst_frames)
+            self.status_info = "Ráfaga..."
+
+    def _cerrar_rafaga(self):
+        app = App.get_running_app()
+        try:
+            save_dir = app.path_puesto
+            os.makedirs(save_dir, exist_ok=True)
+            prefix = app.current_measurement_type[:3]
+            filename = nombre_unico(save_dir, prefix, 'Rafaga', self.capture_format)
+            cuadros = self.ring.ultimos(int(self.burst_frames))
+            rotacion = app.cam_rotation
+            formato, calidad = self.capture_format, self.capture_quality
+            analisis = self.analisis_captura()
+            analisis.pop('nitidez')
+        except Exception as e:
+            self.status_info = f"Error: {str(e)}"
+            return
+
+        def trabajo():
+            notas = [nitidez_cuadro(c) for c in cuadros]
+            mejor = notas.index(max(notas))
+            pixels, size, colorfmt, invertir_y = cuadros[mejor]
+            frame = pixeles_a_bgr(pixels, size, colorfmt, invertir_y, rotacion)
+            escribir_imagen(filename, frame, formato, calidad)
+            campos = {nombre: fn(cuadros[mejor]) for nombre, fn in analisis.items()}
+            return escribir_metadatos(filename, archivo=filename, nitidez=notas[mejor],
+                                      rafaga=len(cuadros), bytes=os.path.getsize(filename),
+                                      miniatura=generar_miniatura(filename, frame), **campos)
+
+        app.temp_photo_path = filename
+        self.pending_writes += 1
+        if self.pipeline.submit(trabajo, on_done=self.foto_guardada,
+                                on_error=lambda e: self.foto_fallida(e, filename)) is None:
+            self.cola_llena(filename)
+
+    def foto_guardada(self, meta, es_extintor=False):
+        app = App.get_running_app()
+        filename = meta['archivo']
+        self.pending_writes = max(0, self.pending_writes - 1)
+        NOMBRES_EN_COLA.discard(filename)
+        self.capture_count += 1
+        similares = []
+        if app.store is not None:
+            capture_id = app.store.agregar_captura(app.sector_id, filename, meta)
+            if meta.get('phash') is not None:
+                similares = app.store.indice_hashes().buscar(meta['phash'])
+                app.store.agregar_hash(capture_id, filename, meta['phash'])
+            app.almacenamiento.registrar(capture_id, meta.get('bytes'))
+        print(f"Foto guardada: {filename}")
+
+        nota = meta.get('nitidez')
+        if nota is not None and nota < self.blur_threshold:
+            self.status_info = "¡FOTO MOVIDA!\nRepetir toma"
+            Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 4)
+        elif similares:
+            self.status_info = f"¡FOTO REPETIDA!\nIgual a {similares[0][2]}"
+            Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 4)
+        else:
+            self.status_info = "¡FOTO GUARDADA!"
+            Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 2)
+
+        if es_extintor:
+            # La vista previa usa la miniatura, no la foto en resolución completa
+            app.root.get_screen('extinguisher_form').mostrar_preview(meta.get('miniatura', filename))
+
+    def abrir_formulario_extintor(self, es_extintor):
+        # El formulario se abre sin esperar al encoder; la vista previa
+        # aparece cuando la foto termina de escribirse
+        if es_extintor:
+            app = App.get_running_app()
+            form = app.root.get_screen('extinguisher_form')
+            form.cargar_imagen('')
+            form.aplicar_etiqueta(self.ultimo_codigo)
+            app.root.current = 'extinguisher_form'
+
+    def cola_llena(self, filename=None):
+        # La foto no entró a la cola: se libera el nombre reservado
+        if filename is not None:
+            self.pending_writes = max(0, self.pending_writes - 1)
+            NOMBRES_EN_COLA.discard(filename)
+        self.status_info = "Cola llena\nEsperar y repetir"
+        Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 2)
+
+    def foto_fallida(self, error, filename=None):
+        self.pending_writes = max(0, self.pending_writes - 1)
+        NOMBRES_EN_COLA.discard(filename)
+        self.status_info = f"Error: {str(error)}"
 
-    def probar_lente_extra(self, indice_nuevo):
-        try:
-            self.index = indice_nuevo
-            self.play = True
-            self.status_info = f"Lente ID {indice_nuevo} Activo"
-        except Exception as e:
-            # Estrategia de búsqueda de cámaras traseras
-            if indice_nuevo == 2:
-                print("Falló ID 2, probando ID 3...")
-                self.probar_lente_extra(3)
-            elif indice_nuevo == 3:
-                print("Falló ID 3, probando ID 4...")
-                self.probar_lente_extra(4)
-            else:
-                self.status_info = "Lente no disponible"
-                self.index = 0
-                self.play = True
+    # --- VIDEO EN LA APP ---
+    def toggle_record_stop(self):
+        if self.grabador is not None:
+            self.detener_grabacion()
+        elif cv2 is None or self.capture_source != 'sensor':
+            self.grabar_con_intent()
+        else:
+            self.iniciar_grabacion()
 
-    def reactivar(self):
-        try:
-            self.play = True
-        except:
-            self.index = 0
-            self.play = True
+    def iniciar_grabacion(self):
+        app = App.get_running_app()
+        if not self.espacio_suficiente():
+            return
+        os.makedirs(app.path_puesto, exist_ok=True)
+        self.grabador = GrabadorVideo(app.path_puesto, app.current_measurement_type[:3],
+                                      fps=int(self.video_fps), segmento_s=self.video_segment_s,
+                                      lado_max=int(self.video_max_side), rotacion=app.cam_rotation,
+                                      on_segmento=self.video_guardado)
+        self.grabador.on_fin = functools.partial(self.fin_grabacion, self.grabador)
+        self.play = True
+        self.is_paused = False
+        self.is_recording = True
+        self.grabador.iniciar()
+        self.record_time = "00:00"
+        self._reloj_video = Clock.schedule_interval(self._actualizar_reloj_video, 0.5)
 
-    # --- FOTOS ---
-    def take_photo(self, es_extintor=False):
+    def _actualizar_reloj_video(self, *args):
+        if self.grabador is not None:
+            segundos = int(self.grabador.tiempo())
+            self.record_time = f"{segundos // 60:02d}:{segundos % 60:02d}"
+
+    def detener_grabacion(self):
+        grabador, self.grabador = self.grabador, None
+        if grabador is None:
+            return
+        grabador.detener()
+        self._cerrando = self._cerrando + [grabador]
+        self._reloj_video.cancel()
+        self.is_recording = False
+        self.is_paused = False
+        self.record_time = ""
+        self.status_info = "Cerrando video..."
+
+    def video_guardado(self, meta):
         app = App.get_running_app()
-        try:
-            save_dir = app.path_puesto
-            if not os.path.exists(save_dir):
-                os.makedirs(save_dir, exist_ok=True)
-            
-            prefix = "EXT" if es_extintor else app.current_measurement_type[:3]
-            timestamp = datetime.now().strftime('%H%M%S')
-            filename = f"{save_dir}/{prefix}_Foto_{timestamp}.png"
-            
-            self.export_to_png(filename)
-            
-            self.capture_count += 1
-            app.temp_photo_path = filename
-            print(f"Foto guardada: {filename}")
-            
-            self.status_info = "¡FOTO GUARDADA!"
+        if app.store is not None:
+            capture_id = app.store.agregar_captura(app.sector_id, meta['archivo'], meta)
+            # Los videos cuentan para el presupuesto pero no se re-codifican
+            app.almacenamiento.registrar(capture_id, meta['bytes'], len(NIVELES_REDUCCION) - 1)
+        print(f"Video guardado: {meta['archivo']} ({meta['duracion']:.0f} s, {meta['descartados']} cuadros descartados)")
+        if self.grabador is not None and not app.almacenamiento.verificar()[0]:
+            self.detener_grabacion()
+            self.espacio_suficiente()
+
+    def fin_grabacion(self, grabador, error):
+        if grabador is self.grabador:
+            self.detener_grabacion()
+        self._cerrando = [g for g in self._cerrando if g is not grabador]
+        if error is not None:
+            self.status_info = f"Error Video: {error}"
+        elif self.grabador is None:
+            self.status_info = "¡VIDEO GUARDADO!"
             Clock.schedule_once(lambda dt: setattr(self, 'status_info', ''), 2)
-            
-            if es_extintor:
-                app.root.get_screen('extinguisher_form').cargar_imagen(filename)
-                app.root.current = 'extinguisher_form'
-                
-        except Exception as e:
-            self.status_info = f"Error: {str(e)}"
 
     # --- VIDEO NATIVO (CORREGIDO CON CAST) ---
-    def toggle_record_stop(self):
+    def grabar_con_intent(self):
+        # Sin cv2 no hay encoder propio: se usa la app de cámara del sistema
         if platform == 'android' and autoclass:
             try:
                 # 1. Clases Java
@@ -164,6 +3468,10 @@ class KivyCamera(Camera):
                 intent.putExtra(MediaStore.EXTRA_OUTPUT, parcelable_uri)
                 intent.putExtra(MediaStore.EXTRA_VIDEO_QUALITY, 1) # 1 = High Quality
 
+                # Android puede matar la app mientras la cámara de video está abierta
+                app.video_pendiente = file_path
+                app.anotar_sesion(sincronizar=True)
+
                 current_activity = PythonActivity.mActivity
                 current_activity.startActivity(intent)
                 
@@ -176,21 +3484,112 @@ class KivyCamera(Camera):
             self.status_info = "Video solo en Android"
 
     def toggle_pause(self):
-        if self.is_recording:
-            self.is_paused = not self.is_paused
-            if self.is_paused:
-                self.play = False 
-            else:
-                self.play = True
+        # El preview sigue en pantalla; solo deja de entrar al video
+        if self.grabador is None:
+            return
+        self.is_paused = not self.is_paused
+        if self.is_paused:
+            self.grabador.pausar()
+        else:
+            self.grabador.reanudar()
+
+    def abrir_galeria(self):
+        app = App.get_running_app()
+        app.root.current = 'gallery'
 
     def exit_screen(self):
-        self.stop_camera()
         app = App.get_running_app()
         app.root.current = 'review'
 
 Factory.register('KivyCamera', cls=KivyCamera)
 
+# --- CICLO DE VIDA DE LA CÁMARA ---
+class ControladorCamara:
+    # Único lugar que enciende o apaga el preview: corre solo con la pantalla
+    # de cámara visible y la app en primer plano. Un popup encima o un rato
+    # sin tocar la pantalla bajan los fps; un reposo largo lo detiene. Entre
+    # pantallas el proveedor queda abierto, así que volver es inmediato; con
+    # la app en segundo plano se suelta el dispositivo.
+    FPS_LENTO = 5
+    REPOSO_LENTO_S = 60
+    REPOSO_PAUSA_S = 300
+
+    def __init__(self, app):
+        self.app = app
+        self.visible = False
+        self.app_en_pausa = False
+        self.popups = 0
+        self.ultimo_toque = time.monotonic()
+        self.estado = 'pausada'
+        self._evento = Clock.schedule_interval(self.revisar, 5)
+
+    def camara(self):
+        # Sin construir la pantalla de cámara antes de tiempo
+        sm = self.app.root
+        if sm is None or not sm.has_screen('camera'):
+            return None
+        return sm.get_screen('camera').ids.qrcam
+
+    def deseado(self):
+        cam = self.camara()
+        if cam is not None and cam.still_pendiente:
+            # Detener el preview en medio de un takePicture pierde la foto
+            return self.estado
+        if cam is None or not self.visible or self.app_en_pausa:
+            return 'pausada'
+        if cam.is_recording:
+            return 'activa'
+        reposo = time.monotonic() - self.ultimo_toque
+        if reposo > self.REPOSO_PAUSA_S:
+            return 'pausada'
+        if self.popups or reposo > self.REPOSO_LENTO_S:
+            return 'lenta'
+        return 'activa'
+
+    def revisar(self, *args):
+        cam = self.camara()
+        estado = self.deseado()
+        if cam is None:
+            return
+        if estado != self.estado:
+            self.estado = estado
+            cam.aplicar_energia(estado, reposo=self.visible and not self.app_en_pausa)
+        if estado == 'pausada' and self.app_en_pausa and cam._camera is not None:
+            # Con stopPreview el dispositivo sigue tomado y otras apps no
+            # pueden abrir la cámara; al volver, aplicar_energia lo reabre
+            cam.soltar_proveedor()
+
+    def pantalla(self, sm, nombre):
+        self.visible = nombre == 'camera'
+        if self.visible:
+            self.ultimo_toque = time.monotonic()
+        self.revisar()
+
+    def pausa_app(self, en_pausa):
+        self.app_en_pausa = en_pausa
+        self.ultimo_toque = time.monotonic()
+        self.revisar()
+
+    def vigilar_popup(self, popup):
+        def abierto(*args):
+            self.popups += 1
+            self.revisar()
+
+        def cerrado(*args):
+            self.popups = max(0, self.popups - 1)
+            self.revisar()
+        popup.bind(on_open=abierto, on_dismiss=cerrado)
+
+    def actividad(self, *args):
+        # Si el toque solo despierta la cámara en reposo, no llega a los botones
+        dormida = self.estado == 'pausada' and self.visible and not self.app_en_pausa
+        self.ultimo_toque = time.monotonic()
+        if self.estado != 'activa':
+            self.revisar()
+        return dormida
+
 # --- DISEÑO KV ---
+# Estilos comunes: se cargan al arrancar
 KV = '''
 #:import dp kivy.metrics.dp
 #:import sp kivy.metrics.sp
@@ -257,16 +3656,11 @@ KV = '''
             pos: self.pos
             size: self.size
             radius: [dp(15)]
+'''
 
-ScreenManager:
-    WelcomeScreen:
-    ProjectScreen:
-    MeasurementScreen:
-    JobScreen:
-    CameraScreen:
-    ExtinguisherFormScreen:
-    ReviewScreen:
-
+# Reglas de cada pantalla: se parsean recién cuando se navega a ella
+KV_PANTALLAS = {
+    'welcome': '''
 <WelcomeScreen>:
     name: 'welcome'
     BoxLayout:
@@ -298,7 +3692,12 @@ ScreenManager:
         BotonECAM:
             text: "INICIAR PROYECTO"
             on_release: app.root.current = 'project'
-
+        BotonECAM:
+            text: "BUSCAR EN PROYECTOS"
+            background_color: (0.3, 0.3, 0.3, 1)
+            on_release: app.root.current = 'catalog'
+''',
+    'project': '''
 <ProjectScreen>:
     name: 'project'
     BoxLayout:
@@ -335,7 +3734,8 @@ ScreenManager:
         BotonECAM:
             text: "SIGUIENTE"
             on_release: root.crear_proyecto()
-
+''',
+    'measurement': '''
 <MeasurementScreen>:
     name: 'measurement'
     BoxLayout:
@@ -380,7 +3780,27 @@ ScreenManager:
                 BotonECAM:
                     text: "TERMOGRAFÍA (BETA)"
                     on_release: root.select_type("TERMOGRAFIA")
-
+        BotonECAM:
+            text: "EXPORTAR PLANILLAS"
+            background_color: (0.3, 0.3, 0.3, 1)
+            on_release: root.exportar_planillas()
+        BotonECAM:
+            text: "LIMPIAR FOTOS REPETIDAS"
+            background_color: (0.3, 0.3, 0.3, 1)
+            disabled: root.exportando
+            on_release: root.limpiar_duplicados()
+        BotonECAM:
+            text: "CANCELAR EXPORTACIÓN" if root.exportando else "EXPORTAR PROYECTO (ZIP)"
+            background_color: color_red if root.exportando else (0.3, 0.3, 0.3, 1)
+            on_release: root.exportar_zip()
+        Label:
+            text: root.progreso_export
+            font_size: sp(13)
+            color: (0.6, 0.6, 0.6, 1)
+            size_hint_y: None
+            height: dp(20)
+''',
+    'job': '''
 <JobScreen>:
     name: 'job'
     BoxLayout:
@@ -422,30 +3842,20 @@ ScreenManager:
         BotonECAM:
             text: "ABRIR CÁMARA"
             on_release: root.iniciar_puesto()
-
+''',
+    'camera': '''
 <CameraScreen>:
     name: 'camera'
-    on_pre_enter: root.setup_guides()
+    on_pre_enter: root.setup_guides(); root.configurar_medicion()
     FloatLayout:
-        # CONTENEDOR ROTADO
-        RelativeLayout:
+        # Preview: rotación, llenado de pantalla y guía en una sola pasada
+        KivyCamera:
+            id: qrcam
             size_hint: (1, 1)
-            canvas.before:
-                PushMatrix
-                Rotate:
-                    angle: app.cam_rotation
-                    origin: self.center
-            canvas.after:
-                PopMatrix
-            
-            KivyCamera:
-                id: qrcam
-                size_hint: (1, 1)
-                # FORZAMOS EL LLENADO DE PANTALLA
-                fit_mode: "cover" 
-                allow_stretch: True
-                keep_ratio: False
-        
+            rotacion: app.cam_rotation
+            guia: app.current_guide_texture if app.current_guide_image else None
+            guia_opacidad: 0.4
+
         # Mensajes
         Label:
             text: qrcam.status_info
@@ -455,13 +3865,83 @@ ScreenManager:
             pos_hint: {'center_x': 0.5, 'center_y': 0.5}
             halign: 'center'
 
-        Image:
-            id: guide_overlay
-            source: app.current_guide_image
-            size_hint: (1, 1)
-            allow_stretch: True
-            opacity: 0.4 if app.current_guide_image else 0
-            fit_mode: "contain"
+        # Etiqueta leída (INCENDIOS)
+        Label:
+            text: "ETIQUETA: " + qrcam.ultimo_codigo
+            color: color_gold
+            bold: True
+            font_size: sp(14)
+            size_hint: (None, None)
+            size: (dp(260), dp(30))
+            pos_hint: {'center_x': 0.5, 'top': 0.88}
+            opacity: 1 if qrcam.tag_scanner and qrcam.ultimo_codigo else 0
+            canvas.before:
+                Color:
+                    rgba: (0, 0, 0, 0.5)
+                RoundedRectangle:
+                    pos: self.pos
+                    size: self.size
+                    radius: [dp(8)]
+
+        # Medidor de luz (ILUMINACION)
+        BoxLayout:
+            orientation: 'vertical'
+            size_hint: (None, None)
+            size: (dp(180), dp(80))
+            pos_hint: {'center_x': 0.5, 'top': 0.88}
+            opacity: 1 if qrcam.light_meter else 0
+            canvas.before:
+                Color:
+                    rgba: (0, 0, 0, 0.5)
+                RoundedRectangle:
+                    pos: self.pos
+                    size: self.size
+                    radius: [dp(8)]
+            BoxLayout:
+                size_hint_y: None
+                height: dp(28)
+                Label:
+                    text: "≈ %d lux" % qrcam.live_lux
+                    bold: True
+                    color: color_gold
+                Button:
+                    text: "CAL"
+                    font_size: sp(10)
+                    size_hint_x: None
+                    width: dp(40)
+                    background_color: (0.3, 0.3, 0.3, 1)
+                    disabled: not qrcam.light_meter
+                    on_release: root.calibrar_luz()
+            HistogramaLuz:
+                valores: qrcam.live_histogram
+
+        # Sonómetro (RUIDO)
+        BoxLayout:
+            orientation: 'vertical'
+            size_hint: (None, None)
+            size: (dp(230), dp(100))
+            pos_hint: {'center_x': 0.5, 'top': 0.88}
+            padding: dp(6)
+            opacity: 1 if app.current_measurement_type == "RUIDO" else 0
+            disabled: app.current_measurement_type != "RUIDO"
+            canvas.before:
+                Color:
+                    rgba: (0, 0, 0, 0.5)
+                RoundedRectangle:
+                    pos: self.pos
+                    size: self.size
+                    radius: [dp(8)]
+            Label:
+                text: root.texto_sonometro
+                font_size: sp(12)
+                halign: 'center'
+            Button:
+                text: "DETENER SONÓMETRO" if root.sonometro_activo else "INICIAR SONÓMETRO"
+                font_size: sp(12)
+                size_hint_y: None
+                height: dp(32)
+                background_color: (0.8, 0.1, 0.1, 1) if root.sonometro_activo else color_gold
+                on_release: root.alternar_sonometro()
 
         # Info Superior
         BoxLayout:
@@ -483,7 +3963,11 @@ ScreenManager:
                 text_size: self.size
                 font_size: sp(14)
             Label:
-                text: str(qrcam.capture_count)
+                text: ("Foco %d" % qrcam.live_sharpness) if qrcam.live_sharpness else ""
+                color: color_green if qrcam.live_sharpness >= qrcam.blur_threshold else color_red
+                font_size: sp(12)
+            Label:
+                text: str(qrcam.capture_count) + (" (+%d)" % qrcam.pending_writes if qrcam.pending_writes else "")
                 halign: 'right'
                 text_size: self.size
                 bold: True
@@ -507,6 +3991,89 @@ ScreenManager:
                 background_color: (0, 0, 0, 0.5)
                 on_release: qrcam.cambiar_lente('0.5x')
 
+        # Botón Galería
+        BotonCam:
+            text: "GALERÍA"
+            size_hint: (None, None)
+            size: (dp(60), dp(60))
+            font_size: sp(10)
+            pos_hint: {'x': 0.02, 'center_y': 0.5}
+            background_color: (0, 0, 0, 0.6)
+            on_release: qrcam.abrir_galeria()
+
+        # Botón Mapa (ILUMINACION / RUIDO)
+        BotonCam:
+            text: "MAPA"
+            size_hint: (None, None)
+            size: (dp(60), dp(60))
+            font_size: sp(10)
+            pos_hint: {'x': 0.02, 'center_y': 0.3}
+            background_color: (0, 0, 0, 0.6)
+            opacity: 1 if app.current_measurement_type in ("ILUMINACION", "RUIDO") else 0
+            disabled: app.current_measurement_type not in ("ILUMINACION", "RUIDO")
+            on_release: app.root.current = 'grid'
+
+        # Botón Térmica (TERMOGRAFIA, BETA)
+        BotonCam:
+            text: "TÉRMICA"
+            size_hint: (None, None)
+            size: (dp(60), dp(60))
+            font_size: sp(10)
+            pos_hint: {'x': 0.02, 'center_y': 0.3}
+            background_color: (0, 0, 0, 0.6)
+            opacity: 1 if app.current_measurement_type == "TERMOGRAFIA" else 0
+            disabled: app.current_measurement_type != "TERMOGRAFIA"
+            on_release: app.root.current = 'thermal'
+
+        # HUD de rendimiento (tiempos por cuadro y colas)
+        BoxLayout:
+            orientation: 'vertical'
+            size_hint: (None, None)
+            size: (dp(250), dp(110))
+            pos_hint: {'x': 0.15, 'top': 0.88}
+            padding: dp(6)
+            opacity: 1 if root.hud_activo else 0
+            disabled: not root.hud_activo
+            canvas.before:
+                Color:
+                    rgba: (0, 0, 0, 0.6)
+                RoundedRectangle:
+                    pos: self.pos
+                    size: self.size
+                    radius: [dp(8)]
+            Label:
+                text: root.texto_hud
+                font_size: sp(10)
+                halign: 'left'
+                text_size: self.size
+                valign: 'top'
+            Button:
+                text: "GUARDAR TRAZA"
+                font_size: sp(10)
+                size_hint_y: None
+                height: dp(24)
+                background_color: color_gold
+                on_release: root.guardar_traza()
+
+        BotonCam:
+            text: "HUD"
+            size_hint: (None, None)
+            size: (dp(40), dp(30))
+            font_size: sp(9)
+            pos_hint: {'x': 0.02, 'center_y': 0.2}
+            background_color: (0, 0, 0, 0.4)
+            on_release: root.alternar_hud()
+
+        # Botón Ráfaga (guarda el cuadro más nítido)
+        BotonCam:
+            text: "RÁFAGA"
+            size_hint: (None, None)
+            size: (dp(60), dp(60))
+            font_size: sp(10)
+            pos_hint: {'x': 0.02, 'center_y': 0.4}
+            background_color: (0, 0, 0, 0.6)
+            on_release: qrcam.take_burst()
+
         # Botón Guía
         BotonCam:
             text: "GUÍA"
@@ -515,10 +4082,21 @@ ScreenManager:
             pos_hint: {'right': 0.98, 'center_y': 0.4}
             background_color: (0, 0, 0, 0.6)
             color: color_gold
-            opacity: 1 if app.current_measurement_type == "ERGONOMIA" else 0
-            disabled: True if app.current_measurement_type != "ERGONOMIA" else False
+            opacity: 1 if app.guides_available else 0
+            disabled: not app.guides_available
             on_release: app.cycle_guide()
 
+        # Ayuda de exposición: normal / cebra / falso color
+        BotonCam:
+            text: {'normal': "EXP", 'cebra': "CEBRA", 'falso_color': "FALSO\\nCOLOR"}[qrcam.modo_exposicion]
+            size_hint: (None, None)
+            size: (dp(60), dp(40))
+            font_size: sp(9)
+            halign: 'center'
+            pos_hint: {'right': 0.98, 'center_y': 0.28}
+            background_color: (0, 0, 0, 0.6)
+            on_release: qrcam.alternar_exposicion()
+
         # Botón Especial EXTINTOR
         Button:
             text: "CARGAR\\nEXTINTOR"
@@ -560,13 +4138,14 @@ ScreenManager:
                 on_release: qrcam.take_photo(es_extintor=False)
 
             BotonCam:
-                text: "GRABAR"
+                text: ("DETENER\\n" + qrcam.record_time) if qrcam.is_recording else "GRABAR"
                 font_size: sp(14)
-                background_color: color_green
+                halign: 'center'
+                background_color: (0.8, 0.1, 0.1, 1) if qrcam.is_recording else color_green
                 on_release: qrcam.toggle_record_stop()
             
             BotonCam:
-                text: "PAUSA"
+                text: "SEGUIR" if qrcam.is_paused else "PAUSA"
                 font_size: sp(14)
                 background_color: color_gold
                 disabled: not qrcam.is_recording
@@ -578,7 +4157,8 @@ ScreenManager:
                 color: color_black
                 background_color: color_gold
                 on_release: qrcam.exit_screen()
-
+''',
+    'extinguisher_form': '''
 # --- PANTALLA MANUAL DE EXTINTORES ---
 <ExtinguisherFormScreen>:
     name: 'extinguisher_form'
@@ -614,6 +4194,13 @@ ScreenManager:
                 height: self.minimum_height
                 spacing: dp(10)
                 
+                TextInput:
+                    id: ext_codigo
+                    hint_text: "Código de etiqueta (QR / barras)"
+                    multiline: False
+                    size_hint_y: None
+                    height: dp(45)
+                    on_text_validate: root.aplicar_etiqueta(self.text)
                 TextInput:
                     id: ext_marca
                     hint_text: "Marca"
@@ -653,25 +4240,233 @@ ScreenManager:
         BoxLayout:
             size_hint_y: None
             height: dp(50)
-            spacing: dp(10)
-            
+            spacing: dp(10)
+            
+            Button:
+                text: "DESCARTAR"
+                background_color: color_red
+                on_release: root.cancelar()
+            
+            Button:
+                text: "GUARDAR DATOS"
+                background_color: color_green
+                on_release: root.guardar_datos()
+''',
+    'review': '''
+<ReviewScreen>:
+    name: 'review'
+    on_pre_enter: root.actualizar_hint()
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(30)
+        spacing: dp(15)
+        canvas.before:
+            Color:
+                rgba: color_black
+            Rectangle:
+                pos: self.pos
+                size: self.size
+        Label:
+            text: "Finalizar Relevamiento"
+            font_size: sp(22)
+            color: color_gold
+            bold: True
+            size_hint_y: None
+            height: dp(50)
+        TextInput:
+            id: notas_input
+            hint_text: "Observaciones generales..."
+            multiline: True
+            size_hint_y: 1
+        BoxLayout:
+            size_hint_y: None
+            height: dp(60)
+            spacing: dp(20)
+            Button:
+                text: "DESCARTAR"
+                background_color: (0.5, 0.2, 0.2, 1)
+                on_release: root.finalizar(guardar=False)
+            Button:
+                text: "GUARDAR"
+                background_color: color_gold
+                on_release: root.finalizar(guardar=True)
+''',
+    'gallery': '''
+# --- GALERÍA DEL PUESTO ---
+<MiniaturaGaleria>:
+    fit_mode: "cover"
+    opacity: 1 if self.texture else 0.15
+
+<GalleryScreen>:
+    name: 'gallery'
+    on_pre_enter: root.cargar_fotos()
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(10)
+        spacing: dp(10)
+        canvas.before:
+            Color:
+                rgba: color_black
+            Rectangle:
+                pos: self.pos
+                size: self.size
+        Label:
+            text: root.titulo
+            font_size: sp(18)
+            color: color_gold
+            bold: True
+            size_hint_y: None
+            height: dp(40)
+        RecycleView:
+            id: rv_fotos
+            viewclass: 'MiniaturaGaleria'
+            RecycleGridLayout:
+                cols: 3
+                spacing: dp(4)
+                default_size: None, dp(120)
+                default_size_hint: 1, None
+                size_hint_y: None
+                height: self.minimum_height
+        BotonECAM:
+            text: "VOLVER"
+            on_release: root.volver()
+''',
+    'grid': '''
+# --- RELEVAMIENTO POR GRILLA (MAPA DEL SECTOR) ---
+<GridSurveyScreen>:
+    name: 'grid'
+    on_pre_enter: root.cargar_lecturas()
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(10)
+        spacing: dp(8)
+        canvas.before:
+            Color:
+                rgba: color_black
+            Rectangle:
+                pos: self.pos
+                size: self.size
+        Label:
+            text: "Mapa " + app.current_measurement_type + ": " + app.current_post
+            font_size: sp(16)
+            color: color_gold
+            bold: True
+            size_hint_y: None
+            height: dp(30)
+        FloatLayout:
+            CroquisSector:
+                id: croquis
+                puntos: root.puntos
+                fondo: root.croquis
+                pos_hint: {'x': 0, 'y': 0}
+                on_toque: root.agregar_punto(*args[1])
+            Image:
+                id: mapa_img
+                pos_hint: {'x': 0, 'y': 0}
+                fit_mode: "fill"
+                opacity: 0.85 if root.mapa else 0
+                source: root.mapa
+                nocache: True
+        Label:
+            text: root.resumen
+            font_size: sp(13)
+            size_hint_y: None
+            height: dp(40)
+        BoxLayout:
+            size_hint_y: None
+            height: dp(45)
+            spacing: dp(8)
+            TextInput:
+                id: valor_input
+                hint_text: "Valor (vacío = lectura en vivo)"
+                input_filter: 'float'
+            Button:
+                text: "DESHACER"
+                size_hint_x: 0.35
+                on_release: root.deshacer()
+        BoxLayout:
+            size_hint_y: None
+            height: dp(50)
+            spacing: dp(8)
+            Button:
+                text: "VOLVER"
+                background_color: (0.3, 0.3, 0.3, 1)
+                on_release: root.volver()
+            Button:
+                text: "GENERAR MAPA"
+                background_color: color_gold
+                on_release: root.generar_mapa()
+''',
+    'thermal': '''
+# --- TERMOGRAFÍA RADIOMÉTRICA (BETA) ---
+<ThermalScreen>:
+    name: 'thermal'
+    on_pre_enter: root.iniciar()
+    on_leave: root.detener()
+    BoxLayout:
+        orientation: 'vertical'
+        padding: dp(10)
+        spacing: dp(8)
+        canvas.before:
+            Color:
+                rgba: color_black
+            Rectangle:
+                pos: self.pos
+                size: self.size
+        Label:
+            text: "Termografía (BETA): " + root.fuente_nombre
+            font_size: sp(16)
+            color: color_gold
+            bold: True
+            size_hint_y: None
+            height: dp(30)
+        Image:
+            id: imagen_termica
+            fit_mode: "contain"
+        Label:
+            text: root.resumen
+            font_size: sp(13)
+            size_hint_y: None
+            height: dp(70)
+        BoxLayout:
+            size_hint_y: None
+            height: dp(45)
+            spacing: dp(8)
+            TextInput:
+                id: umbral_input
+                hint_text: "Umbral °C (vacío = auto)"
+                input_filter: 'float'
+                on_text: root.fijar_umbral(self.text)
+            Button:
+                text: root.paleta.upper()
+                size_hint_x: 0.35
+                on_release: root.cambiar_paleta()
+            Button:
+                text: "FUENTE"
+                size_hint_x: 0.3
+                on_release: root.cambiar_fuente()
+        BoxLayout:
+            size_hint_y: None
+            height: dp(50)
+            spacing: dp(8)
             Button:
-                text: "DESCARTAR"
-                background_color: color_red
-                on_release: root.cancelar()
-            
+                text: "VOLVER"
+                background_color: (0.3, 0.3, 0.3, 1)
+                on_release: app.root.current = 'camera'
             Button:
-                text: "GUARDAR DATOS"
-                background_color: color_green
-                on_release: root.guardar_datos()
-
-<ReviewScreen>:
-    name: 'review'
-    on_pre_enter: root.actualizar_hint()
+                text: "CAPTURAR"
+                background_color: color_gold
+                on_release: root.capturar()
+''',
+    'catalog': '''
+# --- CATÁLOGO ENTRE PROYECTOS ---
+<CatalogScreen>:
+    name: 'catalog'
+    on_enter: root.indexar()
     BoxLayout:
         orientation: 'vertical'
-        padding: dp(30)
-        spacing: dp(15)
+        padding: dp(20)
+        spacing: dp(10)
         canvas.before:
             Color:
                 rgba: color_black
@@ -679,30 +4474,97 @@ ScreenManager:
                 pos: self.pos
                 size: self.size
         Label:
-            text: "Finalizar Relevamiento"
+            text: "Buscar en Proyectos"
             font_size: sp(22)
             color: color_gold
             bold: True
             size_hint_y: None
-            height: dp(50)
-        TextInput:
-            id: notas_input
-            hint_text: "Observaciones generales..."
-            multiline: True
-            size_hint_y: 1
+            height: dp(40)
+        Label:
+            text: root.estado
+            color: (0.6, 0.6, 0.6, 1)
+            font_size: sp(12)
+            size_hint_y: None
+            height: dp(20)
         BoxLayout:
             size_hint_y: None
-            height: dp(60)
-            spacing: dp(20)
-            Button:
-                text: "DESCARTAR"
-                background_color: (0.5, 0.2, 0.2, 1)
-                on_release: root.finalizar(guardar=False)
+            height: dp(45)
+            spacing: dp(8)
+            TextInput:
+                id: consulta
+                hint_text: "Texto de los informes (puesto, fuente, observaciones...)"
+                multiline: False
+                on_text_validate: root.buscar(self.text)
             Button:
-                text: "GUARDAR"
+                text: "BUSCAR"
+                size_hint_x: 0.3
                 background_color: color_gold
-                on_release: root.finalizar(guardar=True)
-'''
+                on_release: root.buscar(consulta.text)
+        BoxLayout:
+            size_hint_y: None
+            height: dp(50)
+            spacing: dp(8)
+            Button:
+                text: "VENCEN\\nMES PRÓXIMO"
+                halign: 'center'
+                font_size: sp(12)
+                on_release: root.vencen_mes_proximo()
+            Button:
+                text: "VENCIMIENTOS\\nPOR MES"
+                halign: 'center'
+                font_size: sp(12)
+                on_release: root.resumen_vencimientos()
+            Button:
+                text: "INFORMES\\nPOR TIPO"
+                halign: 'center'
+                font_size: sp(12)
+                on_release: root.informes_por_tipo()
+        ScrollView:
+            Label:
+                text: root.resultado
+                font_size: sp(13)
+                size_hint_y: None
+                height: self.texture_size[1]
+                text_size: (self.width, None)
+                halign: 'left'
+                valign: 'top'
+        Button:
+            text: "VOLVER"
+            size_hint_y: None
+            height: dp(50)
+            background_color: (0.3, 0.3, 0.3, 1)
+            on_release: app.root.current = 'welcome'
+''',
+}
+
+class LazyScreenManager(ScreenManager):
+    # Cada pantalla (y su regla KV) se construye la primera vez que se pide
+    def __init__(self, fabricas, **kwargs):
+        self.fabricas = fabricas
+        super(LazyScreenManager, self).__init__(**kwargs)
+
+    def get_screen(self, name):
+        if name in self.fabricas and not self.has_screen(name):
+            self.construir(name)
+        return super(LazyScreenManager, self).get_screen(name)
+
+    def construir(self, name):
+        with PERFIL.medir(f'pantalla {name}'), TRAZA.tramo(f'construir {name}'):
+            Builder.load_string(KV_PANTALLAS[name], filename=f'cimacam_{name}.kv')
+            self.add_widget(self.fabricas[name]())
+
+    def on_current(self, instance, value):
+        if not TRAZA.activo:
+            return super(LazyScreenManager, self).on_current(instance, value)
+        # Tramo desde el cambio de pantalla hasta el fin de la transición
+        t0 = time.perf_counter()
+        transicion = self.transition
+
+        def completa(*args):
+            transicion.unbind(on_complete=completa)
+            TRAZA.registrar(f'pantalla {value}', t0, time.perf_counter() - t0)
+        transicion.bind(on_complete=completa)
+        return super(LazyScreenManager, self).on_current(instance, value)
 
 class WelcomeScreen(Screen):
     pass
@@ -716,27 +4578,102 @@ class ProjectScreen(Screen):
         empresa = self.ids.empresa_input.text.strip()
         if empresa:
             app.current_company = empresa
-            if platform == 'android':
-                # GUARDA EN DESCARGAS
-                from android.storage import primary_external_storage_path
-                base_dir = primary_external_storage_path()
-                app.path_empresa = os.path.join(base_dir, "Download", "CimaCam_Datos", empresa)
-            else:
-                base_dir = os.getcwd()
-                app.path_empresa = os.path.join(base_dir, "CimaCam_Datos", empresa)
-            
+            app.path_empresa = os.path.join(carpeta_datos(), empresa)
+
             if not os.path.exists(app.path_empresa):
                 os.makedirs(app.path_empresa, exist_ok=True)
-                
+
+            app.abrir_store()
             app.mostrar_aviso("Carpeta Creada", f"Ruta: {app.path_empresa}")
             app.root.current = 'measurement'
 
 class MeasurementScreen(Screen):
+    exportando = BooleanProperty(False)
+    progreso_export = StringProperty("")
+    exportador = None
+
     def select_type(self, m_type):
         app = App.get_running_app()
         app.current_measurement_type = m_type
         app.root.current = 'job'
 
+    def exportar_planillas(self):
+        app = App.get_running_app()
+        if app.store is None:
+            return
+        app.store.confirmar()
+        args = (app.store.ruta, app.path_empresa, app.current_company)
+
+        def trabajo():
+            try:
+                n_ext, n_inf = exportar_planillas(*args)
+                mainthread(app.mostrar_aviso)("Exportado", f"{n_ext} extintores, {n_inf} informes\nen: {app.path_empresa}")
+            except Exception as e:
+                print(f"Error Exportar: {e}")
+                mainthread(app.mostrar_aviso)("Error", str(e))
+        threading.Thread(target=trabajo, daemon=True).start()
+
+    def limpiar_duplicados(self):
+        app = App.get_running_app()
+        if app.store is None:
+            return
+        app.store.confirmar()
+        args = (app.store.ruta, app.path_empresa)
+
+        def trabajo():
+            try:
+                movidas, liberados = limpiar_duplicados(*args)
+                mainthread(self.fin_limpieza)(movidas, liberados)
+            except Exception as e:
+                print(f"Error Duplicados: {e}")
+                mainthread(app.mostrar_aviso)("Error", str(e))
+        threading.Thread(target=trabajo, daemon=True).start()
+
+    def fin_limpieza(self, movidas, liberados):
+        app = App.get_running_app()
+        if app.store is not None:
+            app.store.olvidar_indice()
+            app.store.olvidar_uso()
+        app.mostrar_aviso("Fotos Repetidas", f"{movidas} fotos movidas a .duplicados\n"
+                                             f"({liberados / (1024 * 1024):.1f} MB)")
+
+    def exportar_zip(self):
+        app = App.get_running_app()
+        if self.exportador is not None and self.exportador.activo:
+            self.exportador.cancelar()
+            return
+        if not app.path_empresa:
+            return
+        preparar = None
+        if app.store is not None:
+            app.store.checkpoint()
+            # Las planillas se regeneran antes de empaquetar, en el mismo hilo
+            args = (app.store.ruta, app.path_empresa, app.current_company)
+            preparar = lambda: exportar_planillas(*args)
+        destino = os.path.join(os.path.dirname(app.path_empresa), f"{app.current_company}.zip")
+        self.exportador = ExportadorProyecto(app.path_empresa, destino, on_progreso=self.progreso_zip,
+                                             on_fin=self.fin_zip, preparar=preparar)
+        self.exportando = True
+        self.progreso_export = "Preparando..."
+        self.exportador.iniciar()
+
+    def progreso_zip(self, hechos, total):
+        mb = 1024 * 1024
+        porcentaje = 100 * hechos / total if total else 100
+        self.progreso_export = f"{porcentaje:.0f}%  ({hechos / mb:.0f} / {total / mb:.0f} MB)"
+
+    def fin_zip(self, resultado):
+        app = App.get_running_app()
+        self.exportando = False
+        if resultado is None:
+            self.progreso_export = "Exportación pausada (se reanuda al volver a exportar)"
+        elif isinstance(resultado, Exception):
+            self.progreso_export = ""
+            app.mostrar_aviso("Error", str(resultado))
+        else:
+            self.progreso_export = ""
+            app.mostrar_aviso("Proyecto Exportado", f"Archivo:\n{resultado}")
+
 class JobScreen(Screen):
     def iniciar_puesto(self):
         app = App.get_running_app()
@@ -747,22 +4684,189 @@ class JobScreen(Screen):
             app.path_puesto = os.path.join(app.path_empresa, folder)
             if not os.path.exists(app.path_puesto):
                 os.makedirs(app.path_puesto, exist_ok=True)
-            
-            cam = app.root.get_screen('camera').ids.qrcam
-            cam.start_camera()
+            if app.store is not None:
+                app.sector_id = app.store.nuevo_sector(app.session_id, app.current_measurement_type,
+                                                       puesto, app.path_puesto)
+                app.almacenamiento.sector_actual = app.sector_id
+
             app.root.current = 'camera'
 
 class CameraScreen(Screen):
     def setup_guides(self):
         app = App.get_running_app()
-        if app.current_measurement_type == "ERGONOMIA":
-            app.current_guide_image = 'guia_frente.png'
+        atlas = app.cargar_guias()
+        app.guides_available = bool(atlas and atlas.nombres)
+        app.current_guide_index = 0
+        app.mostrar_guia()
+
+    sonometro_activo = BooleanProperty(False)
+    texto_sonometro = StringProperty("LAeq -- dB(A)")
+    sonometro = None
+    # False cuando lo detiene el cierre del puesto: el nivel ya no va a la nota
+    _precargar_nivel = True
+    hud_activo = BooleanProperty(False)
+    texto_hud = StringProperty("")
+    _evento_hud = None
+
+    # --- HUD DE RENDIMIENTO ---
+    def alternar_hud(self):
+        self.hud_activo = not self.hud_activo
+        if self.hud_activo:
+            self._traza_previa = TRAZA.activo
+            TRAZA.activo = True
+            self.texto_hud = "Midiendo..."
+            self._evento_hud = Clock.schedule_interval(self.actualizar_hud, 0.5)
         else:
-            app.current_guide_image = ''
+            self._evento_hud.cancel()
+            self._evento_hud = None
+            TRAZA.activo = self._traza_previa
+
+    def actualizar_hud(self, *args):
+        cam = self.ids.qrcam
+        datos = resumen_cuadros(TRAZA.recientes('cuadro', 2.0))
+        colas = {'fotos': cam.pending_writes,
+                 'pipeline': cam.pipeline.pendientes if cam.pipeline is not None else 0}
+        descartes = {a.nombre: a.descartados for a in (cam.analizador_foco, cam.analizador_luz) if a is not None}
+        TRAZA.contador('colas', **colas)
+        if datos is None:
+            self.texto_hud = "Sin cuadros"
+            return
+        TRAZA.contador('cuadros', fps=round(datos['fps'], 1), perdidos=datos['perdidos'])
+        self.texto_hud = (f"{datos['intervalo_ms']:.1f} ms/cuadro ({datos['fps']:.0f} fps), perdidos {datos['perdidos']}\n"
+                          f"on_tex {datos['costo_ms']:.2f} ms, p95 {datos['costo_p95_ms']:.2f} ms\n"
+                          f"cola fotos {colas['fotos']}, pipeline {colas['pipeline']}\n"
+                          + ", ".join(f"{n} descartó {d}" for n, d in descartes.items()))
+
+    def guardar_traza(self):
+        app = App.get_running_app()
+        carpeta = app.path_empresa or app.user_data_dir
+        ruta = os.path.join(carpeta, f"traza_{datetime.now().strftime('%H%M%S')}.json")
+        try:
+            n = TRAZA.exportar(ruta)
+        except OSError as e:
+            app.mostrar_aviso("Traza", str(e))
+            return
+        print(f"Traza: {n} eventos en {ruta}")
+        app.mostrar_aviso("Traza", f"{n} eventos guardados en:\n{os.path.basename(ruta)}\n(abrir en chrome://tracing)")
+
+    def configurar_medicion(self):
+        app = App.get_running_app()
+        self.ids.qrcam.light_meter = app.current_measurement_type == "ILUMINACION"
+        self.ids.qrcam.tag_scanner = app.current_measurement_type == "INCENDIOS"
+
+    def calibrar_luz(self):
+        # Se toma la luma de este momento y se la asocia a la lectura de un
+        # luxómetro patrón puesto al lado del teléfono
+        app = App.get_running_app()
+        luma = self.ids.qrcam.live_luma
+        if not luma:
+            app.mostrar_aviso("Calibración", "Esperar la primera lectura del medidor")
+            return
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        content.add_widget(Label(text=f"Luma actual: {luma:.0f}\nLectura del luxómetro patrón:",
+                                 font_size='14sp', halign='center'))
+        entrada = TextInput(hint_text="lux", input_filter='float', multiline=False,
+                            size_hint_y=None, height=dp(45))
+        content.add_widget(entrada)
+        botones = BoxLayout(size_hint_y=None, height=dp(50), spacing=10)
+        cancelar = Factory.Button(text="CANCELAR")
+        guardar = Factory.Button(text="GUARDAR", background_color=(0.2, 0.7, 0.3, 1))
+        botones.add_widget(cancelar)
+        botones.add_widget(guardar)
+        content.add_widget(botones)
+        popup = Popup(title="Calibrar luxómetro", content=content, size_hint=(0.85, 0.45))
+
+        def confirmar(*args):
+            try:
+                lux = float(entrada.text)
+            except ValueError:
+                return
+            popup.dismiss()
+            calibracion = app.calibracion_lux()
+            calibracion.agregar_punto(luma, lux)
+            app.mostrar_aviso("Calibración", f"Luma {luma:.0f} = {lux:.0f} lux\n"
+                                             f"({len(calibracion.tabla)} puntos en la tabla)")
+        cancelar.bind(on_release=popup.dismiss)
+        guardar.bind(on_release=confirmar)
+        entrada.bind(on_text_validate=confirmar)
+        app.control_camara.vigilar_popup(popup)
+        popup.open()
+
+    def alternar_sonometro(self):
+        if self.sonometro is not None and self.sonometro.activo:
+            self.detener_sonometro()
+            return
+        app = App.get_running_app()
+        if np is None:
+            app.mostrar_aviso("Sonómetro", "Requiere numpy")
+            return
+        try:
+            if platform == 'android':
+                fuente = FuenteMicrofono()
+            else:
+                wavs = sorted(glob.glob(os.path.join(app.path_puesto, '*.wav')))
+                ruta = os.environ.get('CIMACAM_WAV') or (wavs[0] if wavs else None)
+                if not ruta:
+                    app.mostrar_aviso("Sonómetro", "Sin micrófono: copiar un .wav a la carpeta del puesto")
+                    return
+                fuente = FuenteWav(ruta)
+        except Exception as e:
+            app.mostrar_aviso("Sonómetro", str(e))
+            return
+        offset = offset_sonometro(app.user_data_dir, CameraCapabilities.modelo_dispositivo())
+        # El nivel se guarda en el puesto donde empezó la medición
+        self.sonometro = Sonometro(fuente, offset, on_lectura=self.lectura_sonometro,
+                                   on_fin=functools.partial(self.fin_sonometro, app.sector_id))
+        self._precargar_nivel = True
+        self.sonometro_activo = True
+        self.texto_sonometro = "Midiendo..."
+        self.sonometro.iniciar()
+
+    def lectura_sonometro(self, datos):
+        if datos:
+            self.texto_sonometro = (f"LA {datos['la']:.1f}  LAeq {datos['laeq']:.1f} dB(A)\n"
+                                    f"max {datos['lamax']:.1f}  min {datos['lamin']:.1f}  L90 {datos['la90']:.1f}\n"
+                                    f"{datos['duracion'] / 60:.1f} min")
+
+    def detener_sonometro(self, precargar=True):
+        self._precargar_nivel = precargar
+        self.sonometro.detener()
+
+    def fin_sonometro(self, sector_id, datos, error):
+        app = App.get_running_app()
+        fuente = self.sonometro.fuente.nombre
+        self.sonometro_activo = False
+        self.sonometro = None
+        if error is not None:
+            app.mostrar_aviso("Sonómetro", str(error))
+        if not datos:
+            return
+        self.lectura_sonometro(datos)
+        if self._precargar_nivel:
+            app.ultimo_nivel_sonoro = datos
+        if app.store is not None:
+            app.store.agregar_nivel_sonoro(sector_id, fuente, datos)
+
+class HistogramaLuz(Widget):
+    valores = ListProperty([])
+
+    def __init__(self, **kwargs):
+        super(HistogramaLuz, self).__init__(**kwargs)
+        self.bind(valores=self.dibujar, pos=self.dibujar, size=self.dibujar)
+
+    def dibujar(self, *args):
+        self.canvas.clear()
+        if not self.valores:
+            return
+        ancho = self.width / len(self.valores)
+        with self.canvas:
+            Color(0.95, 0.95, 0.95, 0.8)
+            for i, v in enumerate(self.valores):
+                Rectangle(pos=(self.x + i * ancho, self.y), size=(max(1, ancho - 1), self.height * v))
 
 class ExtinguisherFormScreen(Screen):
     def cargar_imagen(self, path):
-        self.ids.img_preview.source = path
+        self.mostrar_preview(path)
         self.ids.ext_marca.text = ""
         self.ids.ext_tipo.text = ""
         self.ids.ext_capacidad.text = ""
@@ -770,37 +4874,54 @@ class ExtinguisherFormScreen(Screen):
         self.ids.ext_venc.text = ""
         self.ids.ext_ph.text = ""
         self.ids.ext_empresa.text = ""
+        self.ids.ext_codigo.text = ""
+
+    def aplicar_etiqueta(self, codigo):
+        # Con la etiqueta leída se copian los datos del relevamiento anterior
+        codigo = codigo.strip()
+        self.ids.ext_codigo.text = codigo
+        app = App.get_running_app()
+        previo = app.store.extintor_por_codigo(codigo) if codigo and app.store is not None else None
+        if not previo:
+            return False
+        self.ids.ext_marca.text = previo['marca'] or ""
+        self.ids.ext_tipo.text = previo['tipo'] or ""
+        self.ids.ext_capacidad.text = previo['capacidad'] or ""
+        self.ids.ext_fab.text = previo['n_fab'] or ""
+        self.ids.ext_venc.text = previo['venc_carga'] or ""
+        self.ids.ext_ph.text = previo['venc_ph'] or ""
+        self.ids.ext_empresa.text = previo['empresa_mant'] or ""
+        return True
+
+    def mostrar_preview(self, path):
+        self.ids.img_preview.source = path
 
     def cancelar(self):
         app = App.get_running_app()
         app.root.current = 'camera'
 
+    @trazado('guardar_datos')
     def guardar_datos(self):
         app = App.get_running_app()
-        datos = [
-            datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            app.current_post,
-            os.path.basename(app.temp_photo_path),
-            self.ids.ext_marca.text,
-            self.ids.ext_tipo.text,
-            self.ids.ext_capacidad.text,
-            self.ids.ext_fab.text,
-            self.ids.ext_venc.text,
-            self.ids.ext_ph.text,
-            self.ids.ext_empresa.text
-        ]
-        csv_file = os.path.join(app.path_empresa, f"Relevamiento_Extintores_{app.current_company}.csv")
-        encabezados = ["Fecha", "Sector", "Foto", "Marca", "Tipo", "Capacidad", "N_Fab", "Venc_Carga", "Venc_PH", "Empresa"]
-        es_nuevo = not os.path.exists(csv_file)
+        campos = {
+            'marca': self.ids.ext_marca.text,
+            'tipo': self.ids.ext_tipo.text,
+            'capacidad': self.ids.ext_capacidad.text,
+            'n_fab': self.ids.ext_fab.text,
+            'venc_carga': self.ids.ext_venc.text,
+            'venc_ph': self.ids.ext_ph.text,
+            'empresa_mant': self.ids.ext_empresa.text,
+        }
         try:
-            with open(csv_file, mode='a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter=';')
-                if es_nuevo: writer.writerow(encabezados)
-                writer.writerow(datos)
-            app.mostrar_aviso("Guardado", f"Datos en:\n{csv_file}")
+            # Solo un INSERT; la planilla CSV se genera al exportar
+            app.store.agregar_extintor(app.sector_id, os.path.basename(app.temp_photo_path), campos,
+                                       self.ids.ext_codigo.text.strip())
+            app.mostrar_aviso("Guardado", f"Extintor registrado en:\n{app.current_post}")
         except Exception as e:
-            print(f"Error CSV: {e}")
+            print(f"Error DB: {e}")
             app.mostrar_aviso("Error", str(e))
+        # La etiqueta ya se usó: el próximo extintor necesita la suya
+        app.root.get_screen('camera').ids.qrcam.ultimo_codigo = ""
         app.root.current = 'camera'
 
 class ReviewScreen(Screen):
@@ -809,48 +4930,722 @@ class ReviewScreen(Screen):
         m = app.current_measurement_type
         w = self.ids.notas_input
         if m == "ERGONOMIA": w.hint_text = "Carga (kg), Frecuencia, Posturas..."
-        elif m == "RUIDO": w.hint_text = "Nivel dBA, Fuente de ruido..."
-        elif m == "TERMOGRAFIA": w.hint_text = "Componente (Tablero/Cable), Temp Max..."
+        elif m == "RUIDO":
+            w.hint_text = "Nivel dBA, Fuente de ruido..."
+            datos = app.ultimo_nivel_sonoro
+            if datos and not w.text:
+                w.text = (f"LAeq {datos['laeq']:.1f} dB(A) ({datos['duracion'] / 60:.1f} min), "
+                          f"LAmax {datos['lamax']:.1f}, LCpeak {datos['lcpeak']:.1f} dB(C)\n")
+        elif m == "TERMOGRAFIA":
+            w.hint_text = "Componente (Tablero/Cable), Temp Max..."
+            if app.resumen_termico and not w.text:
+                w.text = "\n\n".join(app.resumen_termico) + "\n"
         else: w.hint_text = "Observaciones generales..."
 
+    @trazado('finalizar')
     def finalizar(self, guardar=True):
         app = App.get_running_app()
         cam_screen = app.root.get_screen('camera')
-        if hasattr(cam_screen.ids, 'qrcam'):
-            cam_screen.ids.qrcam.stop_camera()
+        if cam_screen.sonometro is not None:
+            # Se guarda lo medido hasta ahora (fin_sonometro, que llega después:
+            # no debe precargar la nota del próximo puesto)
+            cam_screen.detener_sonometro(precargar=False)
         if guardar:
             txt = self.ids.notas_input.text
             if txt:
-                fname = f"{app.path_puesto}/Informe_{datetime.now().strftime('%H%M%S')}.txt"
-                with open(fname, "w", encoding="utf-8") as f:
-                    f.write(f"CLIENTE: {app.current_company}\n")
-                    f.write(f"TIPO: {app.current_measurement_type}\n")
-                    f.write(f"PUESTO: {app.current_post}\n")
-                    f.write(f"FECHA: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n")
-                    f.write("="*30 + "\n")
-                    f.write(txt)
-                app.mostrar_aviso("Informe Guardado", f"Archivo:\n{fname}")
+                try:
+                    app.store.agregar_nota(app.sector_id, txt)
+                except Exception as e:
+                    # La nota queda escrita en el campo para reintentar
+                    print(f"Error DB: {e}")
+                    app.mostrar_aviso("Error", str(e))
+                    return
+                app.mostrar_aviso("Informe Guardado", f"Puesto: {app.current_post}\n(usar EXPORTAR para generar los TXT)")
         self.ids.notas_input.text = ""
+        app.ultimo_nivel_sonoro = None
+        app.resumen_termico = []
         app.root.current = 'measurement'
 
+class MiniaturaGaleria(RecycleDataViewBehavior, Image):
+    source_foto = StringProperty('')
+
+    def refresh_view_attrs(self, rv, index, data):
+        # La vista se recicla: se limpia y se pide la miniatura al caché
+        self.texture = None
+        super(MiniaturaGaleria, self).refresh_view_attrs(rv, index, data)
+        cache = App.get_running_app().miniaturas
+        if cache is None:
+            self.source = self.source_foto
+        else:
+            cache.pedir(self.source_foto, self.miniatura_lista)
+
+    def miniatura_lista(self, filename, texture):
+        if filename == self.source_foto:
+            self.texture = texture
+
+class GalleryScreen(Screen):
+    titulo = StringProperty("")
+
+    def cargar_fotos(self):
+        app = App.get_running_app()
+        fotos = []
+        if app.path_puesto and os.path.isdir(app.path_puesto):
+            with os.scandir(app.path_puesto) as it:
+                fotos = [e.path for e in it
+                         if e.is_file() and e.name.lower().endswith(('.jpg', '.webp', '.png'))]
+        fotos.sort(reverse=True)
+        self.titulo = f"{app.current_post}: {len(fotos)} fotos"
+        self.ids.rv_fotos.data = [{'source_foto': f} for f in fotos]
+
+    def volver(self):
+        app = App.get_running_app()
+        app.root.current = 'camera'
+
+class CroquisSector(Widget):
+    # Área del sector: grilla de referencia y lecturas en coordenadas 0..1
+    __events__ = ('on_toque',)
+    puntos = ListProperty([])
+    fondo = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super(CroquisSector, self).__init__(**kwargs)
+        self.bind(puntos=self.dibujar, fondo=self.dibujar, pos=self.dibujar, size=self.dibujar)
+
+    def on_toque(self, posicion):
+        pass
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos) or not self.width or not self.height:
+            return super(CroquisSector, self).on_touch_down(touch)
+        x = (touch.x - self.x) / self.width
+        y = 1 - (touch.y - self.y) / self.height
+        self.dispatch('on_toque', (x, y))
+        return True
+
+    def dibujar(self, *args):
+        self.canvas.clear()
+        with self.canvas:
+            Color(1, 1, 1, 1) if self.fondo else Color(0.12, 0.12, 0.12, 1)
+            Rectangle(pos=self.pos, size=self.size, source=self.fondo or None)
+            Color(0.3, 0.3, 0.3, 1)
+            for i in range(1, 10):
+                Line(points=[self.x + self.width * i / 10, self.y, self.x + self.width * i / 10, self.top])
+                Line(points=[self.x, self.y + self.height * i / 10, self.right, self.y + self.height * i / 10])
+            Color(0.72, 0.54, 0.15, 1)
+            r = dp(6)
+            for _, x, y, _ in self.puntos:
+                Ellipse(pos=(self.x + x * self.width - r, self.top - y * self.height - r), size=(2 * r, 2 * r))
+
+class GridSurveyScreen(Screen):
+    puntos = ListProperty([])
+    resumen = StringProperty("Tocar el croquis para ubicar cada lectura")
+    mapa = StringProperty('')
+    croquis = StringProperty('')
+
+    def cargar_lecturas(self):
+        app = App.get_running_app()
+        self.mapa = ''
+        self.croquis = ''
+        for ext in ('jpg', 'png'):
+            ruta = os.path.join(app.path_puesto, f"croquis.{ext}")
+            if os.path.exists(ruta):
+                self.croquis = ruta
+        self.puntos = [tuple(l) for l in app.store.lecturas(app.sector_id, app.current_measurement_type)] \
+            if app.store is not None else []
+        self.actualizar_resumen()
+
+    def valor_en_vivo(self):
+        app = App.get_running_app()
+        if app.current_measurement_type == "ILUMINACION":
+            return app.root.get_screen('camera').ids.qrcam.live_lux or None
+        return None
+
+    def agregar_punto(self, x, y):
+        app = App.get_running_app()
+        texto = self.ids.valor_input.text.strip()
+        try:
+            valor = float(texto) if texto else self.valor_en_vivo()
+        except ValueError:
+            # El filtro 'float' de Kivy deja pasar ".", "-" y "-."
+            self.resumen = f"Valor inválido: {texto}"
+            return
+        if valor is None:
+            self.resumen = "Ingresar el valor medido antes de tocar el croquis"
+            return
+        lectura_id = None
+        if app.store is not None:
+            lectura_id = app.store.agregar_lectura(app.sector_id, app.current_measurement_type, x, y, valor)
+        self.puntos.append((lectura_id, x, y, valor))
+        self.ids.valor_input.text = ""
+        self.actualizar_resumen()
+
+    def deshacer(self):
+        app = App.get_running_app()
+        if not self.puntos:
+            return
+        lectura_id = self.puntos.pop()[0]
+        if app.store is not None and lectura_id is not None:
+            app.store.borrar_lectura(lectura_id)
+        self.actualizar_resumen()
+
+    def actualizar_resumen(self):
+        if not self.puntos or np is None:
+            self.resumen = f"{len(self.puntos)} lecturas"
+            return
+        datos = estadisticas_lecturas([p[3] for p in self.puntos], App.get_running_app().current_measurement_type)
+        self.resumen = f"{datos['n']} lecturas | min {datos['min']:.0f}  med {datos['media']:.0f}  max {datos['max']:.0f}"
+        if 'uniformidad_min_med' in datos:
+            self.resumen += f" | U {datos['uniformidad_min_med']:.2f}"
+
+    def generar_mapa(self):
+        app = App.get_running_app()
+        if len(self.puntos) < 3 or cv2 is None:
+            self.resumen = "Se necesitan al menos 3 lecturas"
+            return
+        lecturas = [(x, y, v) for _, x, y, v in self.puntos]
+        tipo = app.current_measurement_type
+        destino = os.path.join(app.path_puesto, f"Mapa_{tipo}_{datetime.now().strftime('%H%M%S')}.png")
+        croquis = self.croquis
+        self.resumen = "Generando mapa..."
+
+        def trabajo():
+            try:
+                datos = renderizar_mapa(lecturas, tipo, destino, croquis=croquis)
+                mainthread(self.mapa_listo)(destino, datos)
+            except Exception as e:
+                print(f"Error Mapa: {e}")
+                mainthread(setattr)(self, 'resumen', f"Error: {e}")
+        threading.Thread(target=trabajo, name='mapa', daemon=True).start()
+
+    def mapa_listo(self, destino, datos):
+        self.mapa = destino
+        self.actualizar_resumen()
+        self.resumen += "\nGuardado: " + os.path.basename(destino)
+
+    def volver(self):
+        App.get_running_app().root.current = 'camera'
+
+class ThermalScreen(Screen):
+    # Cuadros de un archivo radiométrico del puesto o de la fuente simulada;
+    # el análisis corre en el hilo de AnalizadorEnVivo (~10 cuadros/s)
+    PALETAS = ('hierro', 'arcoiris', 'gris')
+    paleta = StringProperty('hierro')
+    resumen = StringProperty('')
+    fuente_nombre = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super(ThermalScreen, self).__init__(**kwargs)
+        self.fuente = None
+        self.fuentes = []
+        self.fuente_indice = 0
+        self.ultimo = None
+        self.analizador = None
+        self._evento = None
+        # Umbral ya interpretado en el hilo de la UI (None = automático)
+        self.umbral = None
+
+    def iniciar(self):
+        app = App.get_running_app()
+        if np is None:
+            self.resumen = "Requiere numpy y OpenCV"
+            return
+        archivos = sorted(f for f in glob.glob(os.path.join(app.path_puesto, '*'))
+                          if f.lower().endswith(EXTENSIONES_TERMICAS))
+        self.fuentes = archivos + ['simulada']
+        self.abrir_fuente(0)
+        self.analizador = AnalizadorEnVivo(self.analizar, self.mostrar, intervalo=0.1, nombre='termica')
+        self._evento = Clock.schedule_interval(self.ofrecer_cuadro, 1 / 15.)
+
+    def ofrecer_cuadro(self, dt):
+        # Fuente, paleta y umbral se leen acá, en el hilo de la UI, y viajan con el
+        # trabajo. Sin return: un False de ofrecer() cancelaría el intervalo del Clock
+        self.analizador.ofrecer((self.fuente, self.paleta, self.umbral))
+
+    def detener(self):
+        if self._evento is not None:
+            self._evento.cancel()
+            self._evento = None
+        if self.analizador is not None:
+            self.analizador.cerrar()
+            self.analizador = None
+
+    def abrir_fuente(self, i):
+        ruta = self.fuentes[i % len(self.fuentes)]
+        try:
+            self.fuente = FuenteTermicaSimulada() if ruta == 'simulada' else FuenteTermicaArchivo(ruta)
+        except Exception as e:
+            print(f"Error Térmica: {e}")
+            App.get_running_app().mostrar_aviso("Térmica", str(e))
+            self.fuente = FuenteTermicaSimulada()
+        self.fuente_indice = i
+        self.fuente_nombre = self.fuente.nombre
+
+    def cambiar_fuente(self):
+        if self.fuentes:
+            self.abrir_fuente(self.fuente_indice + 1)
+
+    def cambiar_paleta(self):
+        self.paleta = self.PALETAS[(self.PALETAS.index(self.paleta) + 1) % len(self.PALETAS)]
+
+    def fijar_umbral(self, texto):
+        # "-", "." o "-." mientras se escribe: umbral automático hasta que sea un número
+        try:
+            self.umbral = float(texto.strip())
+        except ValueError:
+            self.umbral = None
+
+    def analizar(self, trabajo):
+        fuente, paleta, umbral = trabajo
+        crudo = fuente.leer()
+        return crudo, analizar_termico(crudo, paleta, umbral)
+
+    def mostrar(self, resultado):
+        if self.analizador is None:
+            return
+        crudo, datos = resultado
+        self.ultimo = (crudo, datos)
+        imagen = datos['imagen']
+        alto, ancho = imagen.shape[:2]
+        widget = self.ids.imagen_termica
+        if widget.texture is None or widget.texture.size != (ancho, alto):
+            widget.texture = Texture.create(size=(ancho, alto), colorfmt='bgr')
+            widget.texture.flip_vertical()
+        widget.texture.blit_buffer(imagen.tobytes(), colorfmt='bgr', bufferfmt='ubyte')
+        widget.canvas.ask_update()
+        self.resumen = (f"min {datos['tmin']:.1f}  med {datos['tmed']:.1f}  max {datos['tmax']:.1f} °C"
+                        f"  | umbral {datos['umbral']:.1f} °C\n" + self.texto_regiones(datos['regiones'][:3]))
+
+    @staticmethod
+    def texto_regiones(regiones):
+        return "\n".join(f"R{n}: max {r['tmax']:.1f}  med {r['tmed']:.1f}  min {r['tmin']:.1f} °C ({r['area']} px)"
+                         for n, r in enumerate(regiones, 1)) or "Sin puntos calientes"
+
+    def capturar(self):
+        app = App.get_running_app()
+        if self.ultimo is None:
+            return
+        crudo, datos = self.ultimo
+        filename = nombre_unico(app.path_puesto, app.current_measurement_type[:3], "Termica", 'png')
+        campos = {k: datos[k] for k in ('tmin', 'tmax', 'tmed', 'umbral', 'regiones')}
+        campos.update(fuente=self.fuente_nombre, paleta=self.paleta)
+
+        def trabajo():
+            # PNG en falso color para el informe + el crudo .npy para reanalizar
+            try:
+                escribir_imagen(filename, datos['imagen'], 'png')
+                np.save(os.path.splitext(filename)[0] + '.npy', crudo)
+                escribir_metadatos(filename, **campos)
+                mainthread(listo)(os.path.getsize(filename))
+            except Exception as e:
+                print(f"Error Térmica: {e}")
+                mainthread(app.mostrar_aviso)("Error", str(e))
+            finally:
+                NOMBRES_EN_COLA.discard(filename)
+
+        def listo(n_bytes):
+            if app.store is not None:
+                capture_id = app.store.agregar_captura(app.sector_id, filename, campos)
+                app.almacenamiento.registrar(capture_id, n_bytes)
+            app.resumen_termico.append(f"{os.path.basename(filename)}: max {datos['tmax']:.1f} °C\n"
+                                       + self.texto_regiones(datos['regiones']))
+            app.mostrar_aviso("Termografía", f"Guardada: {os.path.basename(filename)}")
+        threading.Thread(target=trabajo, daemon=True).start()
+
+class CatalogScreen(Screen):
+    estado = StringProperty("")
+    resultado = StringProperty("")
+    MAX_FILAS = 200
+
+    def __init__(self, **kwargs):
+        super(CatalogScreen, self).__init__(**kwargs)
+        # Un solo hilo: la conexión del catálogo nunca se comparte
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalogo')
+        self.catalogo = None
+
+    def _en_hilo(self, fn, on_resultado):
+        app = App.get_running_app()
+
+        def trabajo():
+            if self.catalogo is None:
+                self.catalogo = CatalogoDatos(carpeta_datos(), os.path.join(app.user_data_dir, 'catalogo.db'))
+            return fn(self.catalogo)
+
+        def terminado(fut):
+            if fut.exception() is not None:
+                print(f"Error Catálogo: {fut.exception()}")
+                mainthread(setattr)(self, 'estado', f"Error: {fut.exception()}")
+            else:
+                mainthread(on_resultado)(fut.result())
+        self._pool.submit(trabajo).add_done_callback(terminado)
+
+    def indexar(self):
+        self.estado = "Indexando..."
+        self._en_hilo(lambda cat: cat.indexar(), self._indexado)
+
+    def _indexado(self, r):
+        self.estado = (f"{r['archivos']} archivos ({r['cambiados']} nuevos o cambiados,"
+                       f" {r['borrados']} borrados) en {r['segundos']:.2f} s")
+
+    def _mostrar(self, titulo, lineas):
+        if not lineas:
+            self.resultado = f"{titulo}\n\nSin resultados"
+            return
+        extra = f"\n... y {len(lineas) - self.MAX_FILAS} más" if len(lineas) > self.MAX_FILAS else ""
+        self.resultado = f"{titulo}\n\n" + "\n".join(lineas[:self.MAX_FILAS]) + extra
+
+    def buscar(self, consulta):
+        consulta = consulta.strip()
+        if not consulta:
+            return
+        self._en_hilo(lambda cat: cat.buscar_notas(consulta, limite=self.MAX_FILAS), lambda filas: self._mostrar(
+            f"Informes con \"{consulta}\"",
+            [f"{empresa} / {medicion} / {puesto} ({(fecha or '')[:10]})\n    {fragmento.strip()}"
+             for empresa, medicion, puesto, fecha, _, fragmento in filas]))
+
+    def vencen_mes_proximo(self):
+        hoy = datetime.now()
+        mes = f"{hoy.year + hoy.month // 12:04d}-{hoy.month % 12 + 1:02d}"
+        self._en_hilo(lambda cat: cat.vencimientos(mes, mes), lambda filas: self._mostrar(
+            f"Carga vence en {mes}: {len(filas)} extintores",
+            [f"{empresa} / {sector}: {marca} {tipo} {capacidad}" + (f" [{codigo}]" if codigo else "")
+             for empresa, sector, marca, tipo, capacidad, codigo, _ in filas]))
+
+    def resumen_vencimientos(self):
+        desde = datetime.now().strftime('%Y-%m')
+        self._en_hilo(lambda cat: cat.resumen_vencimientos('carga', desde), lambda filas: self._mostrar(
+            "Vencimientos de carga por mes",
+            [f"{mes}: {n} extintores ({clientes} clientes)" for mes, n, clientes in filas]))
+
+    def informes_por_tipo(self):
+        self._en_hilo(lambda cat: cat.informes_por_medicion(), lambda filas: self._mostrar(
+            "Informes por tipo de medición",
+            [f"{medicion}: {n} informes ({clientes} clientes)" for medicion, n, clientes in filas]))
+
+    def cerrar(self):
+        # Espera la indexación en curso; después la conexión ya no la usa nadie
+        self._pool.shutdown(wait=True)
+        if self.catalogo is not None:
+            self.catalogo.cerrar()
+            self.catalogo = None
+
+PANTALLAS = {
+    'welcome': WelcomeScreen,
+    'project': ProjectScreen,
+    'measurement': MeasurementScreen,
+    'job': JobScreen,
+    'camera': CameraScreen,
+    'extinguisher_form': ExtinguisherFormScreen,
+    'review': ReviewScreen,
+    'gallery': GalleryScreen,
+    'grid': GridSurveyScreen,
+    'thermal': ThermalScreen,
+    'catalog': CatalogScreen,
+}
+
+# --- BENCHMARK SIN CABEZA (ESCRITORIO) ---
+# SDL_VIDEODRIVER=offscreen CIMACAM_BENCH=resultado.json python main.py
+# Corre la app entera con la cámara sintética sobre un proyecto temporal y
+# deja los resultados en JSON para comparar entre versiones. Todo el estado
+# de user_data_dir (diario, cámaras, calibraciones) va a una carpeta temporal.
+def percentiles_ms(muestras):
+    if not muestras:
+        return {}
+    orden = sorted(muestras)
+    def p(q):
+        return round(orden[min(len(orden) - 1, int(q * len(orden)))] * 1000, 2)
+    return {'n': len(orden), 'p50_ms': p(0.5), 'p90_ms': p(0.9), 'p99_ms': p(0.99),
+            'max_ms': round(orden[-1] * 1000, 2)}
+
+def memoria_maxima_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux/Android en KB, macOS en bytes
+    return round(maximo / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class BenchmarkSinCabeza:
+    FOTOS = 30
+    SEGUNDOS_PREVIEW = 3.0
+    CICLOS_GUIA = 50
+    FILAS_PLANILLA = 2000
+
+    def __init__(self, app, salida):
+        self.app = app
+        self.salida = salida
+        self.resultados = {'version': hash_archivo(os.path.abspath(__file__))[:12],
+                           'fecha': ahora_iso(), 'python': sys.version.split()[0], 'plataforma': platform}
+        self.carpeta = None
+
+    def iniciar(self):
+        self._pasos = self.pasos()
+        Clock.schedule_once(self._seguir, 0)
+
+    def _seguir(self, dt):
+        # Cada paso es un generador que cede los segundos a esperar
+        try:
+            espera = next(self._pasos)
+        except StopIteration:
+            return self.terminar()
+        except Exception as e:
+            print(f"Error Benchmark: {e}")
+            self.resultados['error'] = repr(e)
+            return self.terminar()
+        Clock.schedule_once(self._seguir, espera)
+
+    def esperar(self, condicion, limite):
+        t0 = time.perf_counter()
+        while not condicion() and time.perf_counter() - t0 < limite:
+            yield 0.02
+
+    def pasos(self):
+        app, r = self.app, self.resultados
+        r['arranque'] = PERFIL.reporte()
+        self.carpeta = os.path.join(app.user_data_dir, 'proyecto')
+        os.makedirs(self.carpeta, exist_ok=True)
+        app.current_company = 'BENCH'
+        app.path_empresa = self.carpeta
+        app.abrir_store()
+        app.current_measurement_type = 'ERGONOMIA'
+        app.root.current = 'job'
+        job = app.root.get_screen('job')
+        job.ids.puesto_input.text = 'Puesto'
+        t0 = time.perf_counter()
+        job.iniciar_puesto()
+        cam = app.root.get_screen('camera').ids.qrcam
+        yield from self.esperar(lambda: not cam._esperando_cuadro, 10)
+        r['camara_abierta_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+
+        # Preview: cuadros entregados al widget por segundo
+        cuadros = [0]
+        contar = lambda *args: cuadros.__setitem__(0, cuadros[0] + 1)
+        cam._camera.bind(on_texture=contar)
+        t0 = time.perf_counter()
+        yield self.SEGUNDOS_PREVIEW
+        cam._camera.unbind(on_texture=contar)
+        r['preview'] = {'fps': round(cuadros[0] / (time.perf_counter() - t0), 1),
+                        'fps_ui': round(Clock.get_fps(), 1), 'fps_fuente': CamaraSintetica.fps,
+                        'resolucion': list(cam._camera._resolution)}
+
+        # take_photo: desde el toque hasta el archivo escrito (foto_guardada)
+        pendientes, latencias = {}, []
+        original = cam.foto_guardada
+
+        def medido(meta, es_extintor=False):
+            t = pendientes.pop(meta['archivo'], None)
+            if t is not None:
+                latencias.append(time.perf_counter() - t)
+            original(meta, es_extintor)
+        cam.foto_guardada = medido
+        # Las tomas que no entran a la cola del pipeline no se miden: se cuentan aparte
+        rechazadas = [0]
+        cola_llena = cam.cola_llena
+
+        def rechazada(filename=None):
+            pendientes.pop(filename, None)
+            rechazadas[0] += 1
+            cola_llena(filename)
+        cam.cola_llena = rechazada
+        toques = []
+        for _ in range(self.FOTOS):
+            t = time.perf_counter()
+            reservadas = cam.pending_writes
+            cam.take_photo()
+            toques.append(time.perf_counter() - t)
+            if cam.pending_writes > reservadas:
+                # Reservó nombre y no la rechazó el submit (aún): temp_photo_path es esta toma
+                pendientes[app.temp_photo_path] = t
+            yield 0.1
+        yield from self.esperar(lambda: not pendientes, 30)
+        del cam.foto_guardada
+        del cam.cola_llena
+        r['captura'] = dict(percentiles_ms(latencias), formato=cam.capture_format,
+                            hilo_ui=percentiles_ms(toques), perdidas=len(pendientes),
+                            rechazadas=rechazadas[0])
+
+        # Codificación pura, sin UI, sobre un cuadro del sensor
+        pixels, size, colorfmt, invertir_y = cam.leer_cuadro_sensor()
+        frame = pixeles_a_bgr(pixels, size, colorfmt, invertir_y)
+        r['codificacion'] = {}
+        for formato in FORMATOS_FOTO:
+            destino = os.path.join(self.carpeta, f"bench.{formato}")
+            t0 = time.perf_counter()
+            for _ in range(5):
+                escribir_imagen(destino, frame, formato)
+            dt = (time.perf_counter() - t0) / 5
+            r['codificacion'][formato] = {'ms': round(dt * 1000, 1), 'mpx_s': round(frame.shape[0] * frame.shape[1] / dt / 1e6, 1),
+                                          'kb': os.path.getsize(destino) // 1024}
+            yield 0
+
+        # Cambio de lente: hasta el primer cuadro real de la nueva cámara
+        r['lentes'] = {}
+        for tipo in ('0.5x', 'front', '1x'):
+            cam.lens_switch_ms = 0
+            cam.cambiar_lente(tipo)
+            yield from self.esperar(lambda: cam.lens_switch_ms > 0, 10)
+            r['lentes'][tipo] = round(cam.lens_switch_ms, 1)
+
+        # Guías: ciclo completo sobre el atlas
+        t0 = time.perf_counter()
+        for _ in range(self.CICLOS_GUIA):
+            app.cycle_guide()
+        r['guias'] = {'ciclos': self.CICLOS_GUIA, 'disponibles': app.guides_available,
+                      'ms_por_cambio': round((time.perf_counter() - t0) * 1000 / self.CICLOS_GUIA, 3)}
+        yield 0
+
+        # Planillas: CSV de extintores + informes TXT
+        campos = {'marca': 'Marca', 'tipo': 'ABC', 'capacidad': '5kg', 'n_fab': '123',
+                  'venc_carga': '01/2027', 'venc_ph': '01/2030', 'empresa_mant': 'Mant'}
+        for i in range(self.FILAS_PLANILLA):
+            app.store.agregar_extintor(app.sector_id, f"EXT_{i}.jpg", campos)
+        for i in range(20):
+            app.store.agregar_nota(app.sector_id, f"Nota {i}")
+        app.store.confirmar()
+        t0 = time.perf_counter()
+        n_ext, n_inf = exportar_planillas(app.store.ruta, app.path_empresa, app.current_company)
+        r['planillas'] = {'extintores': n_ext, 'informes': n_inf,
+                          'ms': round((time.perf_counter() - t0) * 1000, 1)}
+        r['memoria_max_mb'] = memoria_maxima_mb()
+
+    def terminar(self):
+        with open(self.salida, 'w', encoding='utf-8') as f:
+            json.dump(self.resultados, f, ensure_ascii=False, indent=2)
+        print(json.dumps(self.resultados, ensure_ascii=False))
+        self.app.stop()
+
 class CimaCamApp(App):
     current_company = StringProperty("")
     current_post = StringProperty("")
     current_measurement_type = StringProperty("ERGONOMIA")
     path_empresa = ""
     path_puesto = ""
+    store = None
+    session_id = None
+    sector_id = None
+    camaras = None
+    ultimo_nivel_sonoro = None
+    resumen_termico = ListProperty([])
     temp_photo_path = "" 
+    video_pendiente = ""
     guide_list = ListProperty(['guia_frente.png', 'guia_perfil.png', 'guia_admin_perfil.png', 'guia_admin_frente.png', 'guia_levantamiento.png'])
     current_guide_index = NumericProperty(0)
     current_guide_image = StringProperty('')
-    
+    current_guide_texture = ObjectProperty(None, allownone=True)
+    guides_available = BooleanProperty(False)
+    # Carpeta con guías propias por medición: guias/<MEDICION>/*.png
+    guides_dir = 'guias'
+
     # --- VARIABLE DE ROTACIÓN ---
     cam_rotation = NumericProperty(0) 
 
+    @property
+    def user_data_dir(self):
+        # El benchmark no lee ni pisa el estado real: carpeta temporal propia,
+        # borrada al salir del proceso (on_stop corre dos veces y escribe el diario)
+        if os.environ.get('CIMACAM_BENCH'):
+            if not hasattr(self, '_carpeta_bench'):
+                self._carpeta_bench = tempfile.mkdtemp(prefix='cimacam_bench_')
+                atexit.register(shutil.rmtree, self._carpeta_bench, True)
+            return self._carpeta_bench
+        return super().user_data_dir
+
+    def calibracion_lux(self):
+        if not hasattr(self, '_calibracion_lux'):
+            self._calibracion_lux = CalibracionLux(self.user_data_dir, CameraCapabilities.modelo_dispositivo())
+        return self._calibracion_lux
+
+    def cargar_guias(self):
+        # Un atlas por tipo de medición, armado la primera vez que se abre la cámara
+        if not hasattr(self, '_atlas_guias'):
+            self._atlas_guias = {}
+        m = self.current_measurement_type
+        if m not in self._atlas_guias:
+            carpeta = os.path.join(self.directory, self.guides_dir, m)
+            if os.path.isdir(carpeta):
+                self._atlas_guias[m] = GuideAtlas.desde_carpeta(carpeta)
+            elif m == "ERGONOMIA":
+                self._atlas_guias[m] = GuideAtlas(self.guide_list)
+            else:
+                self._atlas_guias[m] = None
+        return self._atlas_guias[m]
+
+    def mostrar_guia(self):
+        atlas = self.cargar_guias()
+        if not atlas or not atlas.nombres:
+            self.current_guide_image = ''
+            self.current_guide_texture = None
+            return
+        nombre = atlas.nombres[self.current_guide_index % len(atlas.nombres)]
+        self.current_guide_image = nombre
+        self.current_guide_texture = atlas.regiones[nombre]
+
     def cycle_guide(self):
-        if self.current_measurement_type == "ERGONOMIA":
-            self.current_guide_index = (self.current_guide_index + 1) % len(self.guide_list)
-            self.current_guide_image = self.guide_list[self.current_guide_index]
+        atlas = self.cargar_guias()
+        if self.guides_available and atlas:
+            self.current_guide_index = (self.current_guide_index + 1) % len(atlas.nombres)
+            self.mostrar_guia()
+
+    def abrir_store(self, reanudar=False):
+        if self.store is not None:
+            if self.store.ruta == os.path.join(self.path_empresa, ProjectStore.ARCHIVO):
+                self.session_id = self.store.nueva_sesion(self.current_company)
+                return
+            self.store.cerrar()
+        self.store = ProjectStore(self.path_empresa)
+        if not (reanudar and self.session_id):
+            self.session_id = self.store.nueva_sesion(self.current_company)
+        self.almacenamiento.usar(self.store, self.path_empresa)
+
+    # --- SESIÓN: DIARIO Y REANUDACIÓN ---
+    CAMPOS_SESION = ('current_company', 'path_empresa', 'current_measurement_type', 'current_post',
+                     'path_puesto', 'temp_photo_path', 'session_id', 'sector_id', 'video_pendiente')
+    # Pantallas a las que se vuelve tras un cierre forzado
+    PANTALLAS_REANUDABLES = ('measurement', 'job', 'camera', 'extinguisher_form', 'review',
+                             'gallery', 'grid', 'thermal')
+
+    def anotar_sesion(self, sincronizar=False):
+        # Solo se escriben los campos que cambiaron desde la última línea
+        if self.root.current not in self.PANTALLAS_REANUDABLES:
+            if self.diario.estado:
+                self.diario.registrar({'_fin': True}, sincronizar)
+            return
+        estado = {campo: getattr(self, campo) for campo in self.CAMPOS_SESION}
+        estado['pantalla'] = self.root.current
+        cambios = {k: v for k, v in estado.items() if self.diario.estado.get(k, None) != v}
+        if cambios:
+            self.diario.registrar(cambios, sincronizar)
+        elif sincronizar:
+            self.diario.sincronizar()
+
+    def reanudar_sesion(self, estado):
+        pantalla = estado.get('pantalla')
+        if pantalla not in self.PANTALLAS_REANUDABLES or not os.path.isdir(estado.get('path_empresa', '')):
+            return False
+        for campo in self.CAMPOS_SESION:
+            if campo in estado:
+                setattr(self, campo, estado[campo])
+        self.abrir_store(reanudar=True)
+        self.almacenamiento.sector_actual = self.sector_id
+        sm = self.root
+        if pantalla == 'extinguisher_form':
+            form = sm.get_screen('extinguisher_form')
+            form.cargar_imagen('')
+            ruta = ruta_miniatura(self.temp_photo_path)
+            form.mostrar_preview(ruta if os.path.exists(ruta) else self.temp_photo_path)
+        sm.current = pantalla
+        self.revisar_video_pendiente()
+        print(f"Sesión reanudada: {self.current_company} / {self.current_post} ({pantalla})")
+        return True
+
+    def revisar_video_pendiente(self):
+        # El intent de video pudo terminar (o no) mientras la app estaba cerrada
+        if self.video_pendiente:
+            nombre = os.path.basename(self.video_pendiente)
+            if os.path.exists(self.video_pendiente) and os.path.getsize(self.video_pendiente):
+                self.mostrar_aviso("Video", f"Video guardado:\n{nombre}")
+            self.video_pendiente = ""
+            self.anotar_sesion()
 
     def mostrar_aviso(self, titulo, mensaje):
         content = BoxLayout(orientation='vertical', padding=10)
@@ -859,10 +5654,19 @@ class CimaCamApp(App):
         content.add_widget(btn)
         popup = Popup(title=titulo, content=content, size_hint=(0.8, 0.4))
         btn.bind(on_release=popup.dismiss)
+        self.control_camara.vigilar_popup(popup)
         popup.open()
 
     def build(self):
         Window.bind(on_keyboard=self.on_key)
+        self.camaras = CameraCapabilities(self.user_data_dir)
+        if platform != 'android':
+            self.camaras.cargar_o_sondear()
+        self.miniaturas = ThumbnailCache() if cv2 is not None else None
+        self.almacenamiento = GestorAlmacenamiento(self.user_data_dir)
+        self.almacenamiento.ocupado = lambda: (self.root.has_screen('camera')
+                                               and (self.root.get_screen('camera').ids.qrcam.pending_writes > 0
+                                                    or self.root.get_screen('camera').ids.qrcam.is_recording))
         
         # --- ROTACIÓN AJUSTADA A 270 GRADOS ---
         if platform == 'android':
@@ -871,15 +5675,54 @@ class CimaCamApp(App):
             self.cam_rotation = 0
 
         if platform == 'android':
-            from android.permissions import request_permissions, Permission
+            from android.permissions import request_permissions, check_permission, Permission
+            # El sondeo abre las cámaras: sin el permiso fallaría en el primer arranque
+            if check_permission(Permission.CAMERA):
+                self.camaras.cargar_o_sondear()
             request_permissions([
                 Permission.CAMERA,
                 Permission.RECORD_AUDIO,
                 Permission.WRITE_EXTERNAL_STORAGE,
                 Permission.READ_EXTERNAL_STORAGE,
                 Permission.INTERNET
-            ])
-        return Builder.load_string(KV)
+            ], self._permisos_respondidos)
+        with PERFIL.medir('kv base'):
+            Builder.load_string(KV)
+        with PERFIL.medir('diario de sesión'):
+            self.diario = DiarioSesion(self.user_data_dir)
+            self._sesion_previa = self.diario.recuperar()
+        sm = LazyScreenManager(PANTALLAS)
+        self.control_camara = ControladorCamara(self)
+        sm.bind(current=self.control_camara.pantalla)
+        Window.bind(on_touch_down=self.control_camara.actividad)
+        sm.current = 'welcome'
+        return sm
+
+    def _permisos_respondidos(self, permisos, otorgados):
+        if 'android.permission.CAMERA' in [p for p, ok in zip(permisos, otorgados) if ok]:
+            self.camaras.cargar_o_sondear()
+
+    def on_start(self):
+        PERFIL.marcar('build')
+        Window.bind(on_flip=self._primer_frame)
+        try:
+            if not os.environ.get('CIMACAM_BENCH'):
+                self.reanudar_sesion(self._sesion_previa)
+        except Exception as e:
+            print(f"Error Reanudar: {e}")
+        self._anotar = Clock.create_trigger(lambda dt: self.anotar_sesion())
+        self.root.bind(current=lambda *args: self._anotar())
+        self.bind(current_company=lambda *args: self._anotar(), current_post=lambda *args: self._anotar(),
+                  current_measurement_type=lambda *args: self._anotar())
+
+    def _primer_frame(self, *args):
+        Window.unbind(on_flip=self._primer_frame)
+        PERFIL.marcar('primer frame')
+        if os.environ.get('CIMACAM_PERFIL'):
+            PERFIL.imprimir()
+            self.stop()
+        elif os.environ.get('CIMACAM_BENCH'):
+            BenchmarkSinCabeza(self, os.environ['CIMACAM_BENCH']).iniciar()
 
     def on_key(self, window, key, *args):
         if key == 27:
@@ -887,8 +5730,13 @@ class CimaCamApp(App):
             if sm.current == 'extinguisher_form':
                 sm.current = 'camera'
                 return True
+            elif sm.current == 'gallery':
+                sm.get_screen('gallery').volver()
+                return True
+            elif sm.current in ('grid', 'thermal'):
+                sm.current = 'camera'
+                return True
             elif sm.current == 'camera':
-                sm.get_screen('camera').ids.qrcam.stop_camera()
                 sm.current = 'job'
                 return True
             elif sm.current == 'job':
@@ -897,7 +5745,52 @@ class CimaCamApp(App):
             elif sm.current == 'measurement':
                 sm.current = 'project'
                 return True
+            elif sm.current == 'catalog':
+                sm.current = 'welcome'
+                return True
             return False
 
+    def on_pause(self):
+        if self.store is not None:
+            self.store.confirmar()
+        self.anotar_sesion(sincronizar=True)
+        self.control_camara.pausa_app(True)
+        return True
+
+    def on_resume(self):
+        self.control_camara.pausa_app(False)
+        self.revisar_video_pendiente()
+
+    def on_stop(self):
+        # Espera a que terminen de escribirse las fotos en cola
+        if self.root.has_screen('camera'):
+            cam = self.root.get_screen('camera').ids.qrcam
+            if cam.pipeline is not None:
+                cam.pipeline.cerrar(entregar=True)
+            for analizador in (cam.analizador_foco, cam.analizador_luz, cam.analizador_etiquetas):
+                if analizador is not None:
+                    analizador.cerrar()
+            for grabador in cam._cerrando + [cam.grabador]:
+                if grabador is not None:
+                    # Sin Clock: se cierra el segmento y se registra acá
+                    grabador.on_fin = None
+                    grabador.detener(esperar=True)
+                    grabador.entregar()
+            sonometro = self.root.get_screen('camera').sonometro
+            if sonometro is not None:
+                # Al cerrar la app no corre el Clock: se guarda acá directamente
+                sonometro.on_fin = None
+                sonometro.detener(esperar=True)
+                if self.store is not None and sonometro.medidor.bloques:
+                    self.store.agregar_nivel_sonoro(self.sector_id, sonometro.fuente.nombre,
+                                                    sonometro.medidor.resultado())
+        if self.root.has_screen('catalog'):
+            self.root.get_screen('catalog').cerrar()
+        self.almacenamiento.detener()
+        if self.store is not None:
+            self.store.cerrar()
+            self.store = None
+        self.diario.cerrar()
+
 if __name__ == '__main__':
     CimaCamApp().run()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# main.py importa Kivy (y crea la ventana) al cargarse: sin pantalla ni argumentos
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,143 @@
+import csv
+import os
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('texto, mes', [
+    ('10/2027', '2027-10'),
+    ('10/27', '2027-10'),
+    ('15/10/2027', '2027-10'),
+    ('2027-10', '2027-10'),
+    ('2027-10-15', '2027-10'),
+    ('2027/1', '2027-01'),
+    ('01-2030', '2030-01'),
+    ('vence 03.2026', '2026-03'),
+    ('13/2027', None),
+    ('2027-00', None),
+    ('sin dato', None),
+    ('', None),
+    (None, None),
+])
+def test_mes_vencimiento(texto, mes):
+    assert main.mes_vencimiento(texto) == mes
+
+
+def escribir_planilla(raiz, empresa, nombre, filas):
+    carpeta = os.path.join(raiz, empresa)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f"Relevamiento_Extintores_{nombre}.csv")
+    with open(ruta, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(main.ENCABEZADOS_EXTINTORES)
+        for fecha, sector, venc_carga, codigo in filas:
+            writer.writerow([fecha, sector, 'EXT.jpg', 'Marca', 'ABC', '5kg', '1', venc_carga, '01/2030',
+                             'Mant', codigo])
+    return ruta
+
+
+@pytest.fixture
+def catalogo(tmp_path):
+    raiz = tmp_path / 'datos'
+    raiz.mkdir()
+    cat = main.CatalogoDatos(str(raiz), str(tmp_path / 'catalogo.db'))
+    yield cat
+    cat.cerrar()
+
+
+def test_vale_el_relevamiento_mas_reciente_por_fecha(catalogo):
+    # El de 2026 se indexa primero; la planilla de 2025 llega después (id mayor)
+    escribir_planilla(catalogo.raiz, 'ACME', 'nuevo', [('10/03/2026 10:00:00', 'Planta', '03/2027', 'EXT-1')])
+    catalogo.indexar()
+    escribir_planilla(catalogo.raiz, 'ACME', 'viejo', [('10/03/2025 10:00:00', 'Planta', '03/2026', 'EXT-1')])
+    catalogo.indexar()
+    assert catalogo.vencimientos('2026-01', '2027-12') == [
+        ('ACME', 'Planta', 'Marca', 'ABC', '5kg', 'EXT-1', '2027-03')]
+    assert catalogo.resumen_vencimientos() == [('2027-03', 1, 1)]
+
+
+def test_sin_codigo_cuenta_cada_registro(catalogo):
+    escribir_planilla(catalogo.raiz, 'ACME', 'a', [('01/01/2026 09:00', 'Depósito', '05/2026', ''),
+                                                  ('01/01/2026 09:05', 'Depósito', '05/2026', '')])
+    escribir_planilla(catalogo.raiz, 'OTRA', 'b', [('02/01/2026 09:00', 'Oficina', '05/2026', 'EXT-1')])
+    catalogo.indexar()
+    assert catalogo.resumen_vencimientos() == [('2026-05', 3, 2)]
+    assert len(catalogo.vencimientos('2026-05', '2026-05', empresa='OTRA')) == 1
+
+
+def test_reindexado_incremental(catalogo):
+    ruta = escribir_planilla(catalogo.raiz, 'ACME', 'a', [('01/01/2026 09:00', 'Planta', '05/2026', 'EXT-1')])
+    escribir_planilla(catalogo.raiz, 'ACME', 'b', [('01/01/2026 09:00', 'Planta', '06/2026', 'EXT-2')])
+    assert catalogo.indexar()['cambiados'] == 2
+    assert catalogo.indexar()['cambiados'] == 0
+    escribir_planilla(catalogo.raiz, 'ACME', 'a', [('01/01/2026 09:00', 'Planta', '07/2026', 'EXT-1'),
+                                                  ('01/01/2026 09:10', 'Planta', '07/2026', 'EXT-3')])
+    os.utime(ruta, ns=(0, 0))
+    datos = catalogo.indexar()
+    assert (datos['cambiados'], datos['borrados']) == (1, 0)
+    assert catalogo.resumen_vencimientos() == [('2026-06', 1, 1), ('2026-07', 2, 1)]
+    os.remove(ruta)
+    assert catalogo.indexar()['borrados'] == 1
+    assert catalogo.resumen_vencimientos() == [('2026-06', 1, 1)]
+
+
+def proyecto_con_base(raiz, empresa):
+    store = main.ProjectStore(os.path.join(raiz, empresa))
+    sesion = store.nueva_sesion(empresa)
+    sector = store.nuevo_sector(sesion, 'RUIDO', 'Planta', os.path.join(raiz, empresa, 'RUIDO_Planta'))
+    return store, sector
+
+
+def extintor(store, sector, venc_carga, codigo=''):
+    campos = dict({c: 'x' for c in main.CAMPOS_EXTINTOR}, venc_carga=venc_carga)
+    store.agregar_extintor(sector, 'EXT.jpg', campos, codigo)
+    store.confirmar()
+
+
+def test_proyecto_sin_exportar_se_lee_de_la_base(catalogo):
+    os.makedirs(os.path.join(catalogo.raiz, 'ACME'))
+    store, sector = proyecto_con_base(catalogo.raiz, 'ACME')
+    try:
+        extintor(store, sector, '04/2027', 'EXT-9')
+        store.agregar_nota(sector, 'Compresor ruidoso en la nave')
+        store.confirmar()
+        catalogo.indexar()
+        assert catalogo.vencimientos('2027-04', '2027-04') == [
+            ('ACME', 'Planta', 'x', 'x', 'x', 'EXT-9', '2027-04')]
+        assert [(e, m, p) for e, m, p, _, _, _ in catalogo.buscar_notas('compresor')] == [('ACME', 'RUIDO', 'Planta')]
+        # Lo nuevo queda en el WAL hasta el checkpoint: igual se re-indexa
+        extintor(store, sector, '05/2027')
+        assert catalogo.indexar()['cambiados'] == 1
+        assert catalogo.resumen_vencimientos() == [('2027-04', 1, 1), ('2027-05', 1, 1)]
+    finally:
+        store.cerrar()
+
+
+def test_con_base_no_se_cuentan_las_planillas_exportadas(catalogo):
+    os.makedirs(os.path.join(catalogo.raiz, 'ACME'))
+    store, sector = proyecto_con_base(catalogo.raiz, 'ACME')
+    try:
+        extintor(store, sector, '04/2027')
+        store.agregar_nota(sector, 'nota')
+        store.confirmar()
+        main.exportar_planillas(store.ruta, os.path.join(catalogo.raiz, 'ACME'), 'ACME')
+    finally:
+        store.cerrar()
+    escribir_planilla(catalogo.raiz, 'VIEJA', 'x', [('01/01/2024 09:00', 'Planta', '04/2027', '')])
+    assert catalogo.indexar()['archivos'] == 2
+    assert catalogo.resumen_vencimientos() == [('2027-04', 2, 2)]
+    assert len(catalogo.buscar_notas('nota')) == 1
+
+
+def test_base_vieja_sin_columna_de_codigo(catalogo):
+    carpeta = os.path.join(catalogo.raiz, 'ACME')
+    os.makedirs(carpeta)
+    store, sector = proyecto_con_base(catalogo.raiz, 'ACME')
+    extintor(store, sector, '04/2027', 'EXT-1')
+    store.con.execute("DROP INDEX idx_extinguishers_codigo")
+    store.con.execute("ALTER TABLE extinguishers DROP COLUMN codigo")
+    store.cerrar()
+    catalogo.indexar()
+    assert catalogo.resumen_vencimientos() == [('2027-04', 1, 1)]
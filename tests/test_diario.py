@@ -0,0 +1,90 @@
+import json
+import os
+
+import main
+
+
+def abrir(carpeta):
+    diario = main.DiarioSesion(str(carpeta))
+    return diario, diario.recuperar()
+
+
+def test_sin_archivos_arranca_vacio(tmp_path):
+    diario, estado = abrir(tmp_path)
+    assert estado == {}
+    assert diario.seq == 0
+
+
+def test_recupera_lo_registrado(tmp_path):
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'empresa': 'ACME', 'puesto': 'P1'})
+    diario.registrar({'puesto': 'P2', 'fotos': 3}, sincronizar=True)
+    _, estado = abrir(tmp_path)
+    assert estado == {'empresa': 'ACME', 'puesto': 'P2', 'fotos': 3}
+
+
+def test_fin_de_sesion_limpia_el_estado(tmp_path):
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'empresa': 'ACME'})
+    diario.registrar({'_fin': True}, sincronizar=True)
+    assert abrir(tmp_path)[1] == {}
+
+
+def test_ultima_linea_cortada(tmp_path):
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'empresa': 'ACME'})
+    diario.registrar({'puesto': 'P1'}, sincronizar=True)
+    with open(diario.ruta_diario, 'a', encoding='utf-8') as f:
+        f.write('{"puesto": "P2", "_se')
+    diario, estado = abrir(tmp_path)
+    assert estado == {'empresa': 'ACME', 'puesto': 'P1'}
+    # Se compacta: lo siguiente no queda pegado a la línea a medias
+    diario.registrar({'puesto': 'P3'}, sincronizar=True)
+    assert abrir(tmp_path)[1] == {'empresa': 'ACME', 'puesto': 'P3'}
+
+
+def test_ultima_linea_cortada_en_medio_de_un_caracter(tmp_path):
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'empresa': 'ACME'}, sincronizar=True)
+    with open(diario.ruta_diario, 'ab') as f:
+        f.write('{"puesto": "Depósito'.encode('utf-8')[:-5])
+    diario, estado = abrir(tmp_path)
+    assert estado == {'empresa': 'ACME'}
+    diario.registrar({'puesto': 'Depósito'}, sincronizar=True)
+    assert abrir(tmp_path)[1] == {'empresa': 'ACME', 'puesto': 'Depósito'}
+
+
+def test_compacta_cada_tantas_lineas(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.DiarioSesion, 'COMPACTAR_CADA', 4)
+    diario, _ = abrir(tmp_path)
+    for n in range(10):
+        diario.registrar({'n': n})
+    diario.sincronizar()
+    with open(diario.ruta_diario, encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+    with open(diario.ruta_instantanea, encoding='utf-8') as f:
+        assert json.load(f) == {'seq': 8, 'estado': {'n': 7}}
+    diario, estado = abrir(tmp_path)
+    assert estado == {'n': 9}
+    assert diario.seq == 10
+
+
+def test_corte_entre_instantanea_y_truncado(tmp_path):
+    # El diario todavía tiene líneas que la instantánea ya incluye
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'n': 1})
+    diario.registrar({'lista': ['a']})
+    diario.registrar({'n': 2}, sincronizar=True)
+    with open(diario.ruta_instantanea, 'w', encoding='utf-8') as f:
+        json.dump({'seq': 2, 'estado': {'n': 1, 'lista': ['a', 'b']}}, f)
+    diario, estado = abrir(tmp_path)
+    assert estado == {'n': 2, 'lista': ['a', 'b']}
+    assert diario.seq == 3
+
+
+def test_cerrar_deja_todo_en_la_instantanea(tmp_path):
+    diario, _ = abrir(tmp_path)
+    diario.registrar({'empresa': 'ACME'})
+    diario.cerrar()
+    assert os.path.getsize(diario.ruta_diario) == 0
+    assert abrir(tmp_path)[1] == {'empresa': 'ACME'}
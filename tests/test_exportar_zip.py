@@ -0,0 +1,127 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import main
+
+
+def crear_proyecto(carpeta):
+    archivos = {
+        'Relevamiento_Extintores_ACME.csv': b'Fecha;Sector\n' * 50,
+        'RUIDO_P1/Foto_1.jpg': os.urandom(3000),
+        'RUIDO_P1/Foto_2.jpg': os.urandom(5000),
+        'RUIDO_P1/Informe_101010.txt': 'CLIENTE: ACME\nTIPO: RUIDO\n'.encode('utf-8') * 20,
+        'ILUMINACION_P2/Foto_3.webp': os.urandom(4000),
+        'ILUMINACION_P2/Foto_4.png': os.urandom(2500),
+    }
+    for rel, datos in archivos.items():
+        ruta = carpeta / rel
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        ruta.write_bytes(datos)
+    return archivos
+
+
+def contenido(zip_path):
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        nombres = zf.namelist()
+        assert len(nombres) == len(set(nombres))
+        return {n: zf.read(n) for n in nombres}
+
+
+class ExportadorCortado(main.ExportadorProyecto):
+    # Checkpoint tras cada archivo; después del segundo queda una foto grande a
+    # medio escribir (sin directorio central) y se corta como si la app muriera
+    CHECKPOINT_BYTES = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoints = 0
+
+    def _guardar_progreso(self, progreso):
+        super()._guardar_progreso(progreso)
+        self.checkpoints += 1
+        if self.checkpoints == 2:
+            with open(self.parcial, 'ab') as f:
+                f.write(b'PK\x03\x04' + os.urandom(200 * 1024))
+            raise RuntimeError("corte")
+
+
+def test_exportacion_completa(tmp_path):
+    carpeta = tmp_path / 'ACME'
+    archivos = crear_proyecto(carpeta)
+    (carpeta / 'cimacam.db-wal').write_bytes(b'x')
+    (carpeta / '.miniaturas').mkdir()
+    (carpeta / '.miniaturas' / 'a.jpg').write_bytes(b'y')
+    destino = str(tmp_path / 'ACME.zip')
+
+    assert main.ExportadorProyecto(str(carpeta), destino)._exportar() == destino
+
+    assert contenido(destino) == archivos
+    assert not os.path.exists(destino + '.part')
+    assert not os.path.exists(destino + '.progreso.json')
+
+
+def test_reanuda_tras_escritura_truncada(tmp_path):
+    carpeta = tmp_path / 'ACME'
+    archivos = crear_proyecto(carpeta)
+    destino = str(tmp_path / 'ACME.zip')
+
+    cortado = ExportadorCortado(str(carpeta), destino)
+    with pytest.raises(RuntimeError):
+        cortado._exportar()
+    with open(destino + '.progreso.json', encoding='utf-8') as f:
+        progreso = json.load(f)
+    assert len(progreso['hechos']) == 2
+    # Lo escrito después del checkpoint sigue en el .part hasta reanudar
+    assert os.path.getsize(destino + '.part') > progreso['offset']
+
+    assert main.ExportadorProyecto(str(carpeta), destino)._exportar() == destino
+
+    assert contenido(destino) == archivos
+    assert not os.path.exists(destino + '.progreso.json')
+
+
+def test_cancelar_y_reanudar(tmp_path):
+    carpeta = tmp_path / 'ACME'
+    archivos = crear_proyecto(carpeta)
+    destino = str(tmp_path / 'ACME.zip')
+
+    exportador = main.ExportadorProyecto(str(carpeta), destino)
+    exportador.cancelar()
+    assert exportador._exportar() is None
+    assert os.path.exists(destino + '.progreso.json')
+
+    assert main.ExportadorProyecto(str(carpeta), destino)._exportar() == destino
+    assert contenido(destino) == archivos
+
+
+def test_duplicados_se_listan_sin_copiar(tmp_path):
+    carpeta = tmp_path / 'ACME'
+    crear_proyecto(carpeta)
+    repetida = (carpeta / 'RUIDO_P1' / 'Foto_1.jpg').read_bytes()
+    (carpeta / 'RUIDO_P1' / 'Foto_1_copia.jpg').write_bytes(repetida)
+    destino = str(tmp_path / 'ACME.zip')
+
+    main.ExportadorProyecto(str(carpeta), destino)._exportar()
+
+    datos = contenido(destino)
+    assert ('RUIDO_P1/Foto_1.jpg' in datos) != ('RUIDO_P1/Foto_1_copia.jpg' in datos)
+    assert b'Foto_1' in datos['DUPLICADOS.txt'] and b'Foto_1_copia' in datos['DUPLICADOS.txt']
+
+
+def test_archivos_vacios_no_cuentan_como_duplicados(tmp_path):
+    carpeta = tmp_path / 'ACME'
+    crear_proyecto(carpeta)
+    for rel in ('RUIDO_P1/vacio.txt', 'ILUMINACION_P2/vacio.txt', 'ILUMINACION_P2/otro.txt'):
+        (carpeta / rel).write_bytes(b'')
+    destino = str(tmp_path / 'ACME.zip')
+
+    main.ExportadorProyecto(str(carpeta), destino)._exportar()
+
+    datos = contenido(destino)
+    for rel in ('RUIDO_P1/vacio.txt', 'ILUMINACION_P2/vacio.txt', 'ILUMINACION_P2/otro.txt'):
+        assert datos[rel] == b''
+    assert 'DUPLICADOS.txt' not in datos
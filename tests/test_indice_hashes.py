@@ -0,0 +1,93 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+
+
+def voltear(h, bits):
+    for b in bits:
+        h ^= 1 << b
+    return h
+
+
+def por_fuerza_bruta(hashes, h, radio):
+    return sorted((main.distancia_hamming(h, otro), clave) for clave, otro in hashes.items()
+                  if main.distancia_hamming(h, otro) <= radio)
+
+
+def test_distancia_hamming():
+    assert main.distancia_hamming(0, 0) == 0
+    assert main.distancia_hamming(0b1011, 0b0010) == 2
+    assert main.distancia_hamming(0, (1 << 64) - 1) == 64
+
+
+@pytest.mark.parametrize('radio', [0, 3, 6, 9])
+def test_buscar_coincide_con_fuerza_bruta(radio):
+    azar = random.Random(radio)
+    indice = main.IndiceHashes(radio)
+    hashes = {}
+    for i in range(300):
+        base = azar.getrandbits(64)
+        hashes[f'a{i}'] = base
+        # Vecinos cerca del borde del radio, repartidos o juntos en un trozo
+        hashes[f'b{i}'] = voltear(base, azar.sample(range(64), radio))
+        hashes[f'c{i}'] = voltear(base, azar.sample(range(16), min(radio + 1, 16)))
+    for clave, h in hashes.items():
+        indice.agregar(clave, h, dato=clave.upper())
+    assert len(indice) == len(hashes)
+    for consulta in list(hashes.values())[:200] + [azar.getrandbits(64) for _ in range(50)]:
+        encontrados = indice.buscar(consulta)
+        assert sorted((d, clave) for d, clave, _ in encontrados) == por_fuerza_bruta(hashes, consulta, radio)
+        assert [d for d, _, _ in encontrados] == sorted(d for d, _, _ in encontrados)
+        assert all(dato == clave.upper() for _, clave, dato in encontrados)
+
+
+def test_peor_caso_del_palomar():
+    # radio 6 en 4 trozos: 2+2+1+1 bits, ningún trozo coincide exacto
+    indice = main.IndiceHashes(6)
+    base = 0x0123456789ABCDEF
+    vecino = voltear(base, [0, 1, 16, 17, 32, 48])
+    indice.agregar('x', vecino)
+    assert [(d, c) for d, c, _ in indice.buscar(base)] == [(6, 'x')]
+    assert indice.buscar(voltear(vecino, [2, 3, 18, 19, 33, 49, 50])) == []
+
+
+def test_quitar_limpia_las_tablas():
+    indice = main.IndiceHashes()
+    indice.agregar('a', 0xFFFF)
+    indice.agregar('b', 0xFFFE)
+    indice.quitar('a')
+    assert len(indice) == 1
+    assert [c for _, c, _ in indice.buscar(0xFFFF)] == ['b']
+    indice.quitar('b')
+    assert indice.buscar(0xFFFF) == []
+    assert all(tabla == {} for tabla in indice.tablas)
+
+
+def test_agregar_de_nuevo_actualiza_el_dato():
+    # Así se sigue un renombrado: mismo hash, archivo nuevo
+    indice = main.IndiceHashes(2)
+    indice.agregar(7, 0xABCD, 'viejo.jpg')
+    indice.agregar(7, 0xABCD, 'nuevo.jpg')
+    assert indice.buscar(0xABCD) == [(0, 7, 'nuevo.jpg')]
+    indice.quitar(7)
+    assert all(tabla == {} for tabla in indice.tablas)
+
+
+def escena(azar):
+    return cv2.resize(azar.integers(0, 256, (12, 16)).astype(np.uint8), (320, 240),
+                      interpolation=cv2.INTER_CUBIC)
+
+
+def test_hash_perceptual_tolera_ruido_y_escala():
+    azar = np.random.default_rng(0)
+    imagen = escena(azar)
+    ruidosa = (imagen + azar.normal(0, 4, imagen.shape)).clip(0, 255).astype(np.uint8)
+    h = main.hash_perceptual(imagen)
+    assert 0 <= h < 1 << 64
+    assert main.distancia_hamming(h, main.hash_perceptual(ruidosa)) <= 6
+    assert main.distancia_hamming(h, main.hash_perceptual(cv2.resize(imagen, (160, 120)))) <= 6
+    assert main.distancia_hamming(h, main.hash_perceptual(escena(azar))) > 6
@@ -0,0 +1,64 @@
+import os
+
+import main
+
+
+def crear_store(carpeta, notas):
+    store = main.ProjectStore(str(carpeta))
+    sesion = store.nueva_sesion('ACME')
+    sector = store.nuevo_sector(sesion, 'RUIDO', 'P1', str(carpeta / 'RUIDO_P1'))
+    ids = []
+    for texto in notas:
+        ids.append(store.agregar_nota(sector, texto))
+        # Todas en el mismo segundo
+        store.con.execute("UPDATE notes SET fecha = '2026-03-10 10:11:12' WHERE id = ?", (ids[-1],))
+    store.agregar_extintor(sector, 'EXT.jpg', {c: 'x' for c in main.CAMPOS_EXTINTOR})
+    store.confirmar()
+    return store, sector, ids
+
+
+def informes(carpeta):
+    return sorted(n for n in os.listdir(carpeta / 'RUIDO_P1') if n.startswith('Informe_'))
+
+
+def test_notas_del_mismo_segundo_no_se_pisan(tmp_path):
+    store, _, ids = crear_store(tmp_path, ['primera', 'segunda'])
+    try:
+        assert main.exportar_planillas(store.ruta, str(tmp_path), 'ACME') == (1, 2)
+        assert informes(tmp_path) == [f'Informe_101112_{i}.txt' for i in ids]
+        textos = [open(tmp_path / 'RUIDO_P1' / n, encoding='utf-8').read() for n in informes(tmp_path)]
+        assert textos[0].startswith('CLIENTE: ACME\nTIPO: RUIDO\nPUESTO: P1\nFECHA: 10/03/2026 10:11\n')
+        assert [t.rsplit('\n', 1)[1] for t in textos] == ['primera', 'segunda']
+    finally:
+        store.cerrar()
+
+
+def test_reexportar_sin_cambios_no_toca_los_archivos(tmp_path):
+    store, sector, ids = crear_store(tmp_path, ['nota'])
+    try:
+        main.exportar_planillas(store.ruta, str(tmp_path), 'ACME')
+        rutas = [tmp_path / 'RUIDO_P1' / f'Informe_101112_{ids[0]}.txt',
+                 tmp_path / 'Relevamiento_Extintores_ACME.csv']
+        for ruta in rutas:
+            os.utime(ruta, ns=(0, 0))
+        main.exportar_planillas(store.ruta, str(tmp_path), 'ACME')
+        assert [os.stat(r).st_mtime_ns for r in rutas] == [0, 0]
+        store.agregar_nota(sector, 'otra')
+        store.confirmar()
+        main.exportar_planillas(store.ruta, str(tmp_path), 'ACME')
+        assert [os.stat(r).st_mtime_ns for r in rutas] == [0, 0]
+        assert len(informes(tmp_path)) == 2
+    finally:
+        store.cerrar()
+
+
+def test_reemplaza_el_informe_con_el_nombre_viejo(tmp_path):
+    store, _, ids = crear_store(tmp_path, ['nota'])
+    try:
+        main.exportar_planillas(store.ruta, str(tmp_path), 'ACME')
+        carpeta = tmp_path / 'RUIDO_P1'
+        (carpeta / f'Informe_101112_{ids[0]}.txt').rename(carpeta / 'Informe_101112.txt')
+        main.exportar_planillas(store.ruta, str(tmp_path), 'ACME')
+        assert informes(tmp_path) == [f'Informe_101112_{ids[0]}.txt']
+    finally:
+        store.cerrar()
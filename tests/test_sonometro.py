@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+import pytest
+
+import main
+
+TASA = 48000
+
+
+def seno(frecuencia, segundos, amplitud=1.0):
+    t = np.arange(int(TASA * segundos)) / TASA
+    return (amplitud * np.sin(2 * np.pi * frecuencia * t)).astype(np.float32)
+
+
+def medir(muestras, **kwargs):
+    medidor = main.MedidorSonido(TASA, **kwargs)
+    medidor.procesar(muestras)
+    return medidor.resultado()
+
+
+def test_sin_bloques_completos_no_hay_resultado():
+    medidor = main.MedidorSonido(TASA)
+    medidor.procesar(np.zeros(100, dtype=np.float32))
+    assert medidor.resultado() == {}
+
+
+def test_seno_de_1khz_a_escala_completa():
+    # Valor eficaz 1/sqrt(2) -> 120 - 3.01 dB; A y C valen 0 dB en 1 kHz
+    datos = medir(seno(1000, 2.0))
+    assert datos['laeq'] == pytest.approx(116.99, abs=0.05)
+    assert datos['lceq'] == pytest.approx(116.99, abs=0.05)
+    assert datos['lcpeak'] == pytest.approx(120.0, abs=0.1)
+    assert datos['duracion'] == pytest.approx(2.0)
+    # Señal estacionaria: todos los percentiles coinciden con el equivalente
+    for clave in ('lamax', 'lamin', 'la10', 'la50', 'la90'):
+        assert datos[clave] == pytest.approx(datos['laeq'], abs=0.15)
+
+
+def test_ponderaciones_a_y_c_en_100hz():
+    # IEC 61672: A = -19.1 dB, C = -0.3 dB en 100 Hz
+    datos = medir(seno(100, 2.0))
+    assert datos['laeq'] - 116.99 == pytest.approx(-19.1, abs=0.3)
+    assert datos['lceq'] - 116.99 == pytest.approx(-0.3, abs=0.3)
+
+
+def test_offset_de_calibracion():
+    base = medir(seno(1000, 1.0))
+    calibrado = medir(seno(1000, 1.0), offset_db=94.0)
+    assert calibrado['laeq'] == pytest.approx(base['laeq'] - 26.0, abs=1e-6)
+
+
+def test_resultado_no_depende_del_tamanio_de_lectura():
+    senal = np.concatenate((seno(1000, 1.0, 0.5), seno(250, 1.5, 0.05)))
+    entero = medir(senal)
+    medidor = main.MedidorSonido(TASA)
+    for i in range(0, senal.size, 4097):
+        medidor.procesar(senal[i:i + 4097])
+    assert medidor.resultado() == pytest.approx(entero)
+
+
+def test_percentiles_y_extremos_con_dos_niveles():
+    # 10 s a 94 dB seguidos de 10 s a 74 dB (1 kHz)
+    alto = seno(1000, 10.0, math.sqrt(2) * 10 ** ((94 - 120) / 20))
+    bajo = seno(1000, 10.0, math.sqrt(2) * 10 ** ((74 - 120) / 20))
+    datos = medir(np.concatenate((alto, bajo)))
+    assert datos['laeq'] == pytest.approx(10 * math.log10((10 ** 9.4 + 10 ** 7.4) / 2), abs=0.1)
+    assert datos['lamax'] == pytest.approx(94.0, abs=0.1)
+    assert datos['lamin'] == pytest.approx(74.0, abs=0.1)
+    assert datos['la10'] == pytest.approx(94.0, abs=0.2)
+    assert datos['la90'] == pytest.approx(74.0, abs=0.2)
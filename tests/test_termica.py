@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+import pytest
+
+import main
+
+
+def crudo(ruta, n, alto, ancho):
+    datos = np.arange(n * alto * ancho, dtype='<u2').reshape(n, alto, ancho)
+    datos.tofile(str(ruta))
+    return datos
+
+
+def test_resolucion_en_el_nombre(tmp_path):
+    ruta = tmp_path / 'pared_160x120.raw'
+    datos = crudo(ruta, 16, 120, 160)
+    fuente = main.FuenteTermicaArchivo(str(ruta))
+    assert fuente.cuadros.shape == (16, 120, 160)
+    assert np.array_equal(fuente.leer(), datos[0])
+    assert np.array_equal(fuente.leer(), datos[1])
+
+
+def test_resolucion_en_el_sidecar(tmp_path):
+    ruta = tmp_path / 'pared.bin'
+    crudo(ruta, 4, 240, 320)
+    (tmp_path / 'pared.bin.json').write_text(json.dumps({'ancho': 320, 'alto': 240}))
+    assert main.FuenteTermicaArchivo(str(ruta)).cuadros.shape == (4, 240, 320)
+
+
+@pytest.mark.parametrize('n, alto, ancho', [(16, 120, 160), (4, 240, 320), (4, 60, 80), (1, 480, 640)])
+def test_tamanio_ambiguo_se_rechaza(tmp_path, n, alto, ancho):
+    ruta = tmp_path / 'pared.raw'
+    crudo(ruta, n, alto, ancho)
+    with pytest.raises(ValueError, match='ambigua'):
+        main.FuenteTermicaArchivo(str(ruta))
+
+
+def test_tamanio_que_calza_con_una_sola_resolucion(tmp_path):
+    ruta = tmp_path / 'pared.raw'
+    crudo(ruta, 1, 512, 640)
+    assert main.FuenteTermicaArchivo(str(ruta)).cuadros.shape == (1, 512, 640)
+
+
+def test_cantidad_impar_de_bytes(tmp_path):
+    ruta = tmp_path / 'pared_80x60.raw'
+    ruta.write_bytes(b'\0' * (80 * 60 * 2 + 1))
+    with pytest.raises(ValueError, match='16 bits'):
+        main.FuenteTermicaArchivo(str(ruta))
+
+
+def test_tamanio_que_no_corresponde_al_nombre(tmp_path):
+    ruta = tmp_path / 'pared_80x60.raw'
+    crudo(ruta, 1, 120, 161)
+    with pytest.raises(ValueError, match='80x60'):
+        main.FuenteTermicaArchivo(str(ruta))